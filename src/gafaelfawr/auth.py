@@ -4,6 +4,7 @@ from __future__ import annotations
 
 import base64
 import json
+from collections.abc import Collection
 from typing import Optional
 
 from fastapi import HTTPException, status
@@ -125,7 +126,7 @@ def generate_challenge(
     context: RequestContext,
     auth_type: AuthType,
     exc: OAuthBearerError,
-    scopes: Optional[set[str]] = None,
+    scopes: Optional[Collection[str]] = None,
     *,
     error_in_headers: bool = True,
 ) -> HTTPException:
@@ -11,39 +11,237 @@ only intended for use via their service layer
 """
 
 import asyncio
+import hashlib
+import hmac
+import itertools
+import sys
+import time
 from abc import ABCMeta, abstractmethod
+from collections.abc import Awaitable, Callable, Hashable
+from contextlib import AbstractAsyncContextManager
+from dataclasses import dataclass, field, fields, is_dataclass
 from types import TracebackType
-from typing import Generic, Literal, TypeVar
+from typing import Any, Generic, Literal, TypeVar
 
-from cachetools import LRUCache, TTLCache
+from cachetools import Cache, LRUCache, TTLCache
+from pydantic import BaseModel
+from safir.datetime import current_datetime
 
 from .constants import (
     ID_CACHE_SIZE,
     LDAP_CACHE_LIFETIME,
     LDAP_CACHE_SIZE,
+    MISSING_TOKEN_CACHE_LIFETIME,
+    MISSING_TOKEN_CACHE_SIZE,
+    QUOTA_CACHE_SIZE,
     TOKEN_CACHE_SIZE,
+    TOKEN_DATA_CACHE_LIFETIME,
+    TOKEN_DATA_CACHE_SIZE,
+    USER_INFO_CACHE_SIZE,
 )
-from .models.token import Token, TokenData
+from .models.cache import CacheStatistics
+from .models.token import Quota, Token, TokenData, TokenUserInfo
 
+K = TypeVar("K")
 S = TypeVar("S")
+V = TypeVar("V")
 
-LRUTokenCache = LRUCache[tuple[str, ...], Token]
+LRUTokenCache = LRUCache[tuple[str, ...], TokenData]
 """Type for the underlying token cache."""
 
+LDAPGeneration = tuple[int | None, ...]
+"""Type for the combined generation of a user's LDAP cache entries."""
+
+_ldap_generations = itertools.count(1)
+"""Source of generation numbers for LDAP cache entries.
+
+Shared by all LDAP caches so that a generation number is never reused, even
+across caches or after a cache is cleared.
+"""
+
 __all__ = [
     "BaseCache",
+    "CacheMetrics",
     "IdCache",
     "InternalTokenCache",
     "PerUserCache",
     "LDAPCache",
+    "MissingTokenCache",
     "NotebookTokenCache",
+    "QuotaCache",
     "TokenCache",
+    "TokenDataCache",
+    "UserInfoCache",
     "UserLockManager",
 ]
 
 
+@dataclass(slots=True)
+class CacheMetrics:
+    """Counts of the activity of a cache.
+
+    Hits include stale hits, which are entries that were found but could not
+    be used, such as entries for expired tokens.
+    """
+
+    hits: int = 0
+    """Number of lookups that found an entry."""
+
+    misses: int = 0
+    """Number of lookups that did not find an entry."""
+
+    stale_hits: int = 0
+    """Number of lookups that found an entry that could not be used."""
+
+    evictions: int = 0
+    """Number of entries evicted to make room for new entries."""
+
+    expirations: int = 0
+    """Number of entries removed because they expired."""
+
+    lock_waits: int = 0
+    """Number of times a cache lock was already held when requested."""
+
+    lock_wait_time: float = 0.0
+    """Total time spent waiting for cache locks in seconds."""
+
+    def record_lookup(self, found: bool) -> None:
+        """Record the result of a cache lookup.
+
+        Parameters
+        ----------
+        found
+            Whether an entry was found.
+        """
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+
+class _MeteredLRUCache(LRUCache[K, V]):
+    """An LRU cache that counts evictions."""
+
+    def __init__(self, maxsize: int, metrics: CacheMetrics) -> None:
+        super().__init__(maxsize)
+        self._metrics = metrics
+
+    def popitem(self) -> tuple[K, V]:
+        item = super().popitem()
+        self._metrics.evictions += 1
+        return item
+
+
+class _MeteredTTLCache(TTLCache[K, V]):
+    """A TTL cache that counts evictions and expirations."""
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        metrics: CacheMetrics,
+        getsizeof: Callable[[V], int] | None = None,
+    ) -> None:
+        super().__init__(maxsize, ttl, getsizeof=getsizeof)
+        self._metrics = metrics
+
+    def expire(self, time: float | None = None) -> None:
+        # TTLCache.__len__ itself expires entries, so count the raw entries.
+        size = Cache.__len__(self)
+        super().expire(time)
+        self._metrics.expirations += size - Cache.__len__(self)
+
+    def popitem(self) -> tuple[K, V]:
+        item = super().popitem()
+        self._metrics.evictions += 1
+        return item
+
+
+def approximate_size(value: Any) -> int:
+    """Approximate the memory used by a cached value.
+
+    Follows the contents of lists, tuples, sets, dictionaries, pydantic
+    models, and dataclasses.  Objects shared with other values, such as
+    interned strings, are counted each time they are seen, so this
+    overestimates somewhat.
+
+    Parameters
+    ----------
+    value
+        Value to measure.
+
+    Returns
+    -------
+    int
+        Approximate size in bytes.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, BaseModel):
+        size += approximate_size(value.__dict__)
+    elif is_dataclass(value) and not isinstance(value, type):
+        for f in fields(value):
+            size += approximate_size(getattr(value, f.name))
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            size += approximate_size(key) + approximate_size(item)
+    elif isinstance(value, list | tuple | set | frozenset):
+        size += sum(approximate_size(v) for v in value)
+    return size
+
+
+def _evict(cache: Cache[K, V], match: Callable[[V], bool]) -> None:
+    """Evict all entries whose values match a predicate from a cache."""
+    for key in list(cache):
+        value = cache.get(key)
+        if value is not None and match(value):
+            del cache[key]
+
+
+async def _acquire(lock: asyncio.Lock, metrics: CacheMetrics) -> None:
+    """Acquire a lock, recording any wait in the cache metrics."""
+    if not lock.locked():
+        await lock.acquire()
+        return
+    start = time.perf_counter()
+    try:
+        await lock.acquire()
+    finally:
+        metrics.lock_waits += 1
+        metrics.lock_wait_time += time.perf_counter() - start
+
+
+class _MeteredLock:
+    """Async context manager for a cache lock that records waits."""
+
+    def __init__(self, lock: asyncio.Lock, metrics: CacheMetrics) -> None:
+        self._lock = lock
+        self._metrics = metrics
+
+    async def __aenter__(self) -> None:
+        await _acquire(self._lock, self._metrics)
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> Literal[False]:
+        self._lock.release()
+        return False
+
+
 class BaseCache(metaclass=ABCMeta):
-    """Base class for caches managed by a cache dependency."""
+    """Base class for caches managed by a cache dependency.
+
+    Each cache counts its activity in `metrics`, and derived classes keep
+    their entries in ``_cache``, which is used to report the size of the
+    cache by `statistics`.
+    """
+
+    def __init__(self) -> None:
+        self._cache: Cache[Any, Any]
+        self._max_memory: int | None = None
+        self.metrics = CacheMetrics()
 
     @abstractmethod
     async def clear(self) -> None:
@@ -52,6 +250,42 @@ class BaseCache(metaclass=ABCMeta):
         Used primarily for testing.
         """
 
+    def statistics(self, name: str) -> CacheStatistics:
+        """Report the statistics for the cache.
+
+        Parameters
+        ----------
+        name
+            Name of the cache to include in the statistics.
+
+        Returns
+        -------
+        CacheStatistics
+            Current size and cumulative activity of the cache.
+        """
+        if isinstance(self._cache, TTLCache):
+            self._cache.expire()
+        if self._max_memory:
+            max_size = None
+            memory = int(self._cache.currsize)
+        else:
+            max_size = int(self._cache.maxsize)
+            memory = None
+        return CacheStatistics(
+            name=name,
+            size=len(self._cache),
+            max_size=max_size,
+            memory=memory,
+            max_memory=self._max_memory,
+            hits=self.metrics.hits,
+            misses=self.metrics.misses,
+            stale_hits=self.metrics.stale_hits,
+            evictions=self.metrics.evictions,
+            expirations=self.metrics.expirations,
+            lock_waits=self.metrics.lock_waits,
+            lock_wait_seconds=self.metrics.lock_wait_time,
+        )
+
 
 class IdCache(BaseCache):
     """A cache of UIDs or GIDs.
@@ -66,6 +300,11 @@ class IdCache(BaseCache):
     `get` returns `None`, the caller should take the lock, call `get` again,
     and then allocate and `store` a token if `get` still returns `None`.
 
+    Parameters
+    ----------
+    size
+        Maximum number of IDs to cache.
+
     Notes
     -----
     When there's a cache miss for a UID or GID, the goal is to block the
@@ -75,8 +314,11 @@ class IdCache(BaseCache):
     can be answered from the cache.
     """
 
-    def __init__(self) -> None:
-        self._cache: LRUCache[str, int] = LRUCache(ID_CACHE_SIZE)
+    def __init__(self, *, size: int = ID_CACHE_SIZE) -> None:
+        super().__init__()
+        self._size = size
+        self._cache: LRUCache[str, int]
+        self._cache = _MeteredLRUCache(size, self.metrics)
         self._lock = asyncio.Lock()
 
     async def clear(self) -> None:
@@ -85,7 +327,7 @@ class IdCache(BaseCache):
         Used primarily for testing.
         """
         async with self._lock:
-            self._cache = LRUCache(ID_CACHE_SIZE)
+            self._cache = _MeteredLRUCache(self._size, self.metrics)
 
     def get(self, name: str) -> int | None:
         """Retrieve the UID or GID for a name, if available.
@@ -100,19 +342,21 @@ class IdCache(BaseCache):
         int or None
             UID or GID if the name is in the cache, else `None`.
         """
-        return self._cache.get(name)
+        id = self._cache.get(name)
+        self.metrics.record_lookup(id is not None)
+        return id
 
-    def lock(self) -> asyncio.Lock:
+    def lock(self) -> AbstractAsyncContextManager[None]:
         """Return the cache lock for use in a context manager.
 
         See `store` for how to use this method.
 
         Returns
         -------
-        asyncio.Lock
-            The lock for the cache.
+        contextlib.AbstractAsyncContextManager
+            Async context manager that will take the lock for the cache.
         """
-        return self._lock
+        return _MeteredLock(self._lock, self.metrics)
 
     def store(self, name: str, id: int) -> None:
         """Store the UID or GID for a user or group in the cache.
@@ -137,31 +381,416 @@ class IdCache(BaseCache):
         self._cache[name] = id
 
 
+class MissingTokenCache(BaseCache):
+    """A short-lived cache of token keys that were not found in Redis.
+
+    Clients that keep retrying with revoked, expired, or garbage tokens can
+    then be rejected without a Redis query.  Token keys are random, so a key
+    that was missing will not normally be created later.
+
+    Only keys that do not exist should be stored here.  Tokens whose key
+    exists but whose secret does not match must not be stored, or anyone
+    could deny service to a valid token by presenting its key with a bogus
+    secret.
+
+    Parameters
+    ----------
+    size
+        Maximum number of missing token keys to remember.
+    lifetime
+        How long to remember missing token keys in seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        size: int = MISSING_TOKEN_CACHE_SIZE,
+        lifetime: float = MISSING_TOKEN_CACHE_LIFETIME,
+    ) -> None:
+        super().__init__()
+        self._size = size
+        self._lifetime = lifetime
+        self._cache: TTLCache[str, bool]
+        self._cache = _MeteredTTLCache(size, lifetime, self.metrics)
+
+    async def clear(self) -> None:
+        """Invalidate the cache.
+
+        Used primarily for testing.
+        """
+        self._cache = _MeteredTTLCache(
+            self._size, self._lifetime, self.metrics
+        )
+
+    def is_missing(self, key: str) -> bool:
+        """Check whether a token key was recently not found in Redis.
+
+        Parameters
+        ----------
+        key
+            The key of the token.
+
+        Returns
+        -------
+        bool
+            `True` if the key was recently recorded as missing with `store`,
+            `False` otherwise.
+        """
+        missing = key in self._cache
+        self.metrics.record_lookup(missing)
+        return missing
+
+    def store(self, key: str) -> None:
+        """Record that a token key was not found in Redis.
+
+        Parameters
+        ----------
+        key
+            The key of the token.
+        """
+        self._cache[key] = True
+
+
+class QuotaCache(BaseCache):
+    """A cache of calculated quotas.
+
+    A user's quota depends only on which of their groups have quota grants in
+    the configuration, and most users share one of a small number of such
+    combinations.  This caches the calculated quota keyed by the set of
+    relevant group names.  The cache is created with the process context, so
+    it is discarded if the configuration changes.
+
+    Entries never become stale for a given configuration, so the caller can
+    calculate and `store` a quota on a cache miss without holding a lock.
+    Racing callers will calculate and store the same result.
+
+    Parameters
+    ----------
+    size
+        Maximum number of combinations of groups to cache.
+    """
+
+    def __init__(self, *, size: int = QUOTA_CACHE_SIZE) -> None:
+        super().__init__()
+        self._size = size
+        self._cache: LRUCache[frozenset[str], Quota]
+        self._cache = _MeteredLRUCache(size, self.metrics)
+
+    async def clear(self) -> None:
+        """Invalidate the cache.
+
+        Used primarily for testing.
+        """
+        self._cache = _MeteredLRUCache(self._size, self.metrics)
+
+    def get(self, groups: frozenset[str]) -> Quota | None:
+        """Retrieve the quota for a combination of groups, if available.
+
+        Parameters
+        ----------
+        groups
+            Names of the user's groups that have quota grants.
+
+        Returns
+        -------
+        Quota or None
+            A copy of the cached quota, or `None` if it is not in the cache.
+        """
+        quota = self._cache.get(groups)
+        self.metrics.record_lookup(quota is not None)
+        return quota.copy(deep=True) if quota else None
+
+    def store(self, groups: frozenset[str], quota: Quota) -> None:
+        """Store the quota for a combination of groups.
+
+        Parameters
+        ----------
+        groups
+            Names of the user's groups that have quota grants.
+        quota
+            Calculated quota for a user with those groups.
+        """
+        self._cache[groups] = quota.copy(deep=True)
+
+
+class TokenDataCache(BaseCache):
+    """A short-lived cache of verified token data.
+
+    This caches the result of retrieving and decrypting token data from
+    Redis so that repeated authentications with the same token within the
+    cache lifetime do not have to go to Redis.  Entries are keyed by the
+    token key and store a digest of the token secret, which must match the
+    secret of the presented token for the cached data to be returned.
+
+    The cache is process-global.  Changes made by this process must be
+    reflected by calling `invalidate`.  Changes made by other processes are
+    delivered by `~gafaelfawr.invalidation.CacheInvalidator` on a
+    best-effort basis, so the lifetime of this cache should be kept short.
+
+    Parameters
+    ----------
+    size
+        Maximum number of tokens whose data to cache.
+    lifetime
+        Lifetime of cached token data in seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        size: int = TOKEN_DATA_CACHE_SIZE,
+        lifetime: float = TOKEN_DATA_CACHE_LIFETIME,
+    ) -> None:
+        super().__init__()
+        self._size = size
+        self._lifetime = lifetime
+        self._cache: TTLCache[str, tuple[bytes, TokenData]]
+        self._cache = _MeteredTTLCache(size, lifetime, self.metrics)
+
+    async def clear(self) -> None:
+        """Invalidate the cache.
+
+        Used primarily for testing.
+        """
+        self._cache = _MeteredTTLCache(
+            self._size, self._lifetime, self.metrics
+        )
+
+    def get(self, token: Token) -> TokenData | None:
+        """Retrieve the data for a token, if available.
+
+        Parameters
+        ----------
+        token
+            The token presented for authentication.
+
+        Returns
+        -------
+        TokenData or None
+            A copy of the cached data for that token, or `None` if the token
+            is not in the cache or its secret does not match the cached
+            token.  Cached data for expired tokens is never returned.
+        """
+        entry = self._cache.get(token.key)
+        if not entry:
+            self.metrics.misses += 1
+            return None
+        digest, data = entry
+        if not hmac.compare_digest(digest, self._digest(token)):
+            self.metrics.misses += 1
+            return None
+        self.metrics.hits += 1
+        if data.expires and data.expires <= current_datetime():
+            self.metrics.stale_hits += 1
+            self._cache.pop(token.key, None)
+            return None
+        return data.copy()
+
+    def invalidate(self, key: str) -> None:
+        """Invalidate any cached data for a token.
+
+        Parameters
+        ----------
+        key
+            The key of the token.
+        """
+        self._cache.pop(key, None)
+
+    def invalidate_user(self, username: str) -> None:
+        """Invalidate the cached data for all tokens of a user.
+
+        Parameters
+        ----------
+        username
+            Owner of the tokens.
+        """
+        _evict(self._cache, lambda e: e[1].username == username)
+
+    def store(self, data: TokenData) -> None:
+        """Store the data for a token in the cache.
+
+        Parameters
+        ----------
+        data
+            The verified data for a token, which includes the token itself.
+        """
+        self._cache[data.token.key] = (self._digest(data.token), data.copy())
+
+    def _digest(self, token: Token) -> bytes:
+        """Compute the digest of a token secret used to verify cache hits."""
+        return hashlib.sha256(token.secret.encode()).digest()
+
+
+class UserInfoCache(BaseCache):
+    """A cache of assembled user information for tokens.
+
+    Assembling the user information for a token may require several LDAP
+    lookups and Firestore UID and GID lookups, plus a quota calculation.  The
+    individual lookups are already cached, but assembling the result from
+    them is repeated on every call.  This caches the final result keyed by
+    token key.
+
+    Each entry records the generations of the LDAP cache entries (see
+    `LDAPCache.generation`) that were current when it was built, and is only
+    returned if the caller presents the same generations.  Entries therefore
+    become stale as soon as the underlying LDAP data is refreshed, expires,
+    or is invalidated, and otherwise share the lifetime of the LDAP caches.
+
+    Parameters
+    ----------
+    size
+        Maximum number of tokens whose user information to cache.
+    lifetime
+        Lifetime of cached user information in seconds, which should match
+        the lifetime of the LDAP caches.
+    """
+
+    def __init__(
+        self,
+        *,
+        size: int = USER_INFO_CACHE_SIZE,
+        lifetime: float = LDAP_CACHE_LIFETIME,
+    ) -> None:
+        super().__init__()
+        self._size = size
+        self._lifetime = lifetime
+        self._cache: TTLCache[str, tuple[LDAPGeneration, TokenUserInfo]]
+        self._lock = asyncio.Lock()
+        self._initialize()
+
+    async def clear(self) -> None:
+        """Invalidate the cache.
+
+        Used primarily for testing.
+        """
+        async with self._lock:
+            self._initialize()
+
+    def get(
+        self, key: str, generation: LDAPGeneration
+    ) -> TokenUserInfo | None:
+        """Retrieve the user information for a token, if available.
+
+        Parameters
+        ----------
+        key
+            Key of the token.
+        generation
+            Current generations of the user's LDAP cache entries.
+
+        Returns
+        -------
+        TokenUserInfo or None
+            A copy of the cached user information, or `None` if there is no
+            cached information or it was built from different LDAP data.
+        """
+        entry = self._cache.get(key)
+        self.metrics.record_lookup(entry is not None)
+        if not entry:
+            return None
+        if entry[0] != generation:
+            self.metrics.stale_hits += 1
+            return None
+        return entry[1].copy(deep=True)
+
+    def invalidate(self, key: str) -> None:
+        """Invalidate any cached user information for a token.
+
+        Parameters
+        ----------
+        key
+            Key of the token.
+        """
+        self._cache.pop(key, None)
+
+    def invalidate_user(self, username: str) -> None:
+        """Invalidate the cached user information for all tokens of a user.
+
+        Parameters
+        ----------
+        username
+            Owner of the tokens.
+        """
+        _evict(self._cache, lambda e: e[1].username == username)
+
+    def store(
+        self, key: str, generation: LDAPGeneration, info: TokenUserInfo
+    ) -> None:
+        """Store the user information for a token.
+
+        Parameters
+        ----------
+        key
+            Key of the token.
+        generation
+            Generations of the user's LDAP cache entries used to build the
+            user information.
+        info
+            User information to store.
+        """
+        self._cache[key] = (generation, info.copy(deep=True))
+
+    def _initialize(self) -> None:
+        """Create the underlying cache."""
+        self._cache = _MeteredTTLCache(
+            self._size, self._lifetime, self.metrics
+        )
+
+
+@dataclass(slots=True)
+class _UserLock:
+    """A per-user lock and the number of tasks holding or waiting for it."""
+
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    """The per-user lock."""
+
+    users: int = 0
+    """Number of tasks holding or waiting for the lock."""
+
+
 class UserLockManager:
     """Helper class for managing per-user locks.
 
     This should only be created by `PerUserCache`.  It is returned by the
     `PerUserCache.lock` method and implements the async context manager
-    protocol.
+    protocol.  Entering the context manager registers the caller as a user of
+    the lock for that key, creating it if needed, and exiting it removes the
+    lock from the table again if no other task holds or waits for it.
 
     Parameters
     ----------
-    general_lock
-        Lock protecting the per-user locks.
-    user_lock
-        Per-user lock for a given user.
+    user_locks
+        Per-user locks of the cache, keyed by username or other lock key.
+    key
+        Key of the lock to take.
+    metrics
+        Metrics of the cache, used to record lock waits.
     """
 
     def __init__(
-        self, general_lock: asyncio.Lock, user_lock: asyncio.Lock
+        self,
+        user_locks: dict[Hashable, _UserLock],
+        key: Hashable,
+        metrics: CacheMetrics,
     ) -> None:
-        self._general_lock = general_lock
-        self._user_lock = user_lock
+        self._user_locks = user_locks
+        self._key = key
+        self._metrics = metrics
+        self._user_lock: _UserLock | None = None
 
     async def __aenter__(self) -> asyncio.Lock:
-        async with self._general_lock:
-            await self._user_lock.acquire()
-            return self._user_lock
+        user_lock = self._user_locks.get(self._key)
+        if not user_lock:
+            user_lock = _UserLock()
+            self._user_locks[self._key] = user_lock
+        user_lock.users += 1
+        try:
+            await _acquire(user_lock.lock, self._metrics)
+        except BaseException:
+            self._release(user_lock)
+            raise
+        self._user_lock = user_lock
+        return user_lock.lock
 
     async def __aexit__(
         self,
@@ -169,55 +798,60 @@ class UserLockManager:
         exc: Exception | None,
         tb: TracebackType | None,
     ) -> Literal[False]:
-        self._user_lock.release()
+        if self._user_lock:
+            self._user_lock.lock.release()
+            self._release(self._user_lock)
+            self._user_lock = None
         return False
 
+    def _release(self, user_lock: _UserLock) -> None:
+        """Stop using a lock and discard it if it is no longer used."""
+        user_lock.users -= 1
+        if user_lock.users == 0:
+            del self._user_locks[self._key]
+
 
 class PerUserCache(BaseCache):
     """Base class for a cache with per-user locking.
 
     Notes
     -----
-    There is a moderately complex locking structure at play here.  When
-    there's a cache miss for data for a specific user, the goal is to block
-    the expensive lookups or token creation for that user until the first
-    requester either looks up the data or creates a new token, either way
-    adding it to the cache.  Hopefully then subsequent requests that were
+    When there's a cache miss for data for a specific user, the goal is to
+    block the expensive lookups or token creation for that user until the
+    first requester either looks up the data or creates a new token, either
+    way adding it to the cache.  Hopefully then subsequent requests that were
     blocked on the lock can be answered from the cache.
 
-    There is therefore a dictionary of per-user locks, but since we don't know
-    the list of users in advance, we have to populate those locks on the fly.
-    It shouldn't be necessary to protect the dict of per-user locks with
-    another lock because we only need to worry about asyncio concurrency, but
-    since FastAPI does use a thread pool, err on the side of caution and use
-    the same locking strategy that would be used for multithreaded code.
-
-    Note that the per-user lock must be acquired before the general lock is
-    released, so the `lock` method cannot simply return the per-user lock.  To
-    see why, imagine that one code path retrieves the per-user lock in
-    preparation for acquiring it, and then another code path calls `clear`.
-    `clear` acquires the global lock and then deletes the per-user lock, but
-    the first caller still has a copy of the per-user lock and thinks it's
-    valid.  It may then take that per-user lock, but a third code path could
-    also try to lock the same user and get a new per-user lock from the
-    post-clearing cache.  Both the first and third code paths will think they
-    have a lock and may conflict.  `UserLockManager` is used to handle this.
+    There is therefore a table of per-user locks, but since we don't know the
+    list of users in advance, locks are created on the fly.  Each lock is
+    kept in the table only while some task holds or is waiting for it, so the
+    size of the table is bounded by the number of concurrent requests rather
+    than the number of users seen since startup.  Derived classes whose
+    entries are finer-grained than a user may lock their own cache keys
+    instead of usernames with `_lock_key`.
+
+    Since this code is only used from a single asyncio thread, looking up,
+    creating, and discarding locks never waits, so the table needs no lock
+    of its own and requests for different users never contend with each
+    other.  The cache is not thread-safe.
     """
 
     def __init__(self) -> None:
+        super().__init__()
         self._lock = asyncio.Lock()
-        self._user_locks: dict[str, asyncio.Lock] = {}
+        self._user_locks: dict[Hashable, _UserLock] = {}
 
     async def clear(self) -> None:
         """Invalidate the cache.
 
-        Used primarily for testing.  Calls the `initialize` method provided by
-        derivative classes, with proper locking, to reinitialize the cache.
+        Used primarily for testing.  Waits for any current holders of
+        per-user locks to finish and then calls the `initialize` method
+        provided by derivative classes to reinitialize the cache.
         """
         async with self._lock:
-            for user, lock in list(self._user_locks.items()):
-                async with lock:
-                    del self._user_locks[user]
+            for key in list(self._user_locks):
+                async with self._lock_key(key):
+                    pass
             self.initialize()
 
     @abstractmethod
@@ -245,27 +879,79 @@ class PerUserCache(BaseCache):
         UserLockManager
             Async context manager that will take the user lock.
         """
-        async with self._lock:
-            if username not in self._user_locks:
-                lock = asyncio.Lock()
-                self._user_locks[username] = lock
-            return UserLockManager(self._lock, self._user_locks[username])
+        return self._lock_key(username)
+
+    def _lock_key(self, key: Hashable) -> UserLockManager:
+        """Return the lock for an arbitrary lock key.
+
+        Parameters
+        ----------
+        key
+            Key of the lock to hold, such as a username or cache key.
+
+        Returns
+        -------
+        UserLockManager
+            Async context manager that will take the lock.
+        """
+        return UserLockManager(self._user_locks, key, self.metrics)
 
 
 class LDAPCache(PerUserCache, Generic[S]):
     """A cache of LDAP data.
 
+    Each stored entry is tagged with a generation number that is unique
+    across all LDAP caches in the process.  Other caches of data derived from
+    LDAP, such as `UserInfoCache`, can record the generations of the entries
+    they used and treat their own entries as stale once those entries have
+    been replaced, invalidated, or expired.
+
     Parameters
     ----------
     content
         The type of object being stored.
+    size
+        Maximum number of users to cache.  Ignored if ``memory`` is set.
+    lifetime
+        Lifetime of cached data in seconds.
+    memory
+        If set, limit the cache by the approximate memory used by its
+        entries in bytes, as measured by `approximate_size`, rather than by
+        the number of entries.
     """
 
-    def __init__(self, content: type[S]) -> None:
+    def __init__(
+        self,
+        content: type[S],
+        *,
+        size: int = LDAP_CACHE_SIZE,
+        lifetime: float = LDAP_CACHE_LIFETIME,
+        memory: int | None = None,
+    ) -> None:
         super().__init__()
-        self._cache: TTLCache[str, S]
+        self._size = size
+        self._lifetime = lifetime
+        self._max_memory = memory
+        self._cache: TTLCache[str, tuple[int, S]]
         self.initialize()
 
+    def generation(self, username: str) -> int | None:
+        """Return the generation of the cached data for a user.
+
+        Parameters
+        ----------
+        username
+            Username for which to retrieve the generation.
+
+        Returns
+        -------
+        int or None
+            The generation number of the cached data, or `None` if there is
+            no data in the cache.
+        """
+        entry = self._cache.get(username)
+        return entry[0] if entry else None
+
     def get(self, username: str) -> S | None:
         """Retrieve data from the cache.
 
@@ -279,11 +965,23 @@ class LDAPCache(PerUserCache, Generic[S]):
         Any or None
             The cached data or `None` if there is no data in the cache.
         """
-        return self._cache.get(username)
+        entry = self._cache.get(username)
+        self.metrics.record_lookup(entry is not None)
+        return entry[1] if entry else None
 
     def initialize(self) -> None:
         """Initialize the cache."""
-        self._cache = TTLCache(LDAP_CACHE_SIZE, LDAP_CACHE_LIFETIME)
+        if self._max_memory:
+            self._cache = _MeteredTTLCache(
+                self._max_memory,
+                self._lifetime,
+                self.metrics,
+                getsizeof=approximate_size,
+            )
+        else:
+            self._cache = _MeteredTTLCache(
+                self._size, self._lifetime, self.metrics
+            )
 
     def invalidate(self, username: str) -> None:
         """Invalidate any cached data for a user.
@@ -293,7 +991,10 @@ class LDAPCache(PerUserCache, Generic[S]):
         username
             Username for which to invalidate the cache.
         """
-        del self._cache[username]
+        try:
+            del self._cache[username]
+        except KeyError:
+            pass
 
     def store(self, username: str, data: S) -> None:
         """Store data in the cache.
@@ -307,20 +1008,155 @@ class LDAPCache(PerUserCache, Generic[S]):
         data
             Data to store.
         """
-        self._cache[username] = data
+        try:
+            self._cache[username] = (next(_ldap_generations), data)
+        except ValueError:
+            # The entry is larger than the memory limit of the whole cache,
+            # so it cannot be cached, but must not leave older data behind.
+            self._cache.pop(username, None)
 
 
 class TokenCache(PerUserCache):
-    """Base class for a cache of internal or notebook tokens."""
+    """Base class for a cache of internal or notebook tokens.
 
-    def __init__(self) -> None:
+    The cache stores the full data for each cached child token, so that the
+    caller can check whether the token is still usable without retrieving it
+    from Redis.  Since the cached data is not rechecked against Redis, changed
+    or revoked child tokens must be evicted with `invalidate`, which
+    `~gafaelfawr.invalidation.CacheInvalidator` does in all processes.
+
+    Cache entries are keyed by information about the parent token, so an
+    index from child token keys to cache keys is kept alongside the cache for
+    use by `invalidate`.  The index may contain stale entries, which only
+    cause unnecessary evictions, but never lacks an entry for a cached token.
+
+    Entries may also be replaced in the background ahead of their expiration
+    with ``refresh``.  At most one refresh per entry runs at a time.
+
+    Parameters
+    ----------
+    size
+        Maximum number of child tokens to cache.
+    """
+
+    def __init__(self, *, size: int = TOKEN_CACHE_SIZE) -> None:
         super().__init__()
+        self._size = size
         self._cache: LRUTokenCache
+        self._keys: dict[str, set[tuple[str, ...]]]
+        self._refreshes: dict[tuple[str, ...], asyncio.Task[None]] = {}
         self.initialize()
 
+    async def clear(self) -> None:
+        """Invalidate the cache.
+
+        Used primarily for testing.  Cancels any background refreshes before
+        reinitializing the cache.
+        """
+        refreshes = list(self._refreshes.values())
+        for task in refreshes:
+            task.cancel()
+        await asyncio.gather(*refreshes, return_exceptions=True)
+        await super().clear()
+
     def initialize(self) -> None:
         """Initialize the cache."""
-        self._cache = LRUCache(TOKEN_CACHE_SIZE)
+        self._cache = _MeteredLRUCache(self._size, self.metrics)
+        self._keys = {}
+
+    def invalidate(self, key: str) -> None:
+        """Invalidate any cache entries for a child token.
+
+        Parameters
+        ----------
+        key
+            Key of the child token that was changed or deleted.
+        """
+        for cache_key in self._keys.pop(key, set()):
+            self._cache.pop(cache_key, None)
+
+    def invalidate_user(self, username: str) -> None:
+        """Invalidate all cached child tokens of a user.
+
+        Entries for those tokens are left in the index, which is harmless.
+
+        Parameters
+        ----------
+        username
+            Owner of the child tokens.
+        """
+        _evict(self._cache, lambda d: d.username == username)
+
+    def _get(self, cache_key: tuple[str, ...]) -> TokenData | None:
+        """Retrieve the data for a child token from the cache.
+
+        Parameters
+        ----------
+        cache_key
+            Key of the cache entry.
+
+        Returns
+        -------
+        TokenData or None
+            A copy of the cached data, or `None` if there is no such entry.
+        """
+        data = self._cache.get(cache_key)
+        self.metrics.record_lookup(data is not None)
+        return data.copy() if data else None
+
+    def _refresh(
+        self,
+        cache_key: tuple[str, ...],
+        create: Callable[[], Awaitable[TokenData | None]],
+    ) -> None:
+        """Replace a cache entry in the background.
+
+        Does nothing if a refresh of the same entry is already running.
+
+        Parameters
+        ----------
+        cache_key
+            Key of the cache entry.
+        create
+            Called with the lock for the entry held to create the replacement
+            child token.  If it returns `None`, the entry is left unchanged.
+        """
+        if cache_key in self._refreshes:
+            return
+        task = asyncio.create_task(self._run_refresh(cache_key, create))
+        self._refreshes[cache_key] = task
+        task.add_done_callback(lambda _: self._refreshes.pop(cache_key, None))
+
+    async def _run_refresh(
+        self,
+        cache_key: tuple[str, ...],
+        create: Callable[[], Awaitable[TokenData | None]],
+    ) -> None:
+        """Create and store the replacement for a cache entry."""
+        async with self._lock_key(cache_key):
+            data = await create()
+            if data:
+                self._store(cache_key, data)
+
+    def _store(self, cache_key: tuple[str, ...], data: TokenData) -> None:
+        """Store the data for a child token in the cache.
+
+        Parameters
+        ----------
+        cache_key
+            Key of the cache entry.
+        data
+            Data for the child token.
+        """
+        self._cache[cache_key] = data.copy()
+        self._keys.setdefault(data.token.key, set()).add(cache_key)
+
+        # Entries for tokens that were replaced or evicted from the cache are
+        # not removed from the index, so rebuild it if it grows too large.
+        if len(self._keys) > 2 * self._size:
+            self._keys = {}
+            for key, cached in self._cache.items():
+                self._keys.setdefault(cached.token.key, set()).add(key)
 
 
 class InternalTokenCache(TokenCache):
@@ -328,7 +1164,7 @@ class InternalTokenCache(TokenCache):
 
     def get(
         self, token_data: TokenData, service: str, scopes: list[str]
-    ) -> Token | None:
+    ) -> TokenData | None:
         """Retrieve an internal token from the cache.
 
         Parameters
@@ -342,9 +1178,9 @@ class InternalTokenCache(TokenCache):
 
         Returns
         -------
-        Token or None
-            The cached token or `None` if there is no matching token in the
-            cache.
+        TokenData or None
+            The data for the cached token or `None` if there is no matching
+            token in the cache.
 
         Notes
         -----
@@ -352,15 +1188,62 @@ class InternalTokenCache(TokenCache):
         done by the caller, while holding the lock, and the token replaced in
         the cache if it is not valid.
         """
-        key = self._build_key(token_data, service, scopes)
-        return self._cache.get(key)
+        return self._get(self._build_key(token_data, service, scopes))
+
+    def lock_token(
+        self, token_data: TokenData, service: str, scopes: list[str]
+    ) -> UserLockManager:
+        """Return the lock for a specific internal token.
+
+        Requests for different internal tokens, even for the same user, can
+        then be handled concurrently, while identical requests wait for the
+        first one to finish.
+
+        Parameters
+        ----------
+        token_data
+            The authentication data for the parent token.
+        service
+            The service of the internal token.
+        scopes
+            The scopes the internal token should have.
+
+        Returns
+        -------
+        UserLockManager
+            Async context manager that will take the lock.
+        """
+        return self._lock_key(self._build_key(token_data, service, scopes))
+
+    def refresh(
+        self,
+        token_data: TokenData,
+        service: str,
+        scopes: list[str],
+        create: Callable[[], Awaitable[TokenData | None]],
+    ) -> None:
+        """Replace a cached internal token in the background.
+
+        Parameters
+        ----------
+        token_data
+            The authentication data for the parent token.
+        service
+            The service of the internal token.
+        scopes
+            The scopes the internal token should have.
+        create
+            Called with the lock for the token held to create its
+            replacement, returning `None` on failure.
+        """
+        self._refresh(self._build_key(token_data, service, scopes), create)
 
     def store(
         self,
         token_data: TokenData,
         service: str,
         scopes: list[str],
-        token: Token,
+        data: TokenData,
     ) -> None:
         """Store an internal token in the cache.
 
@@ -374,11 +1257,10 @@ class InternalTokenCache(TokenCache):
             The service of the internal token.
         scopes
             The scopes the internal token should have.
-        token
-            The token to cache.
+        data
+            The data for the token to cache.
         """
-        key = self._build_key(token_data, service, scopes)
-        self._cache[key] = token
+        self._store(self._build_key(token_data, service, scopes), data)
 
     def _build_key(
         self, token_data: TokenData, service: str, scopes: list[str]
@@ -407,7 +1289,7 @@ class InternalTokenCache(TokenCache):
 class NotebookTokenCache(TokenCache):
     """Cache for notebook tokens."""
 
-    def get(self, token_data: TokenData) -> Token | None:
+    def get(self, token_data: TokenData) -> TokenData | None:
         """Retrieve a notebook token from the cache.
 
         Parameters
@@ -417,9 +1299,9 @@ class NotebookTokenCache(TokenCache):
 
         Returns
         -------
-        Token or None
-            The cached token or `None` if there is no matching token in the
-            cache.
+        TokenData or None
+            The data for the cached token or `None` if there is no matching
+            token in the cache.
 
         Notes
         -----
@@ -427,10 +1309,41 @@ class NotebookTokenCache(TokenCache):
         done by the caller, while holding the lock, and the token replaced in
         the cache if it is not valid.
         """
-        key = self._build_key(token_data)
-        return self._cache.get(key)
+        return self._get(self._build_key(token_data))
+
+    def lock_token(self, token_data: TokenData) -> UserLockManager:
+        """Return the lock for the notebook token of a parent token.
 
-    def store(self, token_data: TokenData, token: Token) -> None:
+        Parameters
+        ----------
+        token_data
+            The authentication data for the parent token.
+
+        Returns
+        -------
+        UserLockManager
+            Async context manager that will take the lock.
+        """
+        return self._lock_key(self._build_key(token_data))
+
+    def refresh(
+        self,
+        token_data: TokenData,
+        create: Callable[[], Awaitable[TokenData | None]],
+    ) -> None:
+        """Replace a cached notebook token in the background.
+
+        Parameters
+        ----------
+        token_data
+            The authentication data for the parent token.
+        create
+            Called with the lock for the token held to create its
+            replacement, returning `None` on failure.
+        """
+        self._refresh(self._build_key(token_data), create)
+
+    def store(self, token_data: TokenData, data: TokenData) -> None:
         """Store a notebook token in the cache.
 
         Should only be called while holding the lock.
@@ -439,11 +1352,10 @@ class NotebookTokenCache(TokenCache):
         ----------
         token_data
             The authentication data for the parent token.
-        token
-            The token to cache.
+        data
+            The data for the token to cache.
         """
-        key = self._build_key(token_data)
-        self._cache[key] = token
+        self._store(self._build_key(token_data), data)
 
     def _build_key(self, token_data: TokenData) -> tuple[str, ...]:
         """Build the cache key for a notebook token.
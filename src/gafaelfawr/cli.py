@@ -193,6 +193,10 @@ async def init(config_path: Optional[Path]) -> None:
         logger.debug("Adding initial administrators")
         async with factory.session.begin():
             await admin_service.add_initial_admins(config.initial_admins)
+        token_service = factory.create_token_service()
+        logger.debug("Adding missing token ancestry")
+        async with factory.session.begin():
+            await token_service.add_missing_ancestors()
         if config.firestore:
             firestore = factory.create_firestore_storage()
             logger.debug("Initializing Firestore")
@@ -223,6 +227,8 @@ async def maintenance(config_path: Optional[Path]) -> None:
     async with Factory.standalone(config, engine, check_db=True) as factory:
         token_service = factory.create_token_service()
         async with factory.session.begin():
+            logger.info("Adding missing token ancestry")
+            await token_service.add_missing_ancestors()
             logger.info("Marking expired tokens in database")
             await token_service.expire_tokens()
             logger.info("Truncating token history")
@@ -24,12 +24,28 @@ from pydantic import AnyHttpUrl, IPvAnyNetwork, validator
 from safir.logging import LogLevel, Profile, configure_logging
 from safir.pydantic import CamelCaseModel, validate_exactly_one_of
 
-from .constants import SCOPE_REGEX, USERNAME_REGEX
+from .constants import (
+    AUTH_HISTORY_BUFFER_SIZE,
+    ID_CACHE_SIZE,
+    LDAP_CACHE_LIFETIME,
+    LDAP_CACHE_SIZE,
+    MISSING_TOKEN_CACHE_LIFETIME,
+    MISSING_TOKEN_CACHE_SIZE,
+    QUOTA_CACHE_SIZE,
+    SCOPE_REGEX,
+    TOKEN_CACHE_SIZE,
+    TOKEN_DATA_CACHE_LIFETIME,
+    TOKEN_DATA_CACHE_SIZE,
+    USER_INFO_CACHE_SIZE,
+    USERNAME_REGEX,
+)
 from .keypair import RSAKeyPair
 from .models.github import GitHubTeam
 from .models.token import Token
 
 __all__ = [
+    "CacheConfig",
+    "CacheSettings",
     "Config",
     "FirestoreConfig",
     "FirestoreSettings",
@@ -289,6 +305,53 @@ class QuotaSettings(CamelCaseModel):
     """Additional quota grants by group name."""
 
 
+class CacheSettings(CamelCaseModel):
+    """Sizes and lifetimes of the in-memory caches of each process."""
+
+    id_size: int = ID_CACHE_SIZE
+    """Maximum number of UIDs, and separately of GIDs, to cache."""
+
+    ldap_size: int = LDAP_CACHE_SIZE
+    """Maximum number of users in each LDAP cache."""
+
+    ldap_memory: Optional[int] = None
+    """Approximate maximum memory in bytes of each LDAP cache.
+
+    If set, the LDAP caches are limited by the approximate size of their
+    entries rather than by ``ldap_size``.
+    """
+
+    ldap_lifetime: int = LDAP_CACHE_LIFETIME
+    """Lifetime in seconds of cached LDAP data and user information."""
+
+    quota_size: int = QUOTA_CACHE_SIZE
+    """Maximum number of distinct combinations of quota groups to cache."""
+
+    token_size: int = TOKEN_CACHE_SIZE
+    """Maximum number of internal, and separately notebook, tokens to cache."""
+
+    token_data_size: int = TOKEN_DATA_CACHE_SIZE
+    """Maximum number of tokens whose verified data to cache."""
+
+    token_data_lifetime: int = TOKEN_DATA_CACHE_LIFETIME
+    """Lifetime in seconds of cached token data."""
+
+    missing_token_size: int = MISSING_TOKEN_CACHE_SIZE
+    """Maximum number of token keys not found in Redis to remember."""
+
+    missing_token_lifetime: int = MISSING_TOKEN_CACHE_LIFETIME
+    """Lifetime in seconds of remembered token keys not found in Redis."""
+
+    user_info_size: int = USER_INFO_CACHE_SIZE
+    """Maximum number of tokens whose assembled user information to cache."""
+
+    @validator("*")
+    def _valid_limit(cls, v: int | None) -> int | None:
+        if v is not None and v <= 0:
+            raise ValueError("must be greater than 0")
+        return v
+
+
 class Settings(CamelCaseModel):
     """pydantic model of Gafaelfawr configuration file.
 
@@ -335,6 +398,41 @@ class Settings(CamelCaseModel):
     token_lifetime_minutes: int = 1380  # 23 hours
     """Number of minutes into the future that a token should expire."""
 
+    token_refresh_threshold: Optional[float] = None
+    """Fraction of its lifetime after which to replace a cached child token.
+
+    If set, once this fraction of the lifetime of a cached notebook or
+    internal token has passed, a replacement is created in the background
+    while the cached token continues to be returned.  Must be less than 0.5,
+    since cached tokens are not reused after half their lifetime.
+    """
+
+    history_write_behind: bool = False
+    """Whether to queue token change history in Redis and write it in batches.
+
+    If set, changes to tokens are added to a Redis stream, and each
+    Gafaelfawr process writes queued changes to the database in the
+    background.  The history returned by the API may therefore lag by a
+    second or so.
+    """
+
+    redis_aes_gcm: bool = False
+    """Whether to store new data in Redis encrypted with AES-GCM.
+
+    Data in both the AES-GCM and the older Fernet formats is always accepted
+    when reading.  Only enable this once no Gafaelfawr processes that can
+    only read the Fernet format remain.
+    """
+
+    auth_history_buffer_size: int = AUTH_HISTORY_BUFFER_SIZE
+    """How many ``/auth`` authentication events to buffer in memory.
+
+    Successful authentications are recorded in the token authentication
+    history by a background task in each Gafaelfawr process.  Events that
+    arrive while the buffer is full are dropped.  Set to 0 to not record
+    authentication history.
+    """
+
     proxies: Optional[list[IPvAnyNetwork]]
     """Trusted proxy IP netblocks in front of Gafaelfawr.
 
@@ -386,12 +484,27 @@ class Settings(CamelCaseModel):
     group_mapping: dict[str, list[str]] = {}
     """Mappings of scopes to lists of groups that provide them."""
 
+    cache: CacheSettings = CacheSettings()
+    """Sizes and lifetimes of the in-memory caches."""
+
     @validator("initial_admins", each_item=True)
     def _validate_initial_admins(cls, v: str) -> str:
         if not re.match(USERNAME_REGEX, v):
             raise ValueError("invalid username")
         return v
 
+    @validator("token_refresh_threshold")
+    def _valid_token_refresh_threshold(cls, v: float | None) -> float | None:
+        if v is not None and not 0 < v < 0.5:
+            raise ValueError("must be greater than 0 and less than 0.5")
+        return v
+
+    @validator("auth_history_buffer_size")
+    def _valid_auth_history_buffer_size(cls, v: int) -> int:
+        if v < 0:
+            raise ValueError("must not be negative")
+        return v
+
     @validator("known_scopes")
     def _valid_known_scopes(cls, v: dict[str, str]) -> dict[str, str]:
         for scope in v.keys():
@@ -734,6 +847,48 @@ class Quota:
     """Additional quota grants by group name."""
 
 
+@dataclass(frozen=True, slots=True)
+class CacheConfig:
+    """Sizes and lifetimes of the in-memory caches of each process."""
+
+    id_size: int
+    """Maximum number of UIDs, and separately of GIDs, to cache."""
+
+    ldap_size: int
+    """Maximum number of users in each LDAP cache."""
+
+    ldap_memory: Optional[int]
+    """Approximate maximum memory in bytes of each LDAP cache.
+
+    If set, the LDAP caches are limited by the approximate size of their
+    entries rather than by ``ldap_size``.
+    """
+
+    ldap_lifetime: timedelta
+    """Lifetime of cached LDAP data and user information."""
+
+    quota_size: int
+    """Maximum number of distinct combinations of quota groups to cache."""
+
+    token_size: int
+    """Maximum number of internal, and separately notebook, tokens to cache."""
+
+    token_data_size: int
+    """Maximum number of tokens whose verified data to cache."""
+
+    token_data_lifetime: timedelta
+    """Lifetime of cached token data."""
+
+    missing_token_size: int
+    """Maximum number of token keys not found in Redis to remember."""
+
+    missing_token_lifetime: timedelta
+    """Lifetime of remembered token keys not found in Redis."""
+
+    user_info_size: int
+    """Maximum number of tokens whose assembled user information to cache."""
+
+
 @dataclass(frozen=True, slots=True)
 class Config:
     """Configuration for Gafaelfawr.
@@ -778,6 +933,36 @@ class Config:
     token_lifetime: timedelta
     """Maximum lifetime of session, notebook, and internal tokens."""
 
+    token_refresh_threshold: float | None
+    """Fraction of its lifetime after which to replace a cached child token.
+
+    If set, once this fraction of the lifetime of a cached notebook or
+    internal token has passed, a replacement is created in the background.
+    """
+
+    history_write_behind: bool
+    """Whether to queue token change history in Redis and write it in batches.
+
+    If set, changes to tokens are added to a Redis stream and written to the
+    database in the background by
+    `~gafaelfawr.services.history.TokenChangeHistoryWriter`.
+    """
+
+    redis_aes_gcm: bool
+    """Whether to store new data in Redis encrypted with AES-GCM.
+
+    If not set, new data is stored as Fernet tokens, which older versions of
+    Gafaelfawr can read.  Both formats are always accepted when reading.
+    """
+
+    auth_history_buffer_size: int
+    """How many ``/auth`` authentication events to buffer in memory.
+
+    Events are written to the database in the background by
+    `~gafaelfawr.services.auth_history.TokenAuthHistoryWriter`.  If 0,
+    authentication history is not recorded.
+    """
+
     proxies: tuple[_BaseNetwork, ...]
     """Trusted proxy IP netblocks in front of Gafaelfawr.
 
@@ -829,6 +1014,9 @@ class Config:
     group_mapping: Mapping[str, frozenset[str]]
     """Mapping of group names to the set of scopes that group grants."""
 
+    cache: CacheConfig
+    """Sizes and lifetimes of the in-memory caches."""
+
     @classmethod
     def from_file(cls, path: Path) -> Self:
         """Construct a Config object from a configuration file.
@@ -979,6 +1167,24 @@ class Config:
             k: frozenset(v) for k, v in group_mapping.items()
         }
 
+        # Build the cache configuration.
+        cache = settings.cache
+        cache_config = CacheConfig(
+            id_size=cache.id_size,
+            ldap_size=cache.ldap_size,
+            ldap_memory=cache.ldap_memory,
+            ldap_lifetime=timedelta(seconds=cache.ldap_lifetime),
+            quota_size=cache.quota_size,
+            token_size=cache.token_size,
+            token_data_size=cache.token_data_size,
+            token_data_lifetime=timedelta(seconds=cache.token_data_lifetime),
+            missing_token_size=cache.missing_token_size,
+            missing_token_lifetime=timedelta(
+                seconds=cache.missing_token_lifetime
+            ),
+            user_info_size=cache.user_info_size,
+        )
+
         # Build the top-level configuration.
         session_secret = cls._load_secret(settings.session_secret_file)
         bootstrap_token = None
@@ -1008,6 +1214,10 @@ class Config:
             database_password=database_password,
             bootstrap_token=bootstrap_token,
             token_lifetime=timedelta(minutes=settings.token_lifetime_minutes),
+            token_refresh_threshold=settings.token_refresh_threshold,
+            history_write_behind=settings.history_write_behind,
+            redis_aes_gcm=settings.redis_aes_gcm,
+            auth_history_buffer_size=settings.auth_history_buffer_size,
             proxies=tuple(settings.proxies if settings.proxies else []),
             after_logout_url=str(settings.after_logout_url),
             error_footer=settings.error_footer,
@@ -1022,6 +1232,7 @@ class Config:
             initial_admins=tuple(settings.initial_admins),
             known_scopes=settings.known_scopes or {},
             group_mapping=group_mapping_frozen,
+            cache=cache_config,
         )
 
     def configure_logging(self) -> None:
@@ -5,7 +5,16 @@ from datetime import timedelta
 __all__ = [
     "ACTOR_REGEX",
     "ALGORITHM",
+    "AUTH_CONFIG_CACHE_SIZE",
+    "AUTH_HISTORY_BATCH_SIZE",
+    "AUTH_HISTORY_BUFFER_SIZE",
+    "AUTH_HISTORY_FLUSH_INTERVAL",
+    "AUTH_HISTORY_RETENTION",
+    "AUTH_HISTORY_SCOPES_LENGTH",
+    "AUTH_HISTORY_SERVICE_LENGTH",
     "BOT_USERNAME_REGEX",
+    "CACHE_INVALIDATION_CHANNEL",
+    "CACHE_INVALIDATION_RETRY",
     "CHANGE_HISTORY_RETENTION",
     "CONFIG_PATH",
     "COOKIE_NAME",
@@ -13,6 +22,8 @@ __all__ = [
     "GID_MIN",
     "GID_MAX",
     "GROUPNAME_REGEX",
+    "HISTORY_BATCH_SIZE",
+    "HISTORY_FLUSH_INTERVAL",
     "HTTP_TIMEOUT",
     "ID_CACHE_SIZE",
     "KUBERNETES_TIMER_DELAY",
@@ -21,14 +32,26 @@ __all__ = [
     "LDAP_CACHE_LIFETIME",
     "LDAP_TIMEOUT",
     "MINIMUM_LIFETIME",
+    "MISSING_TOKEN_CACHE_LIFETIME",
+    "MISSING_TOKEN_CACHE_SIZE",
     "NGINX_SNIPPET",
     "OIDC_AUTHORIZATION_LIFETIME",
+    "QUOTA_CACHE_SIZE",
+    "REDIS_BATCH_SIZE",
     "SCOPE_REGEX",
+    "STATE_CACHE_SIZE",
     "TOKEN_CACHE_SIZE",
+    "TOKEN_CHANGE_HISTORY_STREAM",
+    "TOKEN_DATA_CACHE_LIFETIME",
+    "TOKEN_DATA_CACHE_SIZE",
+    "TOKEN_DELETE_BATCH_SIZE",
+    "TOKEN_USAGE_BATCH_SIZE",
+    "TOKEN_USAGE_FLUSH_INTERVAL",
     "UID_BOT_MIN",
     "UID_BOT_MAX",
     "UID_USER_MIN",
     "USERNAME_REGEX",
+    "USER_INFO_CACHE_SIZE",
 ]
 
 ALGORITHM = "RS256"
@@ -80,6 +103,9 @@ LDAP_TIMEOUT = 5.0
 CHANGE_HISTORY_RETENTION = timedelta(days=365)
 """Retention of old token change history entries."""
 
+AUTH_HISTORY_RETENTION = timedelta(days=90)
+"""Retention of old token authentication history entries."""
+
 MINIMUM_LIFETIME = timedelta(minutes=5)
 """Minimum expiration lifetime for a token."""
 
@@ -94,20 +120,108 @@ error_page 403 = @autherror;
 OIDC_AUTHORIZATION_LIFETIME = 60 * 60
 """How long (in seconds) an authorization code is good for."""
 
+CACHE_INVALIDATION_CHANNEL = "gafaelfawr:invalidate"
+"""Redis pub/sub channel used to send cache invalidation events."""
+
+CACHE_INVALIDATION_RETRY = 5.0
+"""How long (in seconds) to wait before resubscribing to invalidations."""
+
+REDIS_BATCH_SIZE = 1000
+"""Maximum number of keys to send to Redis in a single bulk operation."""
+
+TOKEN_DELETE_BATCH_SIZE = 1000
+"""Maximum number of tokens to delete from the database in one statement."""
+
+TOKEN_CHANGE_HISTORY_STREAM = "history:token-change"
+"""Redis stream holding token change history not yet written to the database.
+
+Only used if write-behind of history is enabled.
+"""
+
+HISTORY_BATCH_SIZE = 1000
+"""Maximum number of queued history entries to write in one transaction."""
+
+HISTORY_FLUSH_INTERVAL = 1.0
+"""How long (in seconds) to wait between writes of queued history entries."""
+
+TOKEN_USAGE_BATCH_SIZE = 1000
+"""Maximum number of token last-used times to update in one statement."""
+
+TOKEN_USAGE_FLUSH_INTERVAL = 60.0
+"""How long (in seconds) to wait between writes of token last-used times.
+
+Last-used times are recorded with minute granularity, so writing them more
+often than this would rarely record anything new.
+"""
+
+AUTH_HISTORY_BATCH_SIZE = 1000
+"""Maximum number of authentication history entries to insert at once."""
+
+AUTH_HISTORY_BUFFER_SIZE = 10000
+"""Default number of authentication events to buffer in memory.
+
+Events that arrive while the buffer is full are dropped rather than delaying
+authentication.
+"""
+
+AUTH_HISTORY_FLUSH_INTERVAL = 5.0
+"""How long (in seconds) to wait between writes of authentication history."""
+
+AUTH_HISTORY_SCOPES_LENGTH = 512
+"""Maximum length of the comma-separated scopes of an authentication."""
+
+AUTH_HISTORY_SERVICE_LENGTH = 64
+"""Maximum length of the service recorded for an authentication."""
+
 # The following constants define per-process cache sizes.
 
+AUTH_CONFIG_CACHE_SIZE = 1000
+"""How many parsed ``/auth`` query strings to cache in memory."""
+
 ID_CACHE_SIZE = 10000
 """How many UID or GID values to cache in memory."""
 
 TOKEN_CACHE_SIZE = 5000
 """How many internal or notebook tokens to cache in memory."""
 
+TOKEN_DATA_CACHE_SIZE = 10000
+"""How many verified token data entries to cache in memory."""
+
+TOKEN_DATA_CACHE_LIFETIME = 30
+"""Lifetime of the token data cache in seconds.
+
+This bounds how long a token revoked or modified by another Gafaelfawr
+process may continue to be accepted by this process.
+"""
+
+MISSING_TOKEN_CACHE_SIZE = 10000
+"""How many token keys not found in Redis to remember in memory."""
+
+MISSING_TOKEN_CACHE_LIFETIME = 30
+"""How long (in seconds) to remember token keys not found in Redis."""
+
+QUOTA_CACHE_SIZE = 1000
+"""How many calculated quotas, one per combination of quota groups, to cache.
+
+Many users share the same combination of groups with quota grants, so this
+can be much smaller than the number of users.
+"""
+
+STATE_CACHE_SIZE = 10000
+"""How many decrypted state cookies to cache in memory."""
+
 LDAP_CACHE_SIZE = 1000
 """Maximum numbr of entries in LDAP caches."""
 
 LDAP_CACHE_LIFETIME = 5 * 60
 """Lifetime of the LDAP caches in seconds."""
 
+USER_INFO_CACHE_SIZE = 5000
+"""How many assembled user information results to cache in memory.
+
+Entries share the lifetime of the LDAP caches.
+"""
+
 # The following constants define the limits of UID and GID ranges when
 # Gafaelfawr is doing UID and GID assignment.
 
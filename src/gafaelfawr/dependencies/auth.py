@@ -130,7 +130,7 @@ class Authenticate:
                 return bootstrap_data
 
         token_service = context.factory.create_token_service()
-        data = await token_service.get_data(token)
+        data = await token_service.get_data_cached(token)
         if not data:
             if context.state.token:
                 raise self._redirect_or_error(context)
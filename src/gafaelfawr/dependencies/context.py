@@ -6,18 +6,21 @@ convenience of writing request handlers.  It also provides a place to store a
 including from dependencies.
 """
 
+from collections.abc import AsyncIterator
 from dataclasses import dataclass
 from typing import Any, Optional
 
+import structlog
 from fastapi import Depends, HTTPException, Request
-from safir.dependencies.db_session import db_session_dependency
+from safir.database import create_async_session, create_database_engine
 from safir.dependencies.logger import logger_dependency
-from sqlalchemy.ext.asyncio import async_scoped_session
+from sqlalchemy.ext.asyncio import AsyncEngine, async_scoped_session
 from structlog.stdlib import BoundLogger
 
 from ..config import Config
 from ..factory import Factory, ProcessContext
 from ..models.state import State
+from ..services.background import BackgroundWriter
 
 __all__ = ["RequestContext", "context_dependency"]
 
@@ -79,20 +82,29 @@ class ContextDependency:
     the context that are shared by all requests are collected into the single
     process-global `~gafaelfawr.factory.ProcessContext` and reused with each
     request.
+
+    The database session is also managed here rather than by a separate
+    dependency.  Most requests, including nearly all ``/auth`` requests, only
+    use Redis, so the per-request database session is only created when it is
+    first used through the `~gafaelfawr.factory.Factory` and is only torn
+    down at the end of the request if it was created.
     """
 
     def __init__(self) -> None:
         self._config: Optional[Config] = None
         self._process_context: Optional[ProcessContext] = None
+        self._engine: Optional[AsyncEngine] = None
+        self._override_engine: Optional[AsyncEngine] = None
+        self._session: Optional[async_scoped_session] = None
+        self._writers: list[BackgroundWriter] = []
 
     async def __call__(
         self,
         request: Request,
-        session: async_scoped_session = Depends(db_session_dependency),
         logger: BoundLogger = Depends(logger_dependency),
-    ) -> RequestContext:
-        """Creates a per-request context and returns it."""
-        if not self._config or not self._process_context:
+    ) -> AsyncIterator[RequestContext]:
+        """Creates a per-request context and yields it."""
+        if not self._config or not self._process_context or not self._session:
             raise RuntimeError("ContextDependency not initialized")
         if request.client and request.client.host:
             ip_address = request.client.host
@@ -104,14 +116,21 @@ class ContextDependency:
                     "type": "missing_client_ip",
                 },
             )
-        return RequestContext(
-            request=request,
-            ip_address=ip_address,
-            config=self._config,
-            logger=logger,
-            session=session,
-            factory=Factory(self._process_context, session, logger),
-        )
+        session = self._session
+        try:
+            yield RequestContext(
+                request=request,
+                ip_address=ip_address,
+                config=self._config,
+                logger=logger,
+                session=session,
+                factory=Factory(self._process_context, session, logger),
+            )
+        finally:
+            # The scoped session only materializes an underlying session for
+            # this task if something used it, so skip the teardown otherwise.
+            if session.registry.has():
+                await session.remove()
 
     @property
     def process_context(self) -> ProcessContext:
@@ -123,22 +142,74 @@ class ContextDependency:
     async def initialize(self, config: Config) -> None:
         """Initialize the process-wide shared context.
 
+        The database engine and scoped session are created the first time
+        this is called and are reused if it is called again to change the
+        configuration.  This also starts the background writers of token
+        last-used times, of authentication history if it is recorded, and of
+        queued token change history if write-behind is enabled.
+
         Parameters
         ----------
         config
             Gafaelfawr configuration.
         """
+        await self._stop_writers()
         if self._process_context:
             await self._process_context.aclose()
         self._config = config
         self._process_context = await ProcessContext.from_config(config)
+        if not self._session:
+            if self._override_engine:
+                engine = self._override_engine
+            else:
+                self._engine = create_database_engine(
+                    config.database_url, config.database_password
+                )
+                engine = self._engine
+            self._session = await create_async_session(engine)
+        logger = structlog.get_logger("gafaelfawr")
+        factory = Factory(self._process_context, self._session, logger)
+        self._writers.append(factory.create_token_usage_writer())
+
+        # The history writer is started even if write-behind is disabled so
+        # that entries queued while it was enabled are still written.
+        self._writers.append(factory.create_token_change_history_writer())
+        if config.auth_history_buffer_size:
+            auth_writer = factory.create_token_auth_history_writer()
+            self._writers.append(auth_writer)
+        for writer in self._writers:
+            await writer.start()
 
     async def aclose(self) -> None:
         """Clean up the per-process configuration."""
+        await self._stop_writers()
         if self._process_context:
             await self._process_context.aclose()
+        if self._engine:
+            await self._engine.dispose()
         self._config = None
         self._process_context = None
+        self._engine = None
+        self._session = None
+
+    async def _stop_writers(self) -> None:
+        """Stop the background writers, writing any buffered data."""
+        for writer in self._writers:
+            await writer.aclose()
+        self._writers = []
+
+    def override_engine(self, engine: AsyncEngine) -> None:
+        """Force the dependency to use the provided database engine.
+
+        Intended for testing, this allows the test suite to configure a single
+        database engine and share it across all of the tests.
+
+        Parameters
+        ----------
+        engine
+            Database engine to use for all sessions.
+        """
+        self._override_engine = engine
 
 
 context_dependency = ContextDependency()
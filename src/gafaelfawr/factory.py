@@ -4,7 +4,7 @@ from __future__ import annotations
 
 from collections.abc import AsyncIterator
 from contextlib import aclosing, asynccontextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from typing import Self
 
 import redis.asyncio as redis
@@ -20,9 +20,20 @@ from sqlalchemy.ext.asyncio import AsyncEngine, async_scoped_session
 from sqlalchemy.future import select
 from structlog.stdlib import BoundLogger
 
-from .cache import IdCache, InternalTokenCache, LDAPCache, NotebookTokenCache
+from .cache import (
+    BaseCache,
+    IdCache,
+    InternalTokenCache,
+    LDAPCache,
+    MissingTokenCache,
+    NotebookTokenCache,
+    QuotaCache,
+    TokenDataCache,
+    UserInfoCache,
+)
 from .config import Config
 from .exceptions import NotConfiguredError
+from .invalidation import CacheInvalidator
 from .models.ldap import LDAPUserData
 from .models.oidc import OIDCAuthorization
 from .models.token import TokenData, TokenGroup
@@ -31,7 +42,13 @@ from .providers.github import GitHubProvider
 from .providers.oidc import OIDCProvider, OIDCTokenVerifier
 from .schema import Admin as SQLAdmin
 from .services.admin import AdminService
+from .services.auth_history import (
+    TokenAuthHistoryBuffer,
+    TokenAuthHistoryWriter,
+)
+from .services.cache import CacheService
 from .services.firestore import FirestoreService
+from .services.history import TokenChangeHistoryWriter
 from .services.kubernetes import (
     KubernetesIngressService,
     KubernetesTokenService,
@@ -40,19 +57,30 @@ from .services.ldap import LDAPService
 from .services.oidc import OIDCService
 from .services.token import TokenService
 from .services.token_cache import TokenCacheService
+from .services.token_usage import TokenUsageTracker, TokenUsageWriter
 from .services.userinfo import OIDCUserInfoService, UserInfoService
 from .storage.admin import AdminStore
-from .storage.base import RedisStorage
+from .storage.base import RedisStorage, RedisStringStorage
 from .storage.firestore import FirestoreStorage
 from .storage.forgerock import ForgeRockStorage
-from .storage.history import AdminHistoryStore, TokenChangeHistoryStore
+from .storage.history import (
+    AdminHistoryStore,
+    HistoryCheckpointStore,
+    TokenAuthHistoryStore,
+    TokenChangeHistoryQueue,
+    TokenChangeHistoryStore,
+)
 from .storage.kubernetes import (
     KubernetesIngressStorage,
     KubernetesTokenStorage,
 )
 from .storage.ldap import LDAPStorage
 from .storage.oidc import OIDCAuthorizationStore
-from .storage.token import TokenDatabaseStore, TokenRedisStore
+from .storage.token import (
+    ChildTokenRedisStore,
+    TokenDatabaseStore,
+    TokenRedisStore,
+)
 
 __all__ = ["Factory", "ProcessContext"]
 
@@ -64,8 +92,9 @@ class ProcessContext:
     This object caches all of the per-process singletons that can be reused
     for every request and only need to be recreated if the application
     configuration changes.  This does not include the database session; each
-    request creates a new scoped session that's removed at the end of the
-    session to ensure that all transactions are committed or abandoned.
+    request uses a scoped session that's created on first use and removed at
+    the end of the request to ensure that all transactions are committed or
+    abandoned.
     """
 
     config: Config
@@ -101,6 +130,27 @@ class ProcessContext:
     notebook_token_cache: NotebookTokenCache
     """Shared notebook token cache."""
 
+    token_data_cache: TokenDataCache
+    """Shared cache of verified token data."""
+
+    missing_token_cache: MissingTokenCache
+    """Shared cache of token keys not found in Redis."""
+
+    quota_cache: QuotaCache
+    """Shared cache of calculated quotas by quota group membership."""
+
+    user_info_cache: UserInfoCache
+    """Shared cache of assembled user information for tokens."""
+
+    cache_invalidator: CacheInvalidator
+    """Publisher and listener for cross-process cache invalidation."""
+
+    token_usage_tracker: TokenUsageTracker
+    """Last-used times of tokens not yet written to the database."""
+
+    token_auth_history_buffer: TokenAuthHistoryBuffer | None
+    """Authentication history not yet written, if it is being recorded."""
+
     @classmethod
     async def from_config(cls, config: Config) -> Self:
         """Create a new process context from the Gafaelfawr configuration.
@@ -126,32 +176,121 @@ class ProcessContext:
                 )
             ldap_pool = AIOConnectionPool(client)
 
-        return cls(
+        redis_client = redis.from_url(
+            config.redis_url, password=config.redis_password
+        )
+        cache = config.cache
+        ldap_lifetime = cache.ldap_lifetime.total_seconds()
+        ldap_group_cache = LDAPCache(
+            list[TokenGroup],
+            size=cache.ldap_size,
+            lifetime=ldap_lifetime,
+            memory=cache.ldap_memory,
+        )
+        ldap_group_name_cache = LDAPCache(
+            list[str],
+            size=cache.ldap_size,
+            lifetime=ldap_lifetime,
+            memory=cache.ldap_memory,
+        )
+        ldap_user_cache = LDAPCache(
+            LDAPUserData,
+            size=cache.ldap_size,
+            lifetime=ldap_lifetime,
+            memory=cache.ldap_memory,
+        )
+        internal_token_cache = InternalTokenCache(size=cache.token_size)
+        notebook_token_cache = NotebookTokenCache(size=cache.token_size)
+        token_data_cache = TokenDataCache(
+            size=cache.token_data_size,
+            lifetime=cache.token_data_lifetime.total_seconds(),
+        )
+        user_info_cache = UserInfoCache(
+            size=cache.user_info_size, lifetime=ldap_lifetime
+        )
+        quota_cache = QuotaCache(size=cache.quota_size)
+        missing_token_cache = MissingTokenCache(
+            size=cache.missing_token_size,
+            lifetime=cache.missing_token_lifetime.total_seconds(),
+        )
+        cache_invalidator = CacheInvalidator(
+            redis=redis_client,
+            token_data_cache=token_data_cache,
+            token_caches=(internal_token_cache, notebook_token_cache),
+            ldap_caches=(
+                ldap_group_cache,
+                ldap_group_name_cache,
+                ldap_user_cache,
+            ),
+            user_info_cache=user_info_cache,
+            quota_cache=quota_cache,
+            missing_token_cache=missing_token_cache,
+            logger=structlog.get_logger("gafaelfawr"),
+        )
+        await cache_invalidator.start()
+        token_auth_history_buffer = None
+        if config.auth_history_buffer_size:
+            token_auth_history_buffer = TokenAuthHistoryBuffer(
+                config.auth_history_buffer_size
+            )
+
+        context = cls(
             config=config,
             http_client=await http_client_dependency(),
             ldap_pool=ldap_pool,
-            redis=redis.from_url(
-                config.redis_url, password=config.redis_password
-            ),
-            uid_cache=IdCache(),
-            gid_cache=IdCache(),
-            ldap_group_cache=LDAPCache(list[TokenGroup]),
-            ldap_group_name_cache=LDAPCache(list[str]),
-            ldap_user_cache=LDAPCache(LDAPUserData),
-            internal_token_cache=InternalTokenCache(),
-            notebook_token_cache=NotebookTokenCache(),
+            redis=redis_client,
+            uid_cache=IdCache(size=cache.id_size),
+            gid_cache=IdCache(size=cache.id_size),
+            ldap_group_cache=ldap_group_cache,
+            ldap_group_name_cache=ldap_group_name_cache,
+            ldap_user_cache=ldap_user_cache,
+            internal_token_cache=internal_token_cache,
+            notebook_token_cache=notebook_token_cache,
+            token_data_cache=token_data_cache,
+            missing_token_cache=missing_token_cache,
+            quota_cache=quota_cache,
+            user_info_cache=user_info_cache,
+            cache_invalidator=cache_invalidator,
+            token_usage_tracker=TokenUsageTracker(),
+            token_auth_history_buffer=token_auth_history_buffer,
         )
 
+        # Report the effective cache limits, since they may have been
+        # changed from the defaults and are otherwise not visible.
+        logger = structlog.get_logger("gafaelfawr")
+        limits = {}
+        for name, process_cache in context.caches().items():
+            stats = process_cache.statistics(name)
+            limits[name] = stats.max_size or f"{stats.max_memory} bytes"
+        logger.info("Configured in-memory caches", limits=limits)
+        return context
+
+    def caches(self) -> dict[str, BaseCache]:
+        """Return all of the in-memory caches of the process.
+
+        Returns
+        -------
+        dict of BaseCache
+            Mapping of cache names, which are the attribute names without any
+            ``_cache`` suffix, to caches.
+        """
+        return {
+            f.name.removesuffix("_cache"): getattr(self, f.name)
+            for f in fields(self)
+            if isinstance(getattr(self, f.name), BaseCache)
+        }
+
     async def aclose(self) -> None:
         """Clean up a process context.
 
         Called during shutdown, or before recreating the process context using
         a different configuration.
         """
-        await self.redis.close()
-        await self.redis.connection_pool.disconnect()
-        if self.ldap_pool:
-            await self.ldap_pool.close()
+        await self.cache_invalidator.aclose()
+
+        # Clearing the caches cancels any background refreshes of cached
+        # tokens, which must happen before the connections they use are
+        # closed.
         await self.uid_cache.clear()
         await self.gid_cache.clear()
         await self.ldap_group_cache.clear()
@@ -159,6 +298,15 @@ class ProcessContext:
         await self.ldap_user_cache.clear()
         await self.internal_token_cache.clear()
         await self.notebook_token_cache.clear()
+        await self.token_data_cache.clear()
+        await self.missing_token_cache.clear()
+        await self.quota_cache.clear()
+        await self.user_info_cache.clear()
+
+        await self.redis.close()
+        await self.redis.connection_pool.disconnect()
+        if self.ldap_pool:
+            await self.ldap_pool.close()
 
 
 class Factory:
@@ -172,7 +320,8 @@ class Factory:
     context
         Shared process context.
     session
-        Database session.
+        Database session.  This is a scoped session proxy, so the underlying
+        session is only created if a component actually uses it.
     logger
         Logger to use for errors.
     """
@@ -273,6 +422,15 @@ class Factory:
         """Underlying Redis connection pool, mainly for tests."""
         return self._context.redis
 
+    @property
+    def token_auth_history_buffer(self) -> TokenAuthHistoryBuffer | None:
+        """Buffer of authentications to record, if they are recorded.
+
+        This is used directly rather than through a service so that
+        recording an authentication does not require creating any objects.
+        """
+        return self._context.token_auth_history_buffer
+
     async def aclose(self) -> None:
         """Shut down the factory.
 
@@ -296,6 +454,20 @@ class Factory:
         admin_history_store = AdminHistoryStore(self.session)
         return AdminService(admin_store, admin_history_store, self._logger)
 
+    def create_cache_service(self) -> CacheService:
+        """Create a service for reporting on and managing the caches.
+
+        Returns
+        -------
+        CacheService
+            Newly-created cache service.
+        """
+        return CacheService(
+            caches=self._context.caches(),
+            cache_invalidator=self._context.cache_invalidator,
+            logger=self._logger,
+        )
+
     def create_firestore_service(self) -> FirestoreService:
         """Create the Firestore service layer.
 
@@ -380,7 +552,12 @@ class Factory:
             msg = "OpenID Connect server not configured"
             raise NotConfiguredError(msg)
         key = self._context.config.session_secret
-        storage = RedisStorage(OIDCAuthorization, key, self._context.redis)
+        storage = RedisStorage(
+            OIDCAuthorization,
+            key,
+            self._context.redis,
+            aes_gcm=self._context.config.redis_aes_gcm,
+        )
         authorization_store = OIDCAuthorizationStore(storage)
         token_service = self.create_token_service()
         return OIDCService(
@@ -432,6 +609,7 @@ class Factory:
                 group_cache=self._context.ldap_group_cache,
                 group_name_cache=self._context.ldap_group_name_cache,
                 user_cache=self._context.ldap_user_cache,
+                cache_invalidator=self._context.cache_invalidator,
                 logger=self._logger,
             )
         return OIDCUserInfoService(
@@ -439,6 +617,8 @@ class Factory:
             ldap=ldap,
             firestore=firestore,
             forgerock=forgerock,
+            quota_cache=self._context.quota_cache,
+            user_info_cache=self._context.user_info_cache,
             logger=self._logger,
         )
 
@@ -514,6 +694,31 @@ class Factory:
             self._context.config.slack_webhook, "Gafaelfawr", self._logger
         )
 
+    def create_token_auth_history_writer(self) -> TokenAuthHistoryWriter:
+        """Create a writer of buffered authentication history.
+
+        The caller must call ``start`` to start writing in the background and
+        ``aclose`` during shutdown.
+
+        Returns
+        -------
+        TokenAuthHistoryWriter
+            Newly-created writer of buffered authentication history.
+
+        Raises
+        ------
+        NotConfiguredError
+            Raised if authentication history is not being recorded.
+        """
+        if not self._context.token_auth_history_buffer:
+            raise NotConfiguredError("Authentication history not recorded")
+        return TokenAuthHistoryWriter(
+            buffer=self._context.token_auth_history_buffer,
+            token_auth_store=TokenAuthHistoryStore(self.session),
+            session=self.session,
+            logger=self._logger,
+        )
+
     def create_token_cache_service(self) -> TokenCacheService:
         """Create a token cache.
 
@@ -523,17 +728,62 @@ class Factory:
             A new token cache.
         """
         key = self._context.config.session_secret
-        storage = RedisStorage(TokenData, key, self._context.redis)
+        storage = RedisStorage(
+            TokenData,
+            key,
+            self._context.redis,
+            aes_gcm=self._context.config.redis_aes_gcm,
+        )
         token_redis_store = TokenRedisStore(storage, self._logger)
+        child_token_store = ChildTokenRedisStore(
+            RedisStringStorage(self._context.redis)
+        )
         token_db_store = TokenDatabaseStore(self.session)
-        token_change_store = TokenChangeHistoryStore(self.session)
+        token_change_store = self.create_token_change_history_store()
         return TokenCacheService(
             config=self._context.config,
             internal_cache=self._context.internal_token_cache,
             notebook_cache=self._context.notebook_token_cache,
+            child_token_store=child_token_store,
             token_db_store=token_db_store,
             token_redis_store=token_redis_store,
             token_change_store=token_change_store,
+            session=self.session,
+            logger=self._logger,
+        )
+
+    def create_token_change_history_store(self) -> TokenChangeHistoryStore:
+        """Create storage for token change history.
+
+        If write-behind of history is enabled, the store adds new entries to
+        the Redis queue rather than the database.
+
+        Returns
+        -------
+        TokenChangeHistoryStore
+            Newly-created storage for token change history.
+        """
+        queue = None
+        if self._context.config.history_write_behind:
+            queue = TokenChangeHistoryQueue(self._context.redis)
+        return TokenChangeHistoryStore(self.session, queue)
+
+    def create_token_change_history_writer(self) -> TokenChangeHistoryWriter:
+        """Create a writer of queued token change history.
+
+        The caller must call ``start`` to start writing in the background and
+        ``aclose`` during shutdown.
+
+        Returns
+        -------
+        TokenChangeHistoryWriter
+            Newly-created writer of queued token change history.
+        """
+        return TokenChangeHistoryWriter(
+            queue=TokenChangeHistoryQueue(self._context.redis),
+            checkpoint_store=HistoryCheckpointStore(self.session),
+            token_change_store=TokenChangeHistoryStore(self.session),
+            session=self.session,
             logger=self._logger,
         )
 
@@ -547,24 +797,57 @@ class Factory:
         """
         token_db_store = TokenDatabaseStore(self.session)
         key = self._context.config.session_secret
-        storage = RedisStorage(TokenData, key, self._context.redis)
+        storage = RedisStorage(
+            TokenData,
+            key,
+            self._context.redis,
+            aes_gcm=self._context.config.redis_aes_gcm,
+        )
         token_redis_store = TokenRedisStore(storage, self._logger)
-        token_change_store = TokenChangeHistoryStore(self.session)
+        child_token_store = ChildTokenRedisStore(
+            RedisStringStorage(self._context.redis)
+        )
+        token_change_store = self.create_token_change_history_store()
         token_cache_service = TokenCacheService(
             config=self._context.config,
             internal_cache=self._context.internal_token_cache,
             notebook_cache=self._context.notebook_token_cache,
+            child_token_store=child_token_store,
             token_db_store=token_db_store,
             token_redis_store=token_redis_store,
             token_change_store=token_change_store,
+            session=self.session,
             logger=self._logger,
         )
         return TokenService(
             config=self._context.config,
             token_cache=token_cache_service,
+            token_data_cache=self._context.token_data_cache,
+            missing_token_cache=self._context.missing_token_cache,
+            cache_invalidator=self._context.cache_invalidator,
             token_db_store=token_db_store,
             token_redis_store=token_redis_store,
             token_change_store=token_change_store,
+            token_usage_tracker=self._context.token_usage_tracker,
+            token_auth_store=TokenAuthHistoryStore(self.session),
+            logger=self._logger,
+        )
+
+    def create_token_usage_writer(self) -> TokenUsageWriter:
+        """Create a writer of the last-used times of tokens.
+
+        The caller must call ``start`` to start writing in the background and
+        ``aclose`` during shutdown.
+
+        Returns
+        -------
+        TokenUsageWriter
+            Newly-created writer of the last-used times of tokens.
+        """
+        return TokenUsageWriter(
+            tracker=self._context.token_usage_tracker,
+            token_db_store=TokenDatabaseStore(self.session),
+            session=self.session,
             logger=self._logger,
         )
 
@@ -596,12 +879,15 @@ class Factory:
                 group_cache=self._context.ldap_group_cache,
                 group_name_cache=self._context.ldap_group_name_cache,
                 user_cache=self._context.ldap_user_cache,
+                cache_invalidator=self._context.cache_invalidator,
                 logger=self._logger,
             )
         return UserInfoService(
             config=self._context.config,
             ldap=ldap,
             firestore=firestore,
+            quota_cache=self._context.quota_cache,
+            user_info_cache=self._context.user_info_cache,
             logger=self._logger,
         )
 
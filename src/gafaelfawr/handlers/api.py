@@ -28,6 +28,7 @@ from ..dependencies.context import RequestContext, context_dependency
 from ..exceptions import ExternalUserInfoError, NotFoundError
 from ..models.admin import Admin
 from ..models.auth import APIConfig, APILoginResponse, Scope
+from ..models.cache import CacheStatistics
 from ..models.history import TokenChangeHistoryEntry
 from ..models.token import (
     AdminTokenRequest,
@@ -142,6 +143,54 @@ async def delete_admin(
         raise NotFoundError(msg, ErrorLocation.path, "username")
 
 
+@router.get(
+    "/caches",
+    dependencies=[Depends(authenticate_admin_read)],
+    description=(
+        "Get statistics for the in-memory caches of the Gafaelfawr process"
+        " that handled the request. Other processes have their own caches."
+    ),
+    response_model=list[CacheStatistics],
+    summary="Get cache statistics",
+    tags=["admin"],
+)
+async def get_caches(
+    context: RequestContext = Depends(context_dependency),
+) -> list[CacheStatistics]:
+    cache_service = context.factory.create_cache_service()
+    return cache_service.get_statistics()
+
+
+@router.delete(
+    "/caches/users/{username}",
+    description=(
+        "Invalidate all cached data for a user, including LDAP data and"
+        " cached token data, in every Gafaelfawr process."
+    ),
+    responses={
+        403: {"description": "Permission denied", "model": ErrorModel},
+    },
+    status_code=204,
+    summary="Invalidate cached user data",
+    tags=["admin"],
+)
+async def delete_user_caches(
+    username: str = Path(
+        ...,
+        title="Username",
+        description="Username of user whose cached data to invalidate",
+        example="someuser",
+        min_length=1,
+        max_length=64,
+        regex=USERNAME_REGEX,
+    ),
+    auth_data: TokenData = Depends(authenticate_admin_write),
+    context: RequestContext = Depends(context_dependency),
+) -> None:
+    cache_service = context.factory.create_cache_service()
+    await cache_service.invalidate_user(username, actor=auth_data.username)
+
+
 @router.get(
     "/history/token-changes",
     description=(
@@ -527,6 +576,36 @@ async def post_tokens(
     return NewToken(token=str(token))
 
 
+@router.delete(
+    "/users/{username}/tokens",
+    description=(
+        "Revoke all tokens for a user, including the children of those"
+        " tokens. Only token administrators may revoke all tokens for a"
+        " user."
+    ),
+    summary="Revoke all tokens for user",
+    status_code=204,
+    tags=["admin"],
+)
+async def delete_tokens(
+    username: str = Path(
+        ...,
+        title="Username",
+        example="someuser",
+        min_length=1,
+        max_length=64,
+        regex=USERNAME_REGEX,
+    ),
+    auth_data: TokenData = Depends(authenticate_admin_write),
+    context: RequestContext = Depends(context_dependency),
+) -> None:
+    token_service = context.factory.create_token_service()
+    async with context.session.begin():
+        await token_service.delete_user_tokens(
+            auth_data, username, ip_address=context.ip_address
+        )
+
+
 @router.get(
     "/users/{username}/tokens/{key}",
     response_model=TokenInfo,
@@ -4,12 +4,17 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import timedelta
-from typing import Optional
+from typing import Any, Optional
 
-from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from cachetools import LRUCache
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
 from safir.datetime import current_datetime
 from safir.models import ErrorModel
 from safir.slack.webhook import SlackRouteErrorHandler
+from starlette.datastructures import QueryParams
 
 from ..auth import (
     clean_authorization,
@@ -17,7 +22,7 @@ from ..auth import (
     generate_challenge,
     generate_unauthorized_challenge,
 )
-from ..constants import MINIMUM_LIFETIME
+from ..constants import AUTH_CONFIG_CACHE_SIZE, MINIMUM_LIFETIME
 from ..dependencies.auth import AuthenticateRead
 from ..dependencies.context import RequestContext, context_dependency
 from ..exceptions import (
@@ -35,11 +40,15 @@ router = APIRouter(route_class=SlackRouteErrorHandler)
 __all__ = ["get_auth"]
 
 
-@dataclass
+@dataclass(frozen=True)
 class AuthConfig:
-    """Configuration for an authorization request."""
+    """Configuration for an authorization request.
 
-    scopes: set[str]
+    Instances are shared between requests with the same query string and
+    therefore must not be modified.
+    """
+
+    scopes: frozenset[str]
     """The scopes the authentication token must have."""
 
     satisfy: Satisfy
@@ -54,7 +63,7 @@ class AuthConfig:
     delegate_to: str | None
     """Internal service for which to create an internal token."""
 
-    delegate_scopes: set[str]
+    delegate_scopes: frozenset[str]
     """List of scopes the delegated token should have."""
 
     minimum_lifetime: timedelta | None
@@ -64,149 +73,275 @@ class AuthConfig:
     """Whether to put any delegated token in the ``Authorization`` header."""
 
 
-def auth_uri(
-    x_original_uri: Optional[str] = Header(
-        None, description="URL for which authorization is being checked"
-    ),
-    x_original_url: Optional[str] = Header(
-        None,
-        description=(
-            "URL for which authorization is being checked. `X-Original-URI`"
-            " takes precedence if both are set."
-        ),
-    ),
-) -> str:
-    """Determine URL for which we're validating authentication.
+class AuthParameters(BaseModel):
+    """Query parameters to ``/auth``, used to validate them.
 
-    ``X-Original-URI`` will only be set if the auth-method annotation is set.
-    That is recommended, but allow for the case where it isn't set and fall
-    back on ``X-Original-URL``, which is set unconditionally.
+    The documentation of these parameters is in `AUTH_PARAMETERS_OPENAPI`.
     """
-    return x_original_uri or x_original_url or "NONE"
 
-
-def auth_config(
-    scope: list[str] = Query(
-        ...,
-        title="Required scopes",
-        description=(
+    scope: list[str]
+    satisfy: Satisfy = Satisfy.ALL
+    auth_type: AuthType = AuthType.Bearer
+    notebook: bool = False
+    delegate_to: Optional[str] = None
+    delegate_scope: Optional[str] = None
+    minimum_lifetime: Optional[int] = Field(
+        None, ge=MINIMUM_LIFETIME.total_seconds()
+    )
+    use_authorization: bool = False
+
+
+AUTH_PARAMETERS_OPENAPI = [
+    {
+        "name": "scope",
+        "in": "query",
+        "required": True,
+        "schema": {
+            "title": "Required scopes",
+            "type": "array",
+            "items": {"type": "string"},
+        },
+        "description": (
             "If given more than once, meaning is determined by the `satisfy`"
             " parameter"
         ),
-        example="read:all",
-    ),
-    satisfy: Satisfy = Query(
-        Satisfy.ALL,
-        title="Scope matching policy",
-        description=(
+        "example": "read:all",
+    },
+    {
+        "name": "satisfy",
+        "in": "query",
+        "required": False,
+        "schema": {
+            "title": "Scope matching policy",
+            "enum": [s.value for s in Satisfy],
+            "default": Satisfy.ALL.value,
+        },
+        "description": (
             "Set to `all` to require all listed scopes, set to `any` to"
             " require any of the listed scopes"
         ),
-        example="any",
-    ),
-    auth_type: AuthType = Query(
-        AuthType.Bearer,
-        title="Challenge type",
-        description="Type of `WWW-Authenticate` challenge to return",
-        example="basic",
-    ),
-    notebook: bool = Query(
-        False,
-        title="Request notebook token",
-        description="Cannot be used with `delegate_to` or `delegate_scope`",
-        example=True,
-    ),
-    delegate_to: Optional[str] = Query(
-        None,
-        title="Service name",
-        description="Create an internal token for the named service",
-        example="some-service",
-    ),
-    delegate_scope: Optional[str] = Query(
-        None,
-        title="Scope of delegated token",
-        description=(
+        "example": "any",
+    },
+    {
+        "name": "auth_type",
+        "in": "query",
+        "required": False,
+        "schema": {
+            "title": "Challenge type",
+            "enum": [a.value for a in AuthType],
+            "default": AuthType.Bearer.value,
+        },
+        "description": "Type of `WWW-Authenticate` challenge to return",
+        "example": "basic",
+    },
+    {
+        "name": "notebook",
+        "in": "query",
+        "required": False,
+        "schema": {
+            "title": "Request notebook token",
+            "type": "boolean",
+            "default": False,
+        },
+        "description": "Cannot be used with `delegate_to` or `delegate_scope`",
+        "example": True,
+    },
+    {
+        "name": "delegate_to",
+        "in": "query",
+        "required": False,
+        "schema": {"title": "Service name", "type": "string"},
+        "description": "Create an internal token for the named service",
+        "example": "some-service",
+    },
+    {
+        "name": "delegate_scope",
+        "in": "query",
+        "required": False,
+        "schema": {"title": "Scope of delegated token", "type": "string"},
+        "description": (
             "Comma-separated list of scopes to add to the delegated token."
             " All listed scopes are implicitly added to the scope"
             " requirements for authorization."
         ),
-        example="read:all,write:all",
-    ),
-    minimum_lifetime: Optional[int] = Query(
-        None,
-        title="Required minimum lifetime",
-        description=(
+        "example": "read:all,write:all",
+    },
+    {
+        "name": "minimum_lifetime",
+        "in": "query",
+        "required": False,
+        "schema": {
+            "title": "Required minimum lifetime",
+            "type": "integer",
+            "minimum": int(MINIMUM_LIFETIME.total_seconds()),
+        },
+        "description": (
             "Force reauthentication if the delegated token (internal or"
             " notebook) would have a shorter lifetime, in seconds, than this"
             " parameter."
         ),
-        ge=MINIMUM_LIFETIME.total_seconds(),
-        example=86400,
-    ),
-    use_authorization: bool = Query(
-        False,
-        title="Put delegated token in Authorization",
-        description=(
+        "example": 86400,
+    },
+    {
+        "name": "use_authorization",
+        "in": "query",
+        "required": False,
+        "schema": {
+            "title": "Put delegated token in Authorization",
+            "type": "boolean",
+            "default": False,
+        },
+        "description": (
             "If true, also replace the Authorization header with any"
             " delegated token, passed as a bearer token."
         ),
-        example=True,
-    ),
-    auth_uri: str = Depends(auth_uri),
-    context: RequestContext = Depends(context_dependency),
-) -> AuthConfig:
-    """Construct the configuration for an authorization request.
+        "example": True,
+    },
+    {
+        "name": "X-Original-URI",
+        "in": "header",
+        "required": False,
+        "schema": {"title": "X-Original-Uri", "type": "string"},
+        "description": "URL for which authorization is being checked",
+    },
+    {
+        "name": "X-Original-URL",
+        "in": "header",
+        "required": False,
+        "schema": {"title": "X-Original-Url", "type": "string"},
+        "description": (
+            "URL for which authorization is being checked. `X-Original-URI`"
+            " takes precedence if both are set."
+        ),
+    },
+]
+"""OpenAPI documentation of the parameters to ``/auth``.
 
-    A shared dependency that reads various GET parameters and headers and
-    converts them into an `AuthConfig` class.
+The ``/auth`` route parses its parameters itself rather than declaring them
+to FastAPI (see `parse_auth_config`), so they have to be documented
+separately.
+"""
+
+_auth_config_cache: LRUCache[bytes, AuthConfig] = LRUCache(
+    AUTH_CONFIG_CACHE_SIZE
+)
+"""Cache of parsed authorization configurations by raw query string."""
+
+
+def parse_auth_config(query: bytes) -> AuthConfig:
+    """Parse and validate the query string of an authorization request.
+
+    Each ingress uses a fixed ``/auth`` URL, so there are only a small number
+    of distinct query strings.  Successfully parsed configurations are
+    therefore cached by the raw query string, and requests with a
+    previously-seen query string skip validation entirely.
+
+    Parameters
+    ----------
+    query
+        Raw query string of the request.
+
+    Returns
+    -------
+    AuthConfig
+        Configuration for the authorization request.  This may be shared
+        with other requests and must not be modified.
 
     Raises
     ------
-    fastapi.HTTPException
-        If ``notebook`` and ``delegate_to`` are both set.
+    fastapi.exceptions.RequestValidationError
+        Raised if the query parameters are invalid.
+    InvalidDelegateToError
+        Raised if ``notebook`` and ``delegate_to`` are both set.
     """
-    if notebook and delegate_to:
+    auth_config = _auth_config_cache.get(query)
+    if auth_config:
+        return auth_config
+
+    # Mimic the FastAPI handling of query parameters: scope is a list, and
+    # for all other parameters the last value wins.  FastAPI validates the
+    # default of a missing required list parameter, which is Ellipsis, so do
+    # the same to report the same type_error.list error.
+    query_params = QueryParams(query)
+    values: dict[str, Any] = dict(query_params)
+    values["scope"] = query_params.getlist("scope") or ...
+    try:
+        params = AuthParameters.parse_obj(values)
+    except ValidationError as e:
+        raise RequestValidationError([ErrorWrapper(e, ("query",))])
+
+    if params.notebook and params.delegate_to:
         msg = "delegate_to cannot be set for notebook tokens"
         raise InvalidDelegateToError(msg)
-    scopes = set(scope)
-    context.rebind_logger(
-        auth_uri=auth_uri,
-        required_scopes=sorted(scopes),
-        satisfy=satisfy.name.lower(),
-    )
-
-    if delegate_scope:
-        delegate_scopes = set(s.strip() for s in delegate_scope.split(","))
+    if params.delegate_scope:
+        delegate_scopes = frozenset(
+            s.strip() for s in params.delegate_scope.split(",")
+        )
     else:
-        delegate_scopes = set()
+        delegate_scopes = frozenset()
     lifetime = None
-    if minimum_lifetime:
-        lifetime = timedelta(seconds=minimum_lifetime)
-    elif not minimum_lifetime and (notebook or delegate_to):
+    if params.minimum_lifetime:
+        lifetime = timedelta(seconds=params.minimum_lifetime)
+    elif params.notebook or params.delegate_to:
         lifetime = MINIMUM_LIFETIME
-    return AuthConfig(
-        scopes=scopes,
-        satisfy=satisfy,
-        auth_type=auth_type,
-        notebook=notebook,
-        delegate_to=delegate_to,
+    auth_config = AuthConfig(
+        scopes=frozenset(params.scope),
+        satisfy=params.satisfy,
+        auth_type=params.auth_type,
+        notebook=params.notebook,
+        delegate_to=params.delegate_to,
         delegate_scopes=delegate_scopes,
         minimum_lifetime=lifetime,
-        use_authorization=use_authorization,
+        use_authorization=params.use_authorization,
+    )
+    _auth_config_cache[query] = auth_config
+    return auth_config
+
+
+async def auth_config(
+    context: RequestContext = Depends(context_dependency),
+) -> AuthConfig:
+    """Construct the configuration for an authorization request.
+
+    A shared dependency that reads various GET parameters and headers and
+    converts them into an `AuthConfig` class.  The parameters are parsed by
+    `parse_auth_config` rather than declared to FastAPI so that parsing and
+    validation can be cached.
+
+    Raises
+    ------
+    fastapi.exceptions.RequestValidationError
+        Raised if the query parameters are invalid.
+    InvalidDelegateToError
+        Raised if ``notebook`` and ``delegate_to`` are both set.
+    """
+    request = context.request
+    auth_config = parse_auth_config(request.scope["query_string"])
+
+    # X-Original-URI will only be set if the auth-method annotation is set.
+    # That is recommended, but allow for the case where it isn't set and fall
+    # back on X-Original-URL, which is set unconditionally.
+    auth_uri = (
+        request.headers.get("X-Original-URI")
+        or request.headers.get("X-Original-URL")
+        or "NONE"
+    )
+    context.rebind_logger(
+        auth_uri=auth_uri,
+        required_scopes=sorted(auth_config.scopes),
+        satisfy=auth_config.satisfy.name.lower(),
     )
+    return auth_config
 
 
 async def authenticate_with_type(
-    auth_type: AuthType = Query(
-        AuthType.Bearer,
-        title="Challenge type",
-        description="Control the type of WWW-Authenticate challenge returned",
-        example="basic",
-    ),
+    auth_config: AuthConfig = Depends(auth_config),
     context: RequestContext = Depends(context_dependency),
 ) -> TokenData:
     """Set authentication challenge based on auth_type parameter."""
-    authenticate = AuthenticateRead(auth_type=auth_type, ajax_forbidden=True)
+    authenticate = AuthenticateRead(
+        auth_type=auth_config.auth_type, ajax_forbidden=True
+    )
     return await authenticate(context=context)
 
 
@@ -220,6 +355,7 @@ async def authenticate_with_type(
     },
     summary="Authenticate user",
     tags=["internal"],
+    openapi_extra={"parameters": AUTH_PARAMETERS_OPENAPI},
 )
 async def get_auth(
     response: Response,
@@ -313,6 +449,13 @@ async def get_auth(
     headers = await build_success_headers(context, auth_config, token_data)
     for key, value in headers:
         response.headers.append(key, value)
+    if auth_history := context.factory.token_auth_history_buffer:
+        auth_history.record(
+            token_data,
+            scopes=auth_config.scopes,
+            service=auth_config.delegate_to,
+            ip_address=context.ip_address,
+        )
     return {"status": "ok"}
 
 
@@ -371,7 +514,7 @@ async def build_success_headers(
     """
     info_service = context.factory.create_user_info_service()
     try:
-        user_info = await info_service.get_user_info_from_token(token_data)
+        email = await info_service.get_email_from_token(token_data)
     except ExternalUserInfoError as e:
         # Catch these exceptions rather than raising an uncaught exception or
         # reporting the exception to Slack. This route is called on every user
@@ -390,8 +533,8 @@ async def build_success_headers(
         )
 
     headers = [("X-Auth-Request-User", token_data.username)]
-    if user_info.email:
-        headers.append(("X-Auth-Request-Email", user_info.email))
+    if email:
+        headers.append(("X-Auth-Request-Email", email))
 
     delegated_token = None
     if auth_config.notebook:
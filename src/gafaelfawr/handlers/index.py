@@ -1,12 +1,15 @@
 """Handlers for the app's root, ``/``."""
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
 from safir.metadata import Metadata, get_metadata
 from safir.slack.webhook import SlackRouteErrorHandler
 
+from ..dependencies.context import RequestContext, context_dependency
+
 router = APIRouter(route_class=SlackRouteErrorHandler)
 
-__all__ = ["get_index"]
+__all__ = ["get_index", "get_metrics"]
 
 
 @router.get(
@@ -29,3 +32,22 @@ async def get_index() -> Metadata:
     return get_metadata(
         package_name="gafaelfawr", application_name="gafaelfawr"
     )
+
+
+@router.get(
+    "/metrics",
+    description=(
+        "Return statistics for the in-memory caches of this process in the"
+        " Prometheus text format. This route is not exposed outside the"
+        " cluster and therefore cannot be used by external clients."
+    ),
+    response_class=PlainTextResponse,
+    summary="Cache metrics",
+    tags=["internal"],
+)
+async def get_metrics(
+    context: RequestContext = Depends(context_dependency),
+) -> str:
+    """GET ``/metrics`` (internal cache metrics for Prometheus)."""
+    cache_service = context.factory.create_cache_service()
+    return cache_service.get_metrics()
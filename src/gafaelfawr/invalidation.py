@@ -0,0 +1,265 @@
+"""Cross-process cache invalidation.
+
+The caches in `gafaelfawr.cache` are process-global, but Gafaelfawr is
+normally run as multiple processes, possibly spread across multiple Kubernetes
+pods.  Changes that invalidate cached data are therefore published to a Redis
+pub/sub channel, and every `~gafaelfawr.factory.ProcessContext` subscribes to
+that channel and evicts the affected entries from its own caches.
+
+Delivery through Redis pub/sub is best-effort.  Each process still
+invalidates its own caches synchronously when it makes a change, and the
+caches still expire entries on their own, so a lost message only delays
+invalidation rather than making it permanent.  If the subscription is lost,
+all of the caches are cleared before resubscribing, since messages may have
+been missed.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Iterable, Mapping
+from typing import Any, Optional
+
+import redis.asyncio as redis
+from pydantic import BaseModel, ValidationError
+from structlog.stdlib import BoundLogger
+
+from .cache import (
+    LDAPCache,
+    MissingTokenCache,
+    QuotaCache,
+    TokenCache,
+    TokenDataCache,
+    UserInfoCache,
+)
+from .constants import CACHE_INVALIDATION_CHANNEL, CACHE_INVALIDATION_RETRY
+
+__all__ = ["CacheInvalidation", "CacheInvalidator"]
+
+
+class CacheInvalidation(BaseModel):
+    """An invalidation event published to other Gafaelfawr processes."""
+
+    username: str
+    """User whose cached data should be invalidated."""
+
+    token: Optional[str] = None
+    """Key of the token whose cached data should be invalidated.
+
+    If not set, the event invalidates cached user information, such as LDAP
+    data, rather than data for a specific token.
+    """
+
+
+class CacheInvalidator:
+    """Publish and receive cache invalidation events.
+
+    This is created by `~gafaelfawr.factory.ProcessContext` and holds
+    references to the caches that it manages.  Callers in the service layer
+    use `invalidate_token` and `invalidate_user`, which evict the entries
+    from the local caches immediately and then notify other processes.
+
+    Parameters
+    ----------
+    redis
+        Redis client used to publish and subscribe to invalidation events.
+    token_data_cache
+        Cache of verified token data.
+    token_caches
+        Caches of internal and notebook tokens, from which child tokens are
+        evicted when they are changed or deleted.
+    ldap_caches
+        LDAP caches, all of which are keyed by username.
+    user_info_cache
+        Cache of assembled user information for tokens.
+    quota_cache
+        Cache of quotas, which is only cleared if events may have been lost.
+    missing_token_cache
+        Cache of token keys known not to exist, which is only cleared if
+        events may have been lost.
+    logger
+        Logger to use.
+    """
+
+    def __init__(
+        self,
+        *,
+        redis: redis.Redis,
+        token_data_cache: TokenDataCache,
+        token_caches: Iterable[TokenCache],
+        ldap_caches: Iterable[LDAPCache[Any]],
+        user_info_cache: UserInfoCache,
+        quota_cache: QuotaCache,
+        missing_token_cache: MissingTokenCache,
+        logger: BoundLogger,
+    ) -> None:
+        self._redis = redis
+        self._token_data_cache = token_data_cache
+        self._token_caches = list(token_caches)
+        self._ldap_caches = list(ldap_caches)
+        self._user_info_cache = user_info_cache
+        self._quota_cache = quota_cache
+        self._missing_token_cache = missing_token_cache
+        self._logger = logger
+        self._task: Optional[asyncio.Task[None]] = None
+        self._subscribed = asyncio.Event()
+
+    async def aclose(self) -> None:
+        """Stop listening for invalidation events."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def invalidate_token(self, key: str, username: str) -> None:
+        """Invalidate cached data for a token in all processes.
+
+        Parameters
+        ----------
+        key
+            Key of the token that was changed or deleted.
+        username
+            Owner of the token.
+        """
+        self._invalidate_token(key)
+        await self._publish(CacheInvalidation(username=username, token=key))
+
+    async def invalidate_tokens(self, tokens: Mapping[str, str]) -> None:
+        """Invalidate cached data for multiple tokens in all processes.
+
+        The invalidation events are published in one round trip.
+
+        Parameters
+        ----------
+        tokens
+            Mapping of the keys of tokens that were changed or deleted to
+            their owners.
+        """
+        if not tokens:
+            return
+        for key in tokens:
+            self._invalidate_token(key)
+        async with self._redis.pipeline(transaction=False) as pipeline:
+            for key, username in tokens.items():
+                event = CacheInvalidation(username=username, token=key)
+                pipeline.publish(CACHE_INVALIDATION_CHANNEL, event.json())
+            await pipeline.execute()
+
+    async def invalidate_user(self, username: str) -> None:
+        """Invalidate all cached data for a user in all processes.
+
+        This includes the user's LDAP data and the cached data, user
+        information, and child tokens of all of the user's tokens.
+
+        Parameters
+        ----------
+        username
+            User whose cached information should be invalidated.
+        """
+        await self._invalidate_user(username)
+        await self._publish(CacheInvalidation(username=username))
+
+    async def start(self) -> None:
+        """Start listening for invalidation events from other processes.
+
+        The listener runs as a background task until `aclose` is called.
+        Waits for the initial subscription to complete so that events
+        published after this method returns will be seen.  If the
+        subscription does not succeed promptly, a warning is logged and the
+        background task keeps retrying.
+        """
+        if self._task:
+            return
+        self._task = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(
+                self._subscribed.wait(), CACHE_INVALIDATION_RETRY
+            )
+        except asyncio.TimeoutError:
+            msg = "Timed out subscribing to cache invalidation events"
+            self._logger.warning(msg)
+
+    async def _handle(self, event: CacheInvalidation) -> None:
+        """Evict the cache entries described by an invalidation event.
+
+        Parameters
+        ----------
+        event
+            The invalidation event.
+        """
+        if event.token:
+            self._invalidate_token(event.token)
+        else:
+            await self._invalidate_user(event.username)
+
+    async def _clear(self) -> None:
+        """Clear all of the caches, used when events may have been lost."""
+        await self._token_data_cache.clear()
+        for token_cache in self._token_caches:
+            await token_cache.clear()
+        for ldap_cache in self._ldap_caches:
+            await ldap_cache.clear()
+        await self._user_info_cache.clear()
+        await self._quota_cache.clear()
+        await self._missing_token_cache.clear()
+
+    def _invalidate_token(self, key: str) -> None:
+        """Evict a token from all of the token caches."""
+        self._token_data_cache.invalidate(key)
+        for cache in self._token_caches:
+            cache.invalidate(key)
+
+    async def _invalidate_user(self, username: str) -> None:
+        """Invalidate the caches for a user, with proper locking."""
+        for cache in self._ldap_caches:
+            if cache.generation(username) is not None:
+                async with await cache.lock(username):
+                    cache.invalidate(username)
+        self._token_data_cache.invalidate_user(username)
+        self._user_info_cache.invalidate_user(username)
+        for token_cache in self._token_caches:
+            token_cache.invalidate_user(username)
+
+    async def _listen(self) -> None:
+        """Subscribe to the invalidation channel and process events.
+
+        Runs until cancelled.  If the subscription fails, all of the caches
+        are cleared, since invalidation events may have been lost, and the
+        subscription is retried after a delay.
+        """
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                async with pubsub:
+                    await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                    self._subscribed.set()
+                    async for message in pubsub.listen():
+                        await self._process_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._subscribed.clear()
+                error = f"{type(e).__name__}: {str(e)}"
+                msg = "Lost subscription to cache invalidation events"
+                self._logger.warning(msg, error=error)
+                await self._clear()
+                await asyncio.sleep(CACHE_INVALIDATION_RETRY)
+
+    async def _process_message(self, message: dict[str, Any]) -> None:
+        """Parse and handle one message from the invalidation channel."""
+        if message.get("type") != "message":
+            return
+        try:
+            event = CacheInvalidation.parse_raw(message["data"])
+        except ValidationError as e:
+            msg = "Ignoring invalid cache invalidation event"
+            self._logger.warning(msg, error=str(e))
+            return
+        await self._handle(event)
+
+    async def _publish(self, event: CacheInvalidation) -> None:
+        """Publish an invalidation event to other processes."""
+        await self._redis.publish(CACHE_INVALIDATION_CHANNEL, event.json())
@@ -10,7 +10,6 @@ import structlog
 from fastapi import FastAPI, Request, status
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from safir.dependencies.db_session import db_session_dependency
 from safir.dependencies.http_client import http_client_dependency
 from safir.logging import configure_uvicorn_logging
 from safir.middleware.x_forwarded import XForwardedMiddleware
@@ -156,14 +155,10 @@ def create_app(*, load_config: bool = True) -> FastAPI:
 async def startup_event() -> None:
     config = config_dependency.config()
     await context_dependency.initialize(config)
-    await db_session_dependency.initialize(
-        config.database_url, config.database_password
-    )
 
 
 async def shutdown_event() -> None:
     await http_client_dependency.aclose()
-    await db_session_dependency.aclose()
     await context_dependency.aclose()
 
 
@@ -3,12 +3,14 @@
 from __future__ import annotations
 
 import copy
+import http.cookies
 from abc import ABCMeta, abstractmethod
-from collections.abc import Awaitable, Callable
-from typing import Generic, Self, TypeVar
+from collections.abc import Callable
+from typing import Any, Generic, Optional, Self, TypeVar
 
-from fastapi import FastAPI, Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import Request
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 T = TypeVar("T", bound="BaseState")
 
@@ -26,7 +28,7 @@ class BaseState(metaclass=ABCMeta):
 
     @classmethod
     @abstractmethod
-    async def from_cookie(cls, cookie: str, request: Request) -> Self:
+    def from_cookie(cls, cookie: str, request: Request) -> Self:
         """Reconstruct state from an encrypted cookie.
 
         Parameters
@@ -53,7 +55,50 @@ class BaseState(metaclass=ABCMeta):
         """
 
 
-class StateMiddleware(BaseHTTPMiddleware, Generic[T]):
+class _LazyRequestState(dict[str, Any], Generic[T]):
+    """Request state that parses the state cookie on first access.
+
+    Starlette stores the attributes of ``request.state`` in the ``state`` key
+    of the ASGI scope, and looks them up by key.  Replacing that dictionary
+    with an instance of this class makes ``request.state.cookie`` parse the
+    state cookie the first time it is read.
+
+    Parameters
+    ----------
+    state
+        Existing contents of the request state.
+    loader
+        Function to call to parse the state cookie.
+    """
+
+    def __init__(self, state: dict[str, Any], loader: Callable[[], T]) -> None:
+        super().__init__(state)
+        self._loader = loader
+        self._original: Optional[T] = None
+
+    def __missing__(self, key: str) -> Any:
+        if key != "cookie":
+            raise KeyError(key)
+        state = copy.copy(self.original)
+        self["cookie"] = state
+        return state
+
+    @property
+    def original(self) -> T:
+        """The state as parsed from the cookie, loaded if necessary."""
+        if self._original is None:
+            self._original = self._loader()
+        return self._original
+
+    def changed_state(self) -> Optional[T]:
+        """Return the current state if it has changed, otherwise `None`."""
+        if "cookie" not in self:
+            return None
+        state = self["cookie"]
+        return None if state == self.original else state
+
+
+class StateMiddleware(Generic[T]):
     """Middleware to read and update an encrypted state cookie.
 
     If a cookie by the given name exists, it will be parsed by the given class
@@ -62,6 +107,11 @@ class StateMiddleware(BaseHTTPMiddleware, Generic[T]):
     converted back to a cookie and set in the response after the request is
     complete.
 
+    This is a pure ASGI middleware, and the cookie is only decrypted and
+    parsed when ``request.state.cookie`` is first accessed.  Requests that
+    never look at the state, such as ``/auth`` requests authenticated by a
+    bearer token, therefore pay no cost for it.
+
     The cookie will be marked as ``HttpOnly`` and will be marked as ``Secure``
     unless the application is running on localhost and not using TLS.
 
@@ -82,39 +132,64 @@ class StateMiddleware(BaseHTTPMiddleware, Generic[T]):
     """
 
     def __init__(
-        self, app: FastAPI, *, cookie_name: str, state_class: type[T]
+        self, app: ASGIApp, *, cookie_name: str, state_class: type[T]
     ) -> None:
-        super().__init__(app)
+        self.app = app
         self.cookie_name = cookie_name
         self.state_class = state_class
 
-    async def dispatch(
-        self,
-        request: Request,
-        call_next: Callable[[Request], Awaitable[Response]],
-    ) -> Response:
-        if self.cookie_name in request.cookies:
-            cookie = request.cookies[self.cookie_name]
-            state = await self.state_class.from_cookie(cookie, request)
-        else:
-            state = self.state_class()
-
-        # Put a copy of the state into the request object.  We need to store a
-        # copy rather than the original so that we can determine if the state
-        # has changed and therefore whether to replace the cookie after the
-        # request handler runs.
-        request.state.cookie = copy.copy(state)
-        response = await call_next(request)
-
-        # If the state has changed, write out the new state.
-        if request.state.cookie != state:
-            cookie = request.state.cookie.to_cookie()
-            secure = self._is_cookie_secure(request)
-            response.set_cookie(
-                self.cookie_name, cookie, secure=secure, httponly=True
-            )
-
-        return response
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+
+        def load_state() -> T:
+            cookie = request.cookies.get(self.cookie_name)
+            if cookie is None:
+                return self.state_class()
+            return self.state_class.from_cookie(cookie, request)
+
+        request_state = _LazyRequestState(scope.get("state", {}), load_state)
+        scope["state"] = request_state
+
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                state = request_state.changed_state()
+                if state is not None:
+                    headers = MutableHeaders(scope=message)
+                    cookie = self._build_cookie(request, state.to_cookie())
+                    headers.append("Set-Cookie", cookie)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+    def _build_cookie(self, request: Request, value: str) -> str:
+        """Build the ``Set-Cookie`` header value for a new state cookie.
+
+        Parameters
+        ----------
+        request
+            The incoming request.
+        value
+            The encrypted cookie value.
+
+        Returns
+        -------
+        str
+            Value for the ``Set-Cookie`` header.
+        """
+        cookie: http.cookies.SimpleCookie = http.cookies.SimpleCookie()
+        cookie[self.cookie_name] = value
+        cookie[self.cookie_name]["path"] = "/"
+        if self._is_cookie_secure(request):
+            cookie[self.cookie_name]["secure"] = True
+        cookie[self.cookie_name]["httponly"] = True
+        cookie[self.cookie_name]["samesite"] = "lax"
+        return cookie.output(header="").strip()
 
     def _is_cookie_secure(self, request: Request) -> bool:
         """Whether the cookie should be marked as secure.
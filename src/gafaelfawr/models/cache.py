@@ -0,0 +1,109 @@
+"""Representation of in-memory cache statistics."""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+__all__ = ["CacheStatistics"]
+
+
+class CacheStatistics(BaseModel):
+    """Statistics for one in-memory cache of a Gafaelfawr process.
+
+    Counters are cumulative since the process started or was last
+    reconfigured.
+    """
+
+    name: str = Field(
+        ..., title="Name", description="Name of the cache", example="ldap_user"
+    )
+
+    size: int = Field(
+        ...,
+        title="Size",
+        description="Number of entries currently in the cache",
+        example=412,
+    )
+
+    max_size: Optional[int] = Field(
+        None,
+        title="Maximum size",
+        description=(
+            "Maximum number of entries in the cache, if it is not limited by"
+            " memory"
+        ),
+        example=1000,
+    )
+
+    memory: Optional[int] = Field(
+        None,
+        title="Memory",
+        description=(
+            "Approximate memory used by the entries in bytes, if the cache is"
+            " limited by memory"
+        ),
+        example=2813022,
+    )
+
+    max_memory: Optional[int] = Field(
+        None,
+        title="Maximum memory",
+        description=(
+            "Maximum approximate memory used by the entries in bytes, if the"
+            " cache is limited by memory"
+        ),
+        example=67108864,
+    )
+
+    hits: int = Field(
+        ...,
+        title="Hits",
+        description=(
+            "Number of lookups that found an entry, including stale hits"
+        ),
+        example=90211,
+    )
+
+    misses: int = Field(
+        ...,
+        title="Misses",
+        description="Number of lookups that did not find an entry",
+        example=1503,
+    )
+
+    stale_hits: int = Field(
+        ...,
+        title="Stale hits",
+        description="Number of lookups that found an unusable entry",
+        example=12,
+    )
+
+    evictions: int = Field(
+        ...,
+        title="Evictions",
+        description="Number of entries evicted to make room for new entries",
+        example=0,
+    )
+
+    expirations: int = Field(
+        ...,
+        title="Expirations",
+        description="Number of entries removed because they expired",
+        example=1320,
+    )
+
+    lock_waits: int = Field(
+        ...,
+        title="Lock waits",
+        description="Number of times a cache lock was already held",
+        example=37,
+    )
+
+    lock_wait_seconds: float = Field(
+        ...,
+        title="Lock wait time",
+        description="Total time spent waiting for cache locks in seconds",
+        example=1.82,
+    )
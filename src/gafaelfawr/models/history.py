@@ -24,6 +24,7 @@ __all__ = [
     "AdminHistoryEntry",
     "HistoryCursor",
     "PaginatedHistory",
+    "TokenAuthHistoryEntry",
     "TokenChange",
     "TokenChangeHistoryEntry",
 ]
@@ -210,6 +211,75 @@ class TokenChange(Enum):
     edit = "edit"
 
 
+class TokenAuthHistoryEntry(BaseModel):
+    """A record of a successful authentication with a token."""
+
+    token: str = Field(
+        ...,
+        title="Token key",
+        example="dDQg_NTNS51GxeEteqnkag",
+        min_length=22,
+        max_length=22,
+    )
+
+    username: str = Field(
+        ...,
+        title="Username of the token",
+        example="someuser",
+        min_length=1,
+        max_length=64,
+    )
+
+    token_type: TokenType = Field(
+        ..., title="Type of the token", example="session"
+    )
+
+    scopes: list[str] = Field(
+        ...,
+        title="Scopes required for the authentication",
+        description="Scopes that the ingress required the token to have",
+        example=["read:all"],
+    )
+
+    service: Optional[str] = Field(
+        None,
+        title="Service that was accessed",
+        description=(
+            "Only set if the ingress requested an internal token for a"
+            " service."
+        ),
+        example="some-service",
+    )
+
+    ip_address: Optional[str] = Field(
+        None,
+        title="IP address from which the token was used",
+        example="198.51.100.50",
+    )
+
+    event_time: datetime = Field(
+        default_factory=current_datetime,
+        title="When the token was used",
+        example=1614985631,
+    )
+
+    class Config:
+        """Additional Pydantic configuration."""
+
+        json_encoders = {datetime: lambda v: int(v.timestamp())}
+        orm_mode = True
+
+    _normalize_scopes = validator("scopes", allow_reuse=True, pre=True)(
+        normalize_scopes
+    )
+    _normalize_event_time = validator(
+        "event_time", allow_reuse=True, pre=True
+    )(normalize_datetime)
+    _normalize_ip_address = validator(
+        "ip_address", allow_reuse=True, pre=True
+    )(normalize_ip_address)
+
+
 class TokenChangeHistoryEntry(BaseModel):
     """A record of a change to a token."""
 
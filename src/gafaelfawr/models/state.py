@@ -7,14 +7,17 @@ holds the data that Gafaelfawr stores in a session cookie.
 
 from __future__ import annotations
 
+import copy
 import json
 from dataclasses import dataclass
 from typing import Optional, Self
 
+import structlog
+from cachetools import LRUCache
 from cryptography.fernet import Fernet
 from fastapi import Request
-from safir.dependencies.logger import logger_dependency
 
+from ..constants import STATE_CACHE_SIZE
 from ..dependencies.config import config_dependency
 from ..middleware.state import BaseState
 from .token import Token
@@ -42,7 +45,7 @@ class State(BaseState):
     """State token for OAuth 2.0 and OpenID Connect logins."""
 
     @classmethod
-    async def from_cookie(
+    def from_cookie(
         cls, cookie: str, request: Optional[Request] = None
     ) -> Self:
         """Reconstruct state from an encrypted cookie.
@@ -51,8 +54,6 @@ class State(BaseState):
         ----------
         cookie
             The encrypted cookie value.
-        key
-            The `~cryptography.fernet.Fernet` key used to decrypt it.
         request
             The request, used for logging.  If not provided (primarily for the
             test suite), invalid state cookies will not be logged.
@@ -62,9 +63,12 @@ class State(BaseState):
         State
             The state represented by the cookie.
         """
-        config = await config_dependency()
-        key = config.session_secret.encode()
-        fernet = Fernet(key)
+        config = config_dependency.config()
+        cache_key = (config.session_secret, cookie)
+        cached = _state_cache.get(cache_key)
+        if isinstance(cached, cls):
+            return copy.copy(cached)
+        fernet = _get_fernet(config.session_secret)
         try:
             data = json.loads(fernet.decrypt(cookie.encode()).decode())
             token = None
@@ -72,20 +76,28 @@ class State(BaseState):
                 token = Token.from_str(data["token"])
         except Exception as e:
             if request:
-                logger = await logger_dependency(request)
+                logger = structlog.get_logger("gafaelfawr")
+                logger = logger.bind(
+                    httpRequest={
+                        "requestMethod": request.method,
+                        "requestUrl": str(request.url),
+                    }
+                )
                 error = type(e).__name__
                 if str(e):
                     error += f": {str(e)}"
                 logger.warning("Discarding invalid state cookie", error=error)
             return cls()
 
-        return cls(
+        state = cls(
             csrf=data.get("csrf"),
             token=token,
             github=data.get("github"),
             return_url=data.get("return_url"),
             state=data.get("state"),
         )
+        _state_cache[cache_key] = copy.copy(state)
+        return state
 
     def to_cookie(self) -> str:
         """Build an encrypted cookie representation of the state.
@@ -108,6 +120,28 @@ class State(BaseState):
             data["state"] = self.state
 
         config = config_dependency.config()
-        key = config.session_secret.encode()
-        fernet = Fernet(key)
+        fernet = _get_fernet(config.session_secret)
         return fernet.encrypt(json.dumps(data).encode()).decode()
+
+
+_fernet_cache: dict[str, Fernet] = {}
+"""Fernet objects for encrypting and decrypting state, by session secret."""
+
+_state_cache: LRUCache[tuple[str, str], State] = LRUCache(STATE_CACHE_SIZE)
+"""Cache of decrypted state by session secret and encrypted cookie.
+
+Browsers send the same cookie with every request until the state changes,
+and a single page load may generate dozens of ``/auth`` requests.  Cached
+`State` objects are never returned directly, only copies, so that
+`~gafaelfawr.middleware.state.StateMiddleware` can still detect changes.
+"""
+
+
+def _get_fernet(secret: str) -> Fernet:
+    """Get the Fernet object for a session secret, creating it if needed."""
+    fernet = _fernet_cache.get(secret)
+    if not fernet:
+        _fernet_cache.clear()
+        fernet = Fernet(secret.encode())
+        _fernet_cache[secret] = fernet
+    return fernet
@@ -5,8 +5,10 @@ from __future__ import annotations
 from .admin import Admin
 from .admin_history import AdminHistory
 from .base import Base
+from .history_checkpoint import HistoryCheckpoint
 from .subtoken import Subtoken
 from .token import Token
+from .token_ancestor import TokenAncestor
 from .token_auth_history import TokenAuthHistory
 from .token_change_history import TokenChangeHistory
 
@@ -14,8 +16,10 @@ __all__ = [
     "Admin",
     "AdminHistory",
     "Base",
+    "HistoryCheckpoint",
     "Subtoken",
     "Token",
+    "TokenAncestor",
     "TokenAuthHistory",
     "TokenChangeHistory",
 ]
@@ -0,0 +1,22 @@
+"""The history_checkpoint database table."""
+
+from __future__ import annotations
+
+from sqlalchemy import Column, String
+
+from .base import Base
+
+__all__ = ["HistoryCheckpoint"]
+
+
+class HistoryCheckpoint(Base):
+    """Position up to which a queue of history entries has been written.
+
+    Updated in the same transaction as the written entries, so that each
+    queued entry is written exactly once and in order.
+    """
+
+    __tablename__ = "history_checkpoint"
+
+    stream: str = Column(String(64), primary_key=True)
+    last_id: str = Column(String(64), nullable=False)
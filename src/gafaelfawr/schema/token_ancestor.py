@@ -0,0 +1,37 @@
+"""The token_ancestor database table."""
+
+from __future__ import annotations
+
+from sqlalchemy import Column, ForeignKey, Index, Integer, String
+
+from .base import Base
+
+__all__ = ["TokenAncestor"]
+
+
+class TokenAncestor(Base):
+    """Closure of the parent/child relationships in ``subtoken``.
+
+    There is one row for each token and each of its ancestors, not just its
+    parent, so that all descendants or all ancestors of a token at any depth
+    can be found with a single indexed query.  A token is not its own
+    ancestor.
+    """
+
+    __tablename__ = "token_ancestor"
+
+    ancestor: str = Column(
+        String(64),
+        ForeignKey("token.token", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    descendant: str = Column(
+        String(64),
+        ForeignKey("token.token", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    depth: int = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("token_ancestor_by_descendant", "descendant", "depth"),
+    )
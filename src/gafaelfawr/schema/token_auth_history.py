@@ -7,6 +7,7 @@ from datetime import datetime
 from sqlalchemy import Column, DateTime, Enum, Index, Integer, String
 from sqlalchemy.dialects import postgresql
 
+from ..constants import AUTH_HISTORY_SCOPES_LENGTH, AUTH_HISTORY_SERVICE_LENGTH
 from ..models.token import TokenType
 from .base import Base
 
@@ -24,8 +25,8 @@ class TokenAuthHistory(Base):
     token_type: TokenType = Column(Enum(TokenType), nullable=False)
     token_name: str | None = Column(String(64))
     parent: str | None = Column(String(64))
-    scopes: str | None = Column(String(512))
-    service: str | None = Column(String(64))
+    scopes: str | None = Column(String(AUTH_HISTORY_SCOPES_LENGTH))
+    service: str | None = Column(String(AUTH_HISTORY_SERVICE_LENGTH))
     ip_address: str | None = Column(
         String(64).with_variant(postgresql.INET, "postgresql")
     )
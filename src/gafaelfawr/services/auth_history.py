@@ -0,0 +1,241 @@
+"""Record authentications with tokens."""
+
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Iterable
+
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import async_scoped_session
+from structlog.stdlib import BoundLogger
+
+from ..constants import (
+    AUTH_HISTORY_BATCH_SIZE,
+    AUTH_HISTORY_FLUSH_INTERVAL,
+    AUTH_HISTORY_SCOPES_LENGTH,
+    AUTH_HISTORY_SERVICE_LENGTH,
+)
+from ..models.history import TokenAuthHistoryEntry
+from ..models.token import TokenData
+from ..storage.history import TokenAuthHistoryStore
+from .background import BackgroundWriter
+
+__all__ = ["TokenAuthHistoryBuffer", "TokenAuthHistoryWriter"]
+
+
+def _is_rejected(error: DBAPIError) -> bool:
+    """Determine whether the database rejected the data being written.
+
+    The asyncpg driver does not map data exceptions to `DataError`, so the
+    SQLSTATE class is checked as well: 22 is a data exception and 23 is an
+    integrity constraint violation.  Any other error, such as a lost
+    connection, may succeed if retried.
+    """
+    if isinstance(error, DataError | IntegrityError):
+        return True
+    sqlstate = getattr(error.orig, "sqlstate", None)
+    return isinstance(sqlstate, str) and sqlstate[:2] in ("22", "23")
+
+
+class TokenAuthHistoryBuffer:
+    """Bounded in-memory buffer of authentication history entries.
+
+    Authentication must neither write to the database nor wait for it, so
+    entries are added here and written in batches by
+    `TokenAuthHistoryWriter`.  If the writer falls behind and the buffer
+    fills, new entries are dropped and counted instead.  There is one buffer
+    per process, so entries outlive the requests that added them.
+
+    Parameters
+    ----------
+    size
+        Maximum number of entries to hold.
+    """
+
+    def __init__(self, size: int) -> None:
+        self._size = size
+        self._entries: deque[TokenAuthHistoryEntry] = deque()
+        self._dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, entry: TokenAuthHistoryEntry) -> None:
+        """Add an entry, or drop it if the buffer is full.
+
+        Parameters
+        ----------
+        entry
+            Authentication to record.
+        """
+        if len(self._entries) < self._size:
+            self._entries.append(entry)
+        else:
+            self._dropped += 1
+
+    def record(
+        self,
+        data: TokenData,
+        *,
+        scopes: Iterable[str],
+        service: str | None = None,
+        ip_address: str | None = None,
+    ) -> None:
+        """Record a successful authentication with a token.
+
+        Scopes and service names too long to store are truncated, since the
+        entry could otherwise never be written.
+
+        Parameters
+        ----------
+        data
+            Data for the token used to authenticate.
+        scopes
+            Scopes that the authentication required.
+        service
+            Service for which an internal token was requested, if any.
+        ip_address
+            IP address from which the token was used.
+        """
+        recorded_scopes = sorted(scopes)
+        while len(",".join(recorded_scopes)) > AUTH_HISTORY_SCOPES_LENGTH:
+            recorded_scopes.pop()
+        if service:
+            service = service[:AUTH_HISTORY_SERVICE_LENGTH]
+        entry = TokenAuthHistoryEntry(
+            token=data.token.key,
+            username=data.username,
+            token_type=data.token_type,
+            scopes=recorded_scopes,
+            service=service,
+            ip_address=ip_address,
+        )
+        self.add(entry)
+
+    def restore(self, entries: list[TokenAuthHistoryEntry]) -> None:
+        """Return entries that could not be written to the buffer.
+
+        Parameters
+        ----------
+        entries
+            Entries returned by `take`, which are put back at the front of
+            the buffer.  Any that no longer fit are dropped.
+        """
+        kept = entries[: max(self._size - len(self._entries), 0)]
+        self._entries.extendleft(reversed(kept))
+        self._dropped += len(entries) - len(kept)
+
+    def take(self, count: int) -> list[TokenAuthHistoryEntry]:
+        """Take the oldest entries from the buffer.
+
+        Parameters
+        ----------
+        count
+            Maximum number of entries to take.
+
+        Returns
+        -------
+        list of TokenAuthHistoryEntry
+            Entries, oldest first.
+        """
+        count = min(count, len(self._entries))
+        return [self._entries.popleft() for _ in range(count)]
+
+    def take_dropped(self) -> int:
+        """Return and reset the number of entries dropped.
+
+        Returns
+        -------
+        int
+            Number of entries dropped since the last call.
+        """
+        dropped = self._dropped
+        self._dropped = 0
+        return dropped
+
+
+class TokenAuthHistoryWriter(BackgroundWriter):
+    """Write buffered authentication history to the database.
+
+    Parameters
+    ----------
+    buffer
+        Buffered entries to write.
+    token_auth_store
+        Storage for token authentication history.
+    session
+        Database session proxy.
+    logger
+        Logger to use for messages.
+    batch_size
+        Maximum number of entries to write in one statement.
+    interval
+        How long to wait between writes in seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        buffer: TokenAuthHistoryBuffer,
+        token_auth_store: TokenAuthHistoryStore,
+        session: async_scoped_session,
+        logger: BoundLogger,
+        batch_size: int = AUTH_HISTORY_BATCH_SIZE,
+        interval: float = AUTH_HISTORY_FLUSH_INTERVAL,
+    ) -> None:
+        super().__init__(session=session, logger=logger, interval=interval)
+        self._buffer = buffer
+        self._token_auth_store = token_auth_store
+        self._batch_size = batch_size
+
+    async def _write(self) -> int:
+        dropped = self._buffer.take_dropped()
+        if dropped:
+            self._logger.warning(
+                "Dropped authentication history entries", count=dropped
+            )
+        batch = self._buffer.take(self._batch_size)
+        if not batch:
+            return 0
+        try:
+            async with self._session.begin():
+                await self._token_auth_store.add_many(batch)
+        except DBAPIError as e:
+            if not _is_rejected(e):
+                self._buffer.restore(batch)
+                raise
+
+            # The database will reject these entries again, so putting them
+            # back would block all later entries.  Instead, write the entries
+            # one at a time, skipping the ones that are rejected.
+            await self._write_each(batch)
+        except BaseException:
+            self._buffer.restore(batch)
+            raise
+        return len(batch)
+
+    async def _write_each(self, batch: list[TokenAuthHistoryEntry]) -> None:
+        """Write entries one at a time, dropping any that are rejected.
+
+        Parameters
+        ----------
+        batch
+            Entries to write.
+        """
+        for i, entry in enumerate(batch):
+            try:
+                async with self._session.begin():
+                    await self._token_auth_store.add_many([entry])
+            except DBAPIError as e:
+                if not _is_rejected(e):
+                    self._buffer.restore(batch[i:])
+                    raise
+                self._logger.error(
+                    "Dropped invalid authentication history entry",
+                    token=entry.token,
+                    user=entry.username,
+                    error=str(e),
+                )
+            except BaseException:
+                self._buffer.restore(batch[i:])
+                raise
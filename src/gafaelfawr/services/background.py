@@ -0,0 +1,105 @@
+"""Base class for writers that run in the background."""
+
+from __future__ import annotations
+
+import asyncio
+from abc import ABCMeta, abstractmethod
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import async_scoped_session
+from structlog.stdlib import BoundLogger
+
+__all__ = ["BackgroundWriter"]
+
+
+class BackgroundWriter(metaclass=ABCMeta):
+    """Periodically write buffered data to the database in the background.
+
+    Derived classes implement `_write`, which is called repeatedly on each
+    pass until it reports that there is nothing left to write.  A final pass
+    is made when the writer is stopped.
+
+    Parameters
+    ----------
+    session
+        Database session proxy.  The writer runs in its own task and
+        therefore gets its own session.
+    logger
+        Logger to use for messages.
+    interval
+        How long to wait between passes in seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        session: async_scoped_session,
+        logger: BoundLogger,
+        interval: float,
+    ) -> None:
+        self._session = session
+        self._logger = logger
+        self._interval = interval
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task[None]] = None
+
+    async def aclose(self) -> None:
+        """Stop writing, after writing any data still buffered."""
+        if not self._task:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def flush(self) -> int:
+        """Write all buffered data to the database.
+
+        Returns
+        -------
+        int
+            Number of records written.
+        """
+        total = 0
+        try:
+            while count := await self._write():
+                total += count
+        finally:
+            await self._session.remove()
+        return total
+
+    async def start(self) -> None:
+        """Start writing buffered data in the background."""
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        """Write buffered data periodically until stopped."""
+        name = type(self).__name__
+        while True:
+            try:
+                count = await self.flush()
+                if count:
+                    self._logger.debug(
+                        "Wrote buffered records", writer=name, count=count
+                    )
+            except Exception:
+                self._logger.exception(
+                    "Cannot write buffered records", writer=name
+                )
+            if self._stopping.is_set():
+                return
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self._interval)
+            except asyncio.TimeoutError:
+                pass
+
+    @abstractmethod
+    async def _write(self) -> int:
+        """Write one batch of buffered data to the database.
+
+        Returns
+        -------
+        int
+            Number of records written, which must be zero if there was
+            nothing to write.
+        """
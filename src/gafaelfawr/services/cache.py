@@ -0,0 +1,144 @@
+"""Report on and manage the in-memory caches."""
+
+from __future__ import annotations
+
+from collections.abc import Mapping
+
+from structlog.stdlib import BoundLogger
+
+from ..cache import BaseCache
+from ..invalidation import CacheInvalidator
+from ..models.cache import CacheStatistics
+
+__all__ = ["CacheService"]
+
+_METRICS = (
+    ("size", "gafaelfawr_cache_entries", "gauge", "Entries in the cache"),
+    ("max_size", "gafaelfawr_cache_max_entries", "gauge", "Cache capacity"),
+    (
+        "memory",
+        "gafaelfawr_cache_memory_bytes",
+        "gauge",
+        "Approximate memory used by cache entries",
+    ),
+    (
+        "max_memory",
+        "gafaelfawr_cache_max_memory_bytes",
+        "gauge",
+        "Approximate memory limit of the cache",
+    ),
+    ("hits", "gafaelfawr_cache_hits_total", "counter", "Cache hits"),
+    ("misses", "gafaelfawr_cache_misses_total", "counter", "Cache misses"),
+    (
+        "stale_hits",
+        "gafaelfawr_cache_stale_hits_total",
+        "counter",
+        "Cache hits that found an unusable entry",
+    ),
+    (
+        "evictions",
+        "gafaelfawr_cache_evictions_total",
+        "counter",
+        "Entries evicted to make room for new entries",
+    ),
+    (
+        "expirations",
+        "gafaelfawr_cache_expirations_total",
+        "counter",
+        "Entries removed because they expired",
+    ),
+    (
+        "lock_waits",
+        "gafaelfawr_cache_lock_waits_total",
+        "counter",
+        "Cache lock requests that had to wait",
+    ),
+    (
+        "lock_wait_seconds",
+        "gafaelfawr_cache_lock_wait_seconds_total",
+        "counter",
+        "Time spent waiting for cache locks",
+    ),
+)
+"""Prometheus metrics for each statistic: field, name, type, and help."""
+
+
+class CacheService:
+    """Report on and manage the in-memory caches of this process.
+
+    The statistics are for the current process only.  Invalidation is
+    published to all processes.
+
+    Parameters
+    ----------
+    caches
+        Mapping of cache names to caches.
+    cache_invalidator
+        Publisher of cache invalidation events.
+    logger
+        Logger to use for messages.
+    """
+
+    def __init__(
+        self,
+        caches: Mapping[str, BaseCache],
+        cache_invalidator: CacheInvalidator,
+        logger: BoundLogger,
+    ) -> None:
+        self._caches = caches
+        self._cache_invalidator = cache_invalidator
+        self._logger = logger
+
+    def get_metrics(self) -> str:
+        """Render the cache statistics in the Prometheus text format.
+
+        Returns
+        -------
+        str
+            Metrics for all caches in the Prometheus text exposition format.
+            Statistics that do not apply to a cache, such as memory use for
+            caches limited by number of entries, are omitted.
+        """
+        statistics = self.get_statistics()
+        lines = []
+        for field, name, metric_type, help_text in _METRICS:
+            samples = [
+                f'{name}{{cache="{s.name}"}} {getattr(s, field)}'
+                for s in statistics
+                if getattr(s, field) is not None
+            ]
+            if samples:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def get_statistics(self) -> list[CacheStatistics]:
+        """Get the statistics for all caches.
+
+        Returns
+        -------
+        list of CacheStatistics
+            Statistics for each cache, sorted by name.
+        """
+        return [
+            self._caches[name].statistics(name)
+            for name in sorted(self._caches)
+        ]
+
+    async def invalidate_user(self, username: str, *, actor: str) -> None:
+        """Invalidate all cached data for a user in all processes.
+
+        Parameters
+        ----------
+        username
+            User whose cached data should be invalidated.
+        actor
+            User requesting the invalidation, for logging.
+        """
+        await self._cache_invalidator.invalidate_user(username)
+        self._logger.info(
+            "Invalidated cached data for user",
+            user=username,
+            requested_by=actor,
+        )
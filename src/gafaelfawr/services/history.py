@@ -0,0 +1,83 @@
+"""Write queued history entries to the database."""
+
+from __future__ import annotations
+
+from sqlalchemy.ext.asyncio import async_scoped_session
+from structlog.stdlib import BoundLogger
+
+from ..constants import HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL
+from ..storage.history import (
+    HistoryCheckpointStore,
+    TokenChangeHistoryQueue,
+    TokenChangeHistoryStore,
+)
+from .background import BackgroundWriter
+
+__all__ = ["TokenChangeHistoryWriter"]
+
+
+class TokenChangeHistoryWriter(BackgroundWriter):
+    """Write queued token change history to the database in batches.
+
+    Entries are read from the queue after the checkpoint recorded in the
+    database, written, and the checkpoint advanced, all in one transaction
+    that also locks the checkpoint.  Entries are therefore written exactly
+    once and in order even if several processes run a writer or a process
+    dies part way through a batch.  Written entries are then removed from
+    the queue.
+
+    The writer is run whether or not write-behind of history is enabled, so
+    that entries queued before it was disabled are still written.  It only
+    starts a database transaction if the queue is not empty.
+
+    Parameters
+    ----------
+    queue
+        Queue of entries to write.
+    checkpoint_store
+        Storage for the position in the queue up to which entries have been
+        written.
+    token_change_store
+        Storage for token change history, which must not use the queue.
+    session
+        Database session proxy.
+    logger
+        Logger to use for messages.
+    batch_size
+        Maximum number of entries to write in one transaction.
+    interval
+        How long to wait between writes in seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        queue: TokenChangeHistoryQueue,
+        checkpoint_store: HistoryCheckpointStore,
+        token_change_store: TokenChangeHistoryStore,
+        session: async_scoped_session,
+        logger: BoundLogger,
+        batch_size: int = HISTORY_BATCH_SIZE,
+        interval: float = HISTORY_FLUSH_INTERVAL,
+    ) -> None:
+        super().__init__(session=session, logger=logger, interval=interval)
+        self._queue = queue
+        self._checkpoint_store = checkpoint_store
+        self._token_change_store = token_change_store
+        self._batch_size = batch_size
+
+    async def _write(self) -> int:
+        if await self._queue.is_empty():
+            return 0
+        async with self._session.begin():
+            last_id = await self._checkpoint_store.lock(self._queue.key)
+            batch = await self._queue.read(last_id, self._batch_size)
+            if batch:
+                await self._token_change_store.add_many(e for _, e in batch)
+                last_id = batch[-1][0]
+                await self._checkpoint_store.update(self._queue.key, last_id)
+
+        # This also removes entries written by a process that died before
+        # removing them, which would otherwise keep the queue from emptying.
+        await self._queue.remove(last_id)
+        return len(batch)
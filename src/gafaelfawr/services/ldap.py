@@ -4,7 +4,8 @@ from __future__ import annotations
 
 from structlog.stdlib import BoundLogger
 
-from ..cache import LDAPCache
+from ..cache import LDAPCache, LDAPGeneration
+from ..invalidation import CacheInvalidator
 from ..models.ldap import LDAPUserData
 from ..models.token import TokenGroup
 from ..storage.ldap import LDAPStorage
@@ -28,6 +29,8 @@ class LDAPService:
         Cache of group names.
     user_cache
         Cache of user information from LDAP.
+    cache_invalidator
+        Used to invalidate the LDAP caches in all Gafaelfawr processes.
     logger
         Logger to use.
     """
@@ -39,12 +42,14 @@ class LDAPService:
         group_cache: LDAPCache[list[TokenGroup]],
         group_name_cache: LDAPCache[list[str]],
         user_cache: LDAPCache[LDAPUserData],
+        cache_invalidator: CacheInvalidator,
         logger: BoundLogger,
     ) -> None:
         self._ldap = ldap
         self._group_cache = group_cache
         self._group_name_cache = group_name_cache
         self._user_cache = user_cache
+        self._cache_invalidator = cache_invalidator
         self._logger = logger
 
     async def get_group_names(
@@ -115,6 +120,29 @@ class LDAPService:
             self._group_cache.store(username, groups)
             return groups
 
+    def get_cache_generation(self, username: str) -> LDAPGeneration:
+        """Get the generation of the cached LDAP data for a user.
+
+        Used by callers that cache results derived from LDAP data to detect
+        when the underlying data has been refreshed, invalidated, or expired.
+
+        Parameters
+        ----------
+        username
+            Username of the user.
+
+        Returns
+        -------
+        tuple of int or None
+            Generation numbers of the user's entries in each LDAP cache, with
+            `None` for caches that have no entry for the user.
+        """
+        return (
+            self._group_cache.generation(username),
+            self._group_name_cache.generation(username),
+            self._user_cache.generation(username),
+        )
+
     async def get_data(self, username: str) -> LDAPUserData:
         """Get configured data from LDAP.
 
@@ -144,17 +172,12 @@ class LDAPService:
     async def invalidate_cache(self, username: str) -> None:
         """Invalidate the cache for a given user.
 
+        The cache is invalidated in this process immediately and in all other
+        Gafaelfawr processes once they receive the invalidation event.
+
         Parameters
         ----------
         username
             Username of the user.
         """
-        if self._group_name_cache.get(username) is not None:
-            async with await self._group_name_cache.lock(username):
-                self._group_name_cache.invalidate(username)
-        if self._group_cache.get(username) is not None:
-            async with await self._group_cache.lock(username):
-                self._group_cache.invalidate(username)
-        if self._user_cache.get(username) is not None:
-            async with await self._user_cache.lock(username):
-                self._user_cache.invalidate(username)
+        await self._cache_invalidator.invalidate_user(username)
@@ -4,14 +4,17 @@ from __future__ import annotations
 
 import ipaddress
 import re
+from collections import defaultdict
 from datetime import datetime, timedelta
 from typing import Optional
 
 from safir.datetime import current_datetime, format_datetime_for_logging
 from structlog.stdlib import BoundLogger
 
+from ..cache import MissingTokenCache, TokenDataCache
 from ..config import Config
 from ..constants import (
+    AUTH_HISTORY_RETENTION,
     CHANGE_HISTORY_RETENTION,
     MINIMUM_LIFETIME,
     USERNAME_REGEX,
@@ -22,6 +25,7 @@ from ..exceptions import (
     InvalidScopesError,
     PermissionDeniedError,
 )
+from ..invalidation import CacheInvalidator
 from ..models.history import (
     HistoryCursor,
     PaginatedHistory,
@@ -36,10 +40,15 @@ from ..models.token import (
     TokenType,
     TokenUserInfo,
 )
-from ..storage.history import TokenChangeHistoryStore
-from ..storage.token import TokenDatabaseStore, TokenRedisStore
+from ..storage.history import TokenAuthHistoryStore, TokenChangeHistoryStore
+from ..storage.token import (
+    TokenDatabaseStore,
+    TokenLookupStatus,
+    TokenRedisStore,
+)
 from ..util import is_bot_user
 from .token_cache import TokenCacheService
+from .token_usage import TokenUsageTracker
 
 __all__ = ["TokenService"]
 
@@ -53,12 +62,23 @@ class TokenService:
         Gafaelfawr configuration.
     token_cache
         Cache of internal and notebook tokens.
+    token_data_cache
+        Cache of verified token data, used by `get_data_cached`.
+    missing_token_cache
+        Cache of token keys not found in Redis, used by `get_data_cached`.
+    cache_invalidator
+        Used to invalidate cached token data in all Gafaelfawr processes.
     token_db_store
         The database backing store for tokens.
     token_redis_store
         The Redis backing store for tokens.
     token_change_store
         The backing store for history of changes to tokens.
+    token_usage_tracker
+        Collects the last-used times of tokens, recorded by
+        `get_data_cached`.
+    token_auth_store
+        The backing store for history of authentications with tokens.
     logger
         Logger to use.
     """
@@ -68,18 +88,41 @@ class TokenService:
         *,
         config: Config,
         token_cache: TokenCacheService,
+        token_data_cache: TokenDataCache,
+        missing_token_cache: MissingTokenCache,
+        cache_invalidator: CacheInvalidator,
         token_db_store: TokenDatabaseStore,
         token_redis_store: TokenRedisStore,
         token_change_store: TokenChangeHistoryStore,
+        token_usage_tracker: TokenUsageTracker,
+        token_auth_store: TokenAuthHistoryStore,
         logger: BoundLogger,
     ) -> None:
         self._config = config
         self._token_cache = token_cache
+        self._token_data_cache = token_data_cache
+        self._missing_token_cache = missing_token_cache
+        self._cache_invalidator = cache_invalidator
         self._token_db_store = token_db_store
         self._token_redis_store = token_redis_store
         self._token_change_store = token_change_store
+        self._token_usage_tracker = token_usage_tracker
+        self._token_auth_store = token_auth_store
         self._logger = logger
 
+    async def add_missing_ancestors(self) -> None:
+        """Add missing entries to the closure of token relationships.
+
+        Tokens created by older versions of Gafaelfawr are not recorded in
+        the table of token ancestors used to find all children of a token.
+        This is run when initializing the database and during background
+        maintenance to add them, since older versions may still be creating
+        tokens during an upgrade.
+        """
+        count = await self._token_db_store.add_missing_ancestors()
+        if count:
+            self._logger.info("Added missing token ancestry", count=count)
+
     async def audit(self, fix: bool = False) -> list[str]:
         """Check Gafaelfawr data stores for consistency.
 
@@ -103,12 +146,9 @@ class TokenService:
             t.token: t for t in await self._token_db_store.list_with_parents()
         }
         db_token_keys = set(db_tokens.keys())
-        redis_token_keys = set(await self._token_redis_store.list())
-        redis_tokens = {}
-        for key in redis_token_keys:
-            token_data = await self._token_redis_store.get_data_by_key(key)
-            if token_data:
-                redis_tokens[key] = token_data
+        redis_tokens = await self._token_redis_store.get_data_many(
+            await self._token_redis_store.list()
+        )
         redis_token_keys = set(redis_tokens.keys())
 
         # Tokens in the database but not in Redis.
@@ -131,20 +171,54 @@ class TokenService:
             alerts.append(alert)
 
         # Tokens in Redis but not in the database.
+        redis_only_keys: dict[str, list[str]] = defaultdict(list)
         for key in redis_token_keys - db_token_keys:
+            username = redis_tokens[key].username
             self._logger.warning(
                 "Token found in Redis but not database",
                 token=key,
-                user=redis_tokens[key].username,
+                user=username,
             )
             alert = (
-                f"Token `{key}` for `{redis_tokens[key].username}` found in"
-                " Redis but not database"
+                f"Token `{key}` for `{username}` found in Redis but not"
+                " database"
             )
             if fix:
-                await self._token_redis_store.delete(key)
+                redis_only_keys[username].append(key)
                 alert += " (fixed)"
             alerts.append(alert)
+        for username, keys in redis_only_keys.items():
+            await self._token_redis_store.delete_many(keys, username)
+        await self._cache_invalidator.invalidate_tokens(
+            {k: u for u, keys in redis_only_keys.items() for k in keys}
+        )
+
+        # Tokens missing from the index of tokens for their user.  Tokens
+        # created by versions of Gafaelfawr before the index was added will
+        # not be indexed.  Rewriting the token data adds them.
+        indexed_keys = db_token_keys & redis_token_keys
+        usernames = {redis_tokens[k].username for k in indexed_keys}
+        indexes = await self._token_redis_store.list_for_users(usernames)
+        unindexed = []
+        for key in indexed_keys:
+            token_data = redis_tokens[key]
+            if key in indexes[token_data.username]:
+                continue
+            self._logger.warning(
+                "Token missing from user token index",
+                token=key,
+                user=token_data.username,
+            )
+            alert = (
+                f"Token `{key}` for `{token_data.username}` missing from"
+                " user token index"
+            )
+            if fix:
+                unindexed.append(token_data)
+                alert += " (fixed)"
+            alerts.append(alert)
+        if unindexed:
+            await self._token_redis_store.store_data_many(unindexed)
 
         # Check that the data matches between the database and Redis.  Older
         # versions of Gafaelfawr didn't sort the scopes in Redis, so we have
@@ -219,6 +293,25 @@ class TokenService:
                 " token"
             )
 
+        # Check for child tokens missing from the closure of token ancestry,
+        # which would not be found when deleting or expiring their ancestors.
+        missing = await self._token_db_store.list_missing_ancestors()
+        for token in missing:
+            self._logger.warning(
+                "Token missing from token ancestry",
+                token=token.token,
+                user=token.username,
+            )
+            alert = (
+                f"Token `{token.token}` for `{token.username}` missing from"
+                " token ancestry"
+            )
+            if fix:
+                alert += " (fixed)"
+            alerts.append(alert)
+        if fix and missing:
+            await self._token_db_store.add_missing_ancestors()
+
         # Check for unknown scopes.
         for token_data in redis_tokens.values():
             known_scopes = set(self._config.known_scopes.keys())
@@ -517,6 +610,7 @@ class TokenService:
         (which is much faster than deleting entries line by line).
         """
         await self._token_redis_store.delete_all()
+        await self._token_data_cache.clear()
 
     async def delete_token(
         self,
@@ -551,17 +645,60 @@ class TokenService:
             return False
         self._check_authorization(info.username, auth_data)
 
-        # Recursively delete the children of this token first.  Children are
-        # returned in breadth-first order, so delete them in reverse order to
-        # delete the tokens farthest down in the tree first.  This minimizes
-        # the number of orphaned children at any given point.
+        # Delete the token and all of its children, recursively, as a set.
+        # The tree is removed from the database in bulk, and then from Redis
+        # and the caches, and the history is recorded in bulk.  Children are
+        # returned in breadth-first order, so reverse that order to record
+        # the deletion of the tokens farthest down in the tree first.
         children = await self._token_db_store.get_children(key)
-        children.reverse()
-        for child in children:
-            await self._delete_one_token(child, auth_data, ip_address)
-        success = await self._delete_one_token(key, auth_data, ip_address)
+        keys = [*reversed(children), key]
+        deleted = await self._token_db_store.delete_many(keys)
+        order = {k: i for i, k in enumerate(keys)}
+        deleted.sort(key=lambda d: order[d.token])
+        await self._finish_delete(deleted, auth_data, ip_address)
+        return any(d.token == key for d in deleted)
+
+    async def delete_user_tokens(
+        self, auth_data: TokenData, username: str, *, ip_address: str
+    ) -> int:
+        """Delete all tokens for a user.
+
+        This also deletes all children of those tokens, recursively, even if
+        they are owned by another user.  Only token administrators may do
+        this.
 
-        return success
+        Parameters
+        ----------
+        auth_data
+            The token data for the authentication token of the user deleting
+            the tokens.
+        username
+            Owner of the tokens to delete.
+        ip_address
+            The IP address from which the request came.
+
+        Returns
+        -------
+        int
+            Number of tokens deleted from the database.
+
+        Raises
+        ------
+        PermissionDeniedError
+            Raised if the authenticated user is not a token administrator.
+        """
+        self._check_authorization(username, auth_data, require_admin=True)
+
+        # Removing the user's index from Redis first immediately invalidates
+        # all of the user's tokens, including any not found in the database.
+        await self._token_redis_store.delete_for_user(username)
+        deleted = await self._token_db_store.delete_for_user(username)
+        await self._finish_delete(deleted, auth_data, ip_address)
+        await self._cache_invalidator.invalidate_user(username)
+        self._logger.info(
+            "Deleted all tokens for user", user=username, count=len(deleted)
+        )
+        return len(deleted)
 
     async def expire_tokens(self) -> None:
         """Bookkeeping for expired tokens.
@@ -570,7 +707,8 @@ class TokenService:
         after which the token disappears from Redis and effectively expires
         from an authentication standpoint.  However, we want to do some
         additional bookkeeping of expired tokens: remove them from the
-        database and add an expiration entry to the token history table.
+        database, add an expiration entry to the token history table, and
+        remove them from the Redis indexes of each user's tokens.
 
         This method is meant to be run periodically, outside of any given user
         request.
@@ -596,6 +734,11 @@ class TokenService:
                 action=TokenChange.expire,
             )
             await self._token_change_store.add(history_entry)
+        pruned = await self._token_redis_store.prune_indexes()
+        if pruned:
+            self._logger.info(
+                "Pruned expired tokens from indexes", count=pruned
+            )
 
     async def get_change_history(
         self,
@@ -632,8 +775,9 @@ class TokenService:
             Limit the results to actions performed by this user.
         key
             Limit the results to this token and any subtokens of this token.
-            Note that this will currently pick up direct subtokens but not
-            subtokens of subtokens.
+            This finds all current subtokens at any depth, but subtokens
+            that have since been deleted are only found if they were direct
+            subtokens of this token.
         token
             Limit the results to only this token.
         token_type
@@ -688,6 +832,52 @@ class TokenService:
         """
         return await self._token_redis_store.get_data(token)
 
+    async def get_data_cached(self, token: Token) -> TokenData | None:
+        """Retrieve the data for a token, using the process cache if possible.
+
+        This is the same as `get_data` except that verified token data is
+        cached in memory for a short time.  It is intended for the
+        authentication path, which may see the same token many times per
+        second.  Token keys not found in Redis are also remembered for a
+        short time, so that clients retrying with revoked or garbage tokens
+        do not cause a Redis query on every request.  Changes to the token
+        made by this process invalidate the cache immediately, and changes
+        made by other processes are propagated on a best-effort basis.
+
+        Since this is used for authentication, each successful call also
+        records that the token was used.  The last-used time is written to
+        the database later in the background.
+
+        Parameters
+        ----------
+        token
+            The token.
+
+        Returns
+        -------
+        TokenData or None
+            The data underlying the token, or `None` if the token is not found
+            or is invalid.
+        """
+        data = self._token_data_cache.get(token)
+        if data:
+            self._token_usage_tracker.record(token.key)
+            return data
+        if self._missing_token_cache.is_missing(token.key):
+            return None
+
+        # Only a key with no data at all may be remembered as missing.  Data
+        # that cannot be decrypted or does not match the secret is not
+        # cached, so that such problems are logged every time.
+        status, data = await self._token_redis_store.lookup(token)
+        if status == TokenLookupStatus.not_found:
+            self._missing_token_cache.store(token.key)
+        if not data:
+            return None
+        self._token_data_cache.store(data)
+        self._token_usage_tracker.record(token.key)
+        return data
+
     async def get_internal_token(
         self,
         token_data: TokenData,
@@ -991,14 +1181,27 @@ class TokenService:
             data.scopes = info.scopes
             data.expires = info.expires
             await self._token_redis_store.store_data(data)
+            await self._cache_invalidator.invalidate_token(key, info.username)
 
-        # Update subtokens if needed.
+        # Update subtokens if needed.  The database is updated one token at a
+        # time, since each change needs a history entry, but Redis is updated
+        # in bulk afterwards.
         if update_subtoken_expires and info:
             assert expires
+            modified = {}
             for child in await self._token_db_store.get_children(key):
-                await self._modify_expires(
+                child_info = await self._modify_expires(
                     child, auth_data, expires, ip_address
                 )
+                if child_info:
+                    modified[child] = child_info
+            children = await self._token_redis_store.get_data_many(modified)
+            for data in children.values():
+                data.expires = expires
+            await self._token_redis_store.store_data_many(children.values())
+            await self._cache_invalidator.invalidate_tokens(
+                {child: i.username for child, i in modified.items()}
+            )
 
         self._logger.info(
             "Modified token",
@@ -1015,8 +1218,11 @@ class TokenService:
         This method is meant to be run periodically, outside of any given user
         request.
         """
-        cutoff = current_datetime() - CHANGE_HISTORY_RETENTION
+        now = current_datetime()
+        cutoff = now - CHANGE_HISTORY_RETENTION
         await self._token_change_store.delete(older_than=cutoff)
+        cutoff = now - AUTH_HISTORY_RETENTION
+        await self._token_auth_store.delete(older_than=cutoff)
 
     def _check_authorization(
         self,
@@ -1064,59 +1270,60 @@ class TokenService:
             self._logger.warning("Permission denied", error=msg)
             raise PermissionDeniedError(msg)
 
-    async def _delete_one_token(
+    async def _finish_delete(
         self,
-        key: str,
+        deleted: list[TokenInfo],
         auth_data: TokenData,
         ip_address: str,
-    ) -> bool:
-        """Helper function to delete a single token.
+    ) -> None:
+        """Finish deleting tokens that were deleted from the database.
 
-        This does not do cascading delete and assumes authorization has
+        Removes the tokens from Redis and the caches and records their
+        deletion in the history, each in bulk.  Assumes authorization has
         already been checked.
 
         Parameters
         ----------
-        key
-            The key of the token to delete.
+        deleted
+            Information about the tokens deleted from the database.
         auth_data
             The token data for the authentication token of the user deleting
-            the token.
+            the tokens.
         ip_address
             The IP address from which the request came.
-
-        Returns
-        -------
-        bool
-            `True` if the token was deleted, `False` if the token was not
-            found.
         """
-        info = await self.get_token_info_unchecked(key)
-        if not info:
-            return False
-
-        history_entry = TokenChangeHistoryEntry(
-            token=key,
-            username=info.username,
-            token_type=info.token_type,
-            token_name=info.token_name,
-            parent=info.parent,
-            scopes=info.scopes,
-            service=info.service,
-            expires=info.expires,
-            actor=auth_data.username,
-            action=TokenChange.revoke,
-            ip_address=ip_address,
+        keys_by_user: dict[str, list[str]] = defaultdict(list)
+        for info in deleted:
+            keys_by_user[info.username].append(info.token)
+        for username, keys in keys_by_user.items():
+            await self._token_redis_store.delete_many(keys, username)
+        await self._cache_invalidator.invalidate_tokens(
+            {d.token: d.username for d in deleted}
         )
 
-        await self._token_redis_store.delete(key)
-        success = await self._token_db_store.delete(key)
-        if success:
-            await self._token_change_store.add(history_entry)
+        history = [
+            TokenChangeHistoryEntry(
+                token=info.token,
+                username=info.username,
+                token_type=info.token_type,
+                token_name=info.token_name,
+                parent=info.parent,
+                scopes=info.scopes,
+                service=info.service,
+                expires=info.expires,
+                actor=auth_data.username,
+                action=TokenChange.revoke,
+                ip_address=ip_address,
+            )
+            for info in deleted
+        ]
+        await self._token_change_store.add_many(history)
+        for info in deleted:
             self._logger.info(
-                "Deleted token", token_key=key, token_username=info.username
+                "Deleted token",
+                token_key=info.token,
+                token_username=info.username,
             )
-        return success
 
     async def _modify_expires(
         self,
@@ -1124,11 +1331,12 @@ class TokenService:
         auth_data: TokenData,
         expires: datetime,
         ip_address: str,
-    ) -> None:
-        """Change the expiration of a token if necessary.
+    ) -> TokenInfo | None:
+        """Change the expiration of a token in the database if necessary.
 
         Used to update the expiration of subtokens when the parent token
-        expiration has changed.
+        expiration has changed.  The caller is responsible for updating the
+        token data in Redis and invalidating caches.
 
         Parameters
         ----------
@@ -1142,12 +1350,18 @@ class TokenService:
             child token will be changed if it's later than this value.
         ip_address
             The IP address from which the request came.
+
+        Returns
+        -------
+        TokenInfo or None
+            Information about the token before it was changed, or `None` if
+            the token was not found or did not need to be changed.
         """
         info = await self.get_token_info_unchecked(key)
         if not info:
-            return
+            return None
         if info.expires and info.expires <= expires:
-            return
+            return None
 
         history_entry = TokenChangeHistoryEntry(
             token=key,
@@ -1166,10 +1380,7 @@ class TokenService:
 
         await self._token_db_store.modify(key, expires=expires)
         await self._token_change_store.add(history_entry)
-        data = await self._token_redis_store.get_data_by_key(key)
-        if data:
-            data.expires = expires
-            await self._token_redis_store.store_data(data)
+        return info
 
     def _validate_ip_or_cidr(self, ip_or_cidr: str | None) -> None:
         """Check that an IP address or CIDR block is valid.
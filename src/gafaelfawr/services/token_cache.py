@@ -2,18 +2,24 @@
 
 from __future__ import annotations
 
+from collections.abc import Awaitable, Callable
 from datetime import datetime, timedelta
 from typing import Optional
 
 from safir.datetime import current_datetime, format_datetime_for_logging
+from sqlalchemy.ext.asyncio import async_scoped_session
 from structlog.stdlib import BoundLogger
 
-from ..cache import InternalTokenCache, NotebookTokenCache
+from ..cache import InternalTokenCache, NotebookTokenCache, TokenCache
 from ..config import Config
 from ..models.history import TokenChange, TokenChangeHistoryEntry
 from ..models.token import Token, TokenData, TokenType
 from ..storage.history import TokenChangeHistoryStore
-from ..storage.token import TokenDatabaseStore, TokenRedisStore
+from ..storage.token import (
+    ChildTokenRedisStore,
+    TokenDatabaseStore,
+    TokenRedisStore,
+)
 
 __all__ = ["TokenCacheService"]
 
@@ -24,7 +30,20 @@ class TokenCacheService:
     To reduce latency and database query load, notebook and internal tokens
     for a given parent token are cached in memory and reused as long as the
     request data matches, the token is still valid, and less than half of its
-    lifetime has passed.
+    lifetime has passed.  The cache holds the full data of each child token,
+    so this check does not require Redis.  Child tokens that are changed or
+    revoked are evicted from the cache by
+    `~gafaelfawr.invalidation.CacheInvalidator`.
+
+    On a miss in the in-memory cache, the keys of child tokens recently
+    created or found by any Gafaelfawr process are looked up in Redis before
+    falling back to a database query for a matching child token.
+
+    If a refresh threshold is configured, cached tokens that have passed that
+    fraction of their lifetime are still returned, but a replacement is
+    created in a background task and swapped into the cache, so that
+    requests don't have to wait for token creation when the cached token
+    becomes too old to use.
 
     This class handles both the creation and the caching of internal and
     notebook tokens.
@@ -37,12 +56,17 @@ class TokenCacheService:
         Cache for internal tokens.
     notebook_cache
         Cache for notebook tokens.
+    child_token_store
+        Cache in Redis of the keys of child tokens, shared by all processes.
     token_db_store
         The database backing store for tokens.
     token_redis_store
         The Redis backing store for tokens.
     token_change_store
         The backing store for history of changes to tokens.
+    session
+        Database session, used for transaction management of background
+        token creation.
     logger
         Logger to use.
 
@@ -58,7 +82,10 @@ class TokenCacheService:
     scopes.  The expiration of the parent token is included since changing the
     expiration of a parent token (for a user token for instance) may allow for
     a longer internal or notebook token, and we don't want to prevent that
-    change by returning a cached token.
+    change by returning a cached token.  Creation of a new token is locked
+    on the same key, so identical concurrent requests wait for the first one
+    to create the token, but requests for different tokens for the same user
+    proceed concurrently.
     """
 
     def __init__(
@@ -67,17 +94,21 @@ class TokenCacheService:
         config: Config,
         internal_cache: InternalTokenCache,
         notebook_cache: NotebookTokenCache,
+        child_token_store: ChildTokenRedisStore,
         token_redis_store: TokenRedisStore,
         token_db_store: TokenDatabaseStore,
         token_change_store: TokenChangeHistoryStore,
+        session: async_scoped_session,
         logger: BoundLogger,
     ) -> None:
         self._config = config
         self._internal_cache = internal_cache
         self._notebook_cache = notebook_cache
+        self._child_token_store = child_token_store
         self._token_redis_store = token_redis_store
         self._token_db_store = token_db_store
         self._token_change_store = token_change_store
+        self._session = session
         self._logger = logger
 
     async def clear(self) -> None:
@@ -125,21 +156,33 @@ class TokenCacheService:
         Token
             The cached token or newly-created token.
         """
-        # Awkward code is to convince mypy that token is not None.
-        token = self._internal_cache.get(token_data, service, scopes)
-        valid = await self._is_token_valid(token, minimum_lifetime, scopes)
-        if token and valid:
-            return token
-        async with await self._internal_cache.lock(token_data.username):
-            token = self._internal_cache.get(token_data, service, scopes)
-            valid = await self._is_token_valid(token, minimum_lifetime, scopes)
-            if token and valid:
-                return token
-            token = await self._create_internal_token(
+        data = self._internal_cache.get(token_data, service, scopes)
+        if data and self._is_token_valid(
+            self._internal_cache, data, minimum_lifetime, scopes
+        ):
+            if self._needs_refresh(token_data, data):
+                lifetime = self._refresh_lifetime(minimum_lifetime)
+                create = self._background(
+                    lambda: self._create_internal_token(
+                        token_data, service, scopes, ip_address, lifetime
+                    )
+                )
+                self._internal_cache.refresh(
+                    token_data, service, scopes, create
+                )
+            return data.token
+        lock = self._internal_cache.lock_token(token_data, service, scopes)
+        async with lock:
+            data = self._internal_cache.get(token_data, service, scopes)
+            if data and self._is_token_valid(
+                self._internal_cache, data, minimum_lifetime, scopes
+            ):
+                return data.token
+            data = await self._create_internal_token(
                 token_data, service, scopes, ip_address, minimum_lifetime
             )
-            self._internal_cache.store(token_data, service, scopes, token)
-            return token
+            self._internal_cache.store(token_data, service, scopes, data)
+            return data.token
 
     async def get_notebook_token(
         self,
@@ -172,18 +215,30 @@ class TokenCacheService:
         Token or None
             The cached token, or `None` if no matching token is cached.
         """
-        token = self._notebook_cache.get(token_data)
-        if token and await self._is_token_valid(token, minimum_lifetime):
-            return token
-        async with await self._notebook_cache.lock(token_data.username):
-            token = self._notebook_cache.get(token_data)
-            if token and await self._is_token_valid(token, minimum_lifetime):
-                return token
-            token = await self._create_notebook_token(
+        data = self._notebook_cache.get(token_data)
+        if data and self._is_token_valid(
+            self._notebook_cache, data, minimum_lifetime
+        ):
+            if self._needs_refresh(token_data, data):
+                lifetime = self._refresh_lifetime(minimum_lifetime)
+                create = self._background(
+                    lambda: self._create_notebook_token(
+                        token_data, ip_address, lifetime
+                    )
+                )
+                self._notebook_cache.refresh(token_data, create)
+            return data.token
+        async with self._notebook_cache.lock_token(token_data):
+            data = self._notebook_cache.get(token_data)
+            if data and self._is_token_valid(
+                self._notebook_cache, data, minimum_lifetime
+            ):
+                return data.token
+            data = await self._create_notebook_token(
                 token_data, ip_address, minimum_lifetime
             )
-            self._notebook_cache.store(token_data, token)
-            return token
+            self._notebook_cache.store(token_data, data)
+            return data.token
 
     async def _create_internal_token(
         self,
@@ -192,12 +247,11 @@ class TokenCacheService:
         scopes: list[str],
         ip_address: str,
         minimum_lifetime: Optional[timedelta] = None,
-    ) -> Token:
+    ) -> TokenData:
         """Retrieve or create a new internal token.
 
-        This must be run with the per-user token lock taken so that any other
-        requests for a token for the same user will wait until this request is
-        complete.
+        This must be run with the lock for this token taken so that any other
+        identical requests will wait until this request is complete.
 
         Parameters
         ----------
@@ -214,20 +268,33 @@ class TokenCacheService:
 
         Returns
         -------
-        Token
-            The retrieved or newly-created internal token.
+        TokenData
+            The data for the retrieved or newly-created internal token.
         """
+        min_expires = self._minimum_expiration(token_data, minimum_lifetime)
+
+        # See if any process has recently used a matching internal token.
+        key = await self._child_token_store.get_internal_token_key(
+            token_data, service, scopes
+        )
+        if key:
+            data = await self._token_redis_store.get_data_by_key(key)
+            if data and self._is_child_reusable(
+                token_data, data, TokenType.internal, min_expires, scopes
+            ):
+                return data
+
         # See if there's already a matching internal token.
         key = await self._token_db_store.get_internal_token_key(
-            token_data,
-            service,
-            scopes,
-            self._minimum_expiration(token_data, minimum_lifetime),
+            token_data, service, scopes, min_expires
         )
         if key:
             data = await self._token_redis_store.get_data_by_key(key)
             if data:
-                return data.token
+                await self._child_token_store.store_internal_token(
+                    token_data, service, scopes, data
+                )
+                return data
 
         # There is not, so we need to create a new one.
         token = Token()
@@ -267,6 +334,9 @@ class TokenCacheService:
             data, service=service, parent=token_data.token.key
         )
         await self._token_change_store.add(history_entry)
+        await self._child_token_store.store_internal_token(
+            token_data, service, scopes, data
+        )
 
         self._logger.info(
             "Created new internal token",
@@ -277,19 +347,18 @@ class TokenCacheService:
             token_userinfo=data.to_userinfo_dict(),
         )
 
-        return token
+        return data
 
     async def _create_notebook_token(
         self,
         token_data: TokenData,
         ip_address: str,
         minimum_lifetime: Optional[timedelta] = None,
-    ) -> Token:
+    ) -> TokenData:
         """Retrieve or create a notebook token.
 
-        This must be run with the per-user token lock taken so that any other
-        requests for a token for the same user will wait until this request is
-        complete.
+        This must be run with the lock for this token taken so that any other
+        identical requests will wait until this request is complete.
 
         Parameters
         ----------
@@ -302,17 +371,31 @@ class TokenCacheService:
 
         Returns
         -------
-        Token
-            The retrieved or newly-created notebook token.
+        TokenData
+            The data for the retrieved or newly-created notebook token.
         """
+        min_expires = self._minimum_expiration(token_data, minimum_lifetime)
+
+        # See if any process has recently used a matching notebook token.
+        key = await self._child_token_store.get_notebook_token_key(token_data)
+        if key:
+            data = await self._token_redis_store.get_data_by_key(key)
+            if data and self._is_child_reusable(
+                token_data, data, TokenType.notebook, min_expires
+            ):
+                return data
+
         # See if there's already a matching notebook token.
         key = await self._token_db_store.get_notebook_token_key(
-            token_data, self._minimum_expiration(token_data, minimum_lifetime)
+            token_data, min_expires
         )
         if key:
             data = await self._token_redis_store.get_data_by_key(key)
             if data:
-                return data.token
+                await self._child_token_store.store_notebook_token(
+                    token_data, data
+                )
+                return data
 
         # There is not, so we need to create a new one.
         token = Token()
@@ -349,6 +432,7 @@ class TokenCacheService:
         await self._token_redis_store.store_data(data)
         await self._token_db_store.add(data, parent=token_data.token.key)
         await self._token_change_store.add(history_entry)
+        await self._child_token_store.store_notebook_token(token_data, data)
 
         # Cache the token and return it.
         self._logger.info(
@@ -357,44 +441,119 @@ class TokenCacheService:
             token_expires=format_datetime_for_logging(expires),
             token_userinfo=data.to_userinfo_dict(),
         )
-        return token
+        return data
+
+    def _background(
+        self, create: Callable[[], Awaitable[TokenData]]
+    ) -> Callable[[], Awaitable[TokenData | None]]:
+        """Wrap token creation for use in a background task.
+
+        The background task has its own database session, so the wrapped
+        function runs token creation inside its own transaction and removes
+        the session afterwards.  Since nothing waits for the result of the
+        task, errors are logged and `None` is returned.
+
+        Parameters
+        ----------
+        create
+            Function to create the token.
+
+        Returns
+        -------
+        Callable
+            Function suitable for passing to the ``refresh`` method of a
+            token cache.
+        """
+
+        async def background_create() -> TokenData | None:
+            try:
+                async with self._session.begin():
+                    return await create()
+            except Exception as e:
+                msg = "Unable to refresh cached token"
+                self._logger.exception(msg, error=str(e))
+                return None
+            finally:
+                await self._session.remove()
+
+        return background_create
+
+    def _is_child_reusable(
+        self,
+        token_data: TokenData,
+        data: TokenData,
+        token_type: TokenType,
+        min_expires: datetime,
+        scopes: Optional[list[str]] = None,
+    ) -> bool:
+        """Check whether a child token found in Redis can be reused.
+
+        Applies the same checks as the database query for a matching child
+        token, other than the parent and service, which are part of the
+        Redis key under which the child token was found.
+
+        Parameters
+        ----------
+        token_data
+            The data for the parent token.
+        data
+            The data for the child token.
+        token_type
+            The required type of the child token.
+        min_expires
+            The minimum acceptable expiration time for the child token.
+        scopes
+            If given, the scopes the child token must have.
+
+        Returns
+        -------
+        bool
+            Whether the child token can be reused.
+        """
+        if data.username != token_data.username:
+            return False
+        if data.token_type != token_type:
+            return False
+        if scopes is not None and sorted(data.scopes) != sorted(scopes):
+            return False
+        return bool(data.expires and data.expires >= min_expires)
 
-    async def _is_token_valid(
+    def _is_token_valid(
         self,
-        token: Token | None,
+        cache: TokenCache,
+        data: TokenData,
         minimum_lifetime: Optional[timedelta] = None,
         scopes: Optional[list[str]] = None,
     ) -> bool:
-        """Check whether a token is valid.
+        """Check whether a cached token is still usable.
 
-        Tokens are considered invalid if they cannot be retrieved from Redis,
-        don't satisfy a required minimum lifetime, or if more than half of
-        their lifetime has expired.
+        Tokens are considered invalid if they don't satisfy a required
+        minimum lifetime or if more than half of their lifetime has expired.
+        Tokens that were revoked or changed are evicted from the cache rather
+        than checked here.  Invalid tokens are recorded as stale hits in the
+        metrics of the cache.
 
         Parameters
         ----------
-        token
-            The token to check for validity.  `None` is accepted to simplify
-            type checking, but will always return `False`.
+        cache
+            The cache from which the token was retrieved.
+        data
+            The data for the token to check.
+        minimum_lifetime
+            If set, the minimum required lifetime of the token.
         scopes
             If provided, ensure that the token has scopes that are a subset of
             this scope list.  This is used to force a cache miss if an
             internal token is requested but the requesting token no longer has
             the scopes that the internal token provides.
-        minimum_lifetime
-            If set, the minimum required lifetime of the token.
 
         Returns
         -------
         bool
             Whether the token is valid.
         """
-        if not token:
-            return False
-        data = await self._token_redis_store.get_data(token)
-        if not data:
-            return False
         if scopes is not None and not (set(data.scopes) <= set(scopes)):
+            cache.metrics.stale_hits += 1
             return False
         if data.expires:
             if minimum_lifetime:
@@ -403,9 +562,63 @@ class TokenCacheService:
                 required = (data.expires - data.created).total_seconds() / 2
             remaining = data.expires - current_datetime()
             if remaining.total_seconds() < required:
+                cache.metrics.stale_hits += 1
                 return False
         return True
 
+    def _needs_refresh(self, token_data: TokenData, data: TokenData) -> bool:
+        """Check whether a cached token should be replaced in the background.
+
+        Parameters
+        ----------
+        token_data
+            The data for the parent token.
+        data
+            The data for the cached child token.
+
+        Returns
+        -------
+        bool
+            Whether more than the configured refresh threshold of the
+            lifetime of the cached token has passed.  Always `False` if no
+            threshold is configured.
+        """
+        threshold = self._config.token_refresh_threshold
+        if not threshold or not data.expires:
+            return False
+
+        # If the expiration of the child token was capped at the expiration
+        # of its parent, any replacement would have the same expiration.
+        if token_data.expires and data.expires >= token_data.expires:
+            return False
+
+        lifetime = data.expires - data.created
+        return current_datetime() - data.created >= lifetime * threshold
+
+    def _refresh_lifetime(
+        self, minimum_lifetime: Optional[timedelta] = None
+    ) -> timedelta:
+        """Determine the minimum lifetime of a refreshed token.
+
+        A replacement for a cached token must not itself be past the refresh
+        threshold, or a token that is no newer may be found and reused.
+
+        Parameters
+        ----------
+        minimum_lifetime
+            If set, the minimum lifetime required by the request.
+
+        Returns
+        -------
+        timedelta
+            The minimum lifetime of the replacement token.
+        """
+        threshold = self._config.token_refresh_threshold or 0
+        lifetime = self._config.token_lifetime * (1 - threshold)
+        if minimum_lifetime and minimum_lifetime > lifetime:
+            return minimum_lifetime
+        return lifetime
+
     def _minimum_expiration(
         self,
         token_data: TokenData,
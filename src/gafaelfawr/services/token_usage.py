@@ -0,0 +1,108 @@
+"""Record when tokens were last used."""
+
+from __future__ import annotations
+
+from datetime import datetime
+
+from safir.datetime import current_datetime
+from sqlalchemy.ext.asyncio import async_scoped_session
+from structlog.stdlib import BoundLogger
+
+from ..constants import TOKEN_USAGE_FLUSH_INTERVAL
+from ..storage.token import TokenDatabaseStore
+from .background import BackgroundWriter
+
+__all__ = ["TokenUsageTracker", "TokenUsageWriter"]
+
+
+class TokenUsageTracker:
+    """Collect the last-used times of tokens in memory.
+
+    Authentication must not write to the database, so uses of tokens are
+    recorded here, at minute granularity, and written periodically by
+    `TokenUsageWriter`.  Since there is one tracker per process, repeated
+    uses of a token by any request between writes are coalesced into one
+    update.
+    """
+
+    def __init__(self) -> None:
+        self._last_used: dict[str, datetime] = {}
+
+    def record(self, key: str) -> None:
+        """Record that a token was used now.
+
+        Parameters
+        ----------
+        key
+            Key of the token.
+        """
+        now = current_datetime().replace(second=0)
+        if self._last_used.get(key) != now:
+            self._last_used[key] = now
+
+    def restore(self, last_used: dict[str, datetime]) -> None:
+        """Restore last-used times that could not be written.
+
+        Parameters
+        ----------
+        last_used
+            Mapping of token keys to last-used times returned by `take`.
+            Times recorded since then take precedence.
+        """
+        for key, when in last_used.items():
+            self._last_used.setdefault(key, when)
+
+    def take(self) -> dict[str, datetime]:
+        """Take all recorded last-used times, leaving none recorded.
+
+        Returns
+        -------
+        dict of datetime
+            Mapping of token keys to last-used times.
+        """
+        last_used = self._last_used
+        self._last_used = {}
+        return last_used
+
+
+class TokenUsageWriter(BackgroundWriter):
+    """Write last-used times of tokens to the database in the background.
+
+    Parameters
+    ----------
+    tracker
+        Last-used times to write.
+    token_db_store
+        Database storage for tokens.
+    session
+        Database session proxy.
+    logger
+        Logger to use for messages.
+    interval
+        How long to wait between writes in seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        tracker: TokenUsageTracker,
+        token_db_store: TokenDatabaseStore,
+        session: async_scoped_session,
+        logger: BoundLogger,
+        interval: float = TOKEN_USAGE_FLUSH_INTERVAL,
+    ) -> None:
+        super().__init__(session=session, logger=logger, interval=interval)
+        self._tracker = tracker
+        self._token_db_store = token_db_store
+
+    async def _write(self) -> int:
+        last_used = self._tracker.take()
+        if not last_used:
+            return 0
+        try:
+            async with self._session.begin():
+                await self._token_db_store.update_last_used(last_used)
+        except BaseException:
+            self._tracker.restore(last_used)
+            raise
+        return len(last_used)
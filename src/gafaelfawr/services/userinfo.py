@@ -7,6 +7,7 @@ from typing import Any
 from pydantic import ValidationError
 from structlog.stdlib import BoundLogger
 
+from ..cache import LDAPGeneration, QuotaCache, UserInfoCache
 from ..config import Config
 from ..exceptions import (
     ExternalUserInfoError,
@@ -43,9 +44,9 @@ class UserInfoService:
     #. Get UID or GID from LDAP.
     #. Assign and manage UIDs and GIDs via Google Firestore.
 
-    This service manages those interactions.  UID/GID data from Firestore is
-    cached.  LDAP data is not cached, since LDAP is supposed to be able to
-    handle a very high query load.
+    This service manages those interactions.  UID/GID data from Firestore and
+    LDAP data are cached, and the user information assembled from them for a
+    token is cached until the underlying LDAP data changes or expires.
 
     This is the parent class, which is further specialized by authentication
     provider to incorporate some provider-specific logic for extracting user
@@ -59,6 +60,10 @@ class UserInfoService:
         LDAP service for user metadata, if LDAP was configured.
     firestore
         Service for Firestore UID/GID lookups, if Firestore was configured.
+    quota_cache
+        Cache of calculated quotas.
+    user_info_cache
+        Cache of assembled user information for tokens.
     logger
         Logger to use.
     """
@@ -69,13 +74,46 @@ class UserInfoService:
         config: Config,
         ldap: LDAPService | None,
         firestore: FirestoreService | None,
+        quota_cache: QuotaCache,
+        user_info_cache: UserInfoCache,
         logger: BoundLogger,
     ) -> None:
         self._config = config
         self._ldap = ldap
         self._firestore = firestore
+        self._quota_cache = quota_cache
+        self._user_info_cache = user_info_cache
         self._logger = logger
 
+    async def get_email_from_token(self, token_data: TokenData) -> str | None:
+        """Get only the email address of the user from a token.
+
+        This is a cheaper version of `get_user_info_from_token` for callers,
+        such as the ``/auth`` route, that only need the email address.  It
+        does not look up UIDs, GIDs, or group membership, and does not
+        calculate quotas.
+
+        Parameters
+        ----------
+        token_data
+            Data from the authentication token.
+
+        Returns
+        -------
+        str or None
+            The email address of the holder of that token, if known.
+
+        Raises
+        ------
+        LDAPError
+            Gafaelfawr was configured to get user data from LDAP, but the
+            attempt failed due to some error.
+        """
+        if token_data.email or not self._ldap:
+            return token_data.email
+        ldap_data = await self._ldap.get_data(token_data.username)
+        return ldap_data.email
+
     async def get_user_info_from_token(
         self, token_data: TokenData
     ) -> TokenUserInfo:
@@ -103,6 +141,110 @@ class UserInfoService:
         LDAPError
             Gafaelfawr was configured to get user groups, username, or numeric
             UID from LDAP, but the attempt failed due to some error.
+
+        Notes
+        -----
+        The user information stored with a token never changes and UIDs and
+        GIDs from Firestore are never reassigned, so the result can be cached
+        by token key for as long as the LDAP data used to build it is still
+        current.
+        """
+        key = token_data.token.key
+        username = token_data.username
+        generation = self._get_cache_generation(username)
+        user_info = self._user_info_cache.get(key, generation)
+        if user_info:
+            return user_info
+
+        # Building the user information may populate the LDAP caches, so the
+        # generation is taken again afterwards.  If an entry that was already
+        # cached was replaced while building, the result may mix old and new
+        # LDAP data, so don't cache it.
+        user_info = await self._build_user_info(token_data)
+        new_generation = self._get_cache_generation(username)
+        changed = (
+            old is not None and old != new
+            for old, new in zip(generation, new_generation)
+        )
+        if not any(changed):
+            self._user_info_cache.store(key, new_generation, user_info)
+        return user_info
+
+    async def get_scopes(self, user_info: TokenUserInfo) -> list[str] | None:
+        """Get scopes from user information.
+
+        Used to determine the scope claim of a token issued based on an OpenID
+        Connect authentication.
+
+        Parameters
+        ----------
+        TokenUserInfo
+            User information for a user.
+
+        Returns
+        -------
+        list of str or None
+            The scopes generated from the group membership based on the
+            ``group_mapping`` configuration parameter, or `None` if the user
+            was not a member of any known group.
+        """
+        if self._ldap:
+            username = user_info.username
+            gid = user_info.gid
+            if not gid and self._config.ldap and self._config.ldap.gid_attr:
+                ldap_data = await self._ldap.get_data(username)
+                gid = ldap_data.gid
+            groups = await self._ldap.get_group_names(username, gid)
+        elif user_info.groups:
+            groups = [g.name for g in user_info.groups]
+        else:
+            groups = []
+
+        scopes = set(["user:token"])
+        found = False
+        for group in groups:
+            if group in self._config.group_mapping:
+                found = True
+                scopes.update(self._config.group_mapping[group])
+
+        return sorted(scopes) if found else None
+
+    async def invalidate_cache(self, username: str) -> None:
+        """Invalidate any cached data for a given user.
+
+        Used after failed login due to missing group memberships, so that if
+        the user immediately fixes the problem, they don't have to wait for
+        the LDAP cache to expire.
+
+        Parameters
+        ----------
+        username
+            User for which to invalidate cached data.
+
+        Notes
+        -----
+        The cache is invalidated in this process immediately and in all other
+        Gafaelfawr processes via a Redis pub/sub invalidation event (see
+        `~gafaelfawr.invalidation.CacheInvalidator`).  Delivery of that event
+        is best-effort, so another process may briefly continue to use its
+        cached data if the event is lost, but no longer than the lifetime of
+        the LDAP cache.
+        """
+        if self._ldap:
+            await self._ldap.invalidate_cache(username)
+
+    async def _build_user_info(self, token_data: TokenData) -> TokenUserInfo:
+        """Assemble the user information for a token without caching.
+
+        Parameters
+        ----------
+        token_data
+            Data from the authentication token.
+
+        Returns
+        -------
+        TokenUserInfo
+            User information for the holder of that token.
         """
         username = token_data.username
         uid = token_data.uid
@@ -165,101 +307,30 @@ class UserInfoService:
             quota=self._calculate_quota(groups),
         )
 
-    async def get_scopes(self, user_info: TokenUserInfo) -> list[str] | None:
-        """Get scopes from user information.
-
-        Used to determine the scope claim of a token issued based on an OpenID
-        Connect authentication.
+    def _get_cache_generation(self, username: str) -> LDAPGeneration:
+        """Get the LDAP cache generation used to validate cached user info.
 
         Parameters
         ----------
-        TokenUserInfo
-            User information for a user.
+        username
+            Username of the user.
 
         Returns
         -------
-        list of str or None
-            The scopes generated from the group membership based on the
-            ``group_mapping`` configuration parameter, or `None` if the user
-            was not a member of any known group.
+        tuple of int or None
+            Generations of the user's LDAP cache entries, or an empty tuple
+            if LDAP is not configured.
         """
-        if self._ldap:
-            username = user_info.username
-            gid = user_info.gid
-            if not gid and self._config.ldap and self._config.ldap.gid_attr:
-                ldap_data = await self._ldap.get_data(username)
-                gid = ldap_data.gid
-            groups = await self._ldap.get_group_names(username, gid)
-        elif user_info.groups:
-            groups = [g.name for g in user_info.groups]
-        else:
-            groups = []
-
-        scopes = set(["user:token"])
-        found = False
-        for group in groups:
-            if group in self._config.group_mapping:
-                found = True
-                scopes.update(self._config.group_mapping[group])
-
-        return sorted(scopes) if found else None
-
-    async def invalidate_cache(self, username: str) -> None:
-        """Invalidate any cached data for a given user.
-
-        Used after failed login due to missing group memberships, so that if
-        the user immediately fixes the problem, they don't have to wait for
-        the LDAP cache to expire.
-
-        Parameters
-        ----------
-        username
-            User for which to invalidate cached data.
-
-        Notes
-        -----
-        This should be sufficient for the most common cases of invalid group
-        membership even if there are multiple instances of Gafaelfawr
-        running.
-
-        Retrieving LDAP information for a user only happens either (a) during
-        the login process, or (b) when checking a user's token (via the /auth
-        route, the API, etc.). For the typical case of a user who hasn't
-        onboarded yet, (b) is impossible since they haven't previously
-        authenticated and have no tokens. When they go through the login
-        process, we will retrieve their LDAP information and cache it, but
-        then we ask whether they're authorized. If not, we don't issue them a
-        token and then invalidate the cache using this method. These both
-        happen as part of processing the same request, so they can't be split
-        across multiple instances.
-
-        Therefore, in that normal case, this method will remove information
-        that was cached as part of the same request, and no other instance of
-        Gafaelfawr could have cached LDAP data because the user has not
-        successfully authenticated.
-
-        This cache invalidation could be insufficient if the user had
-        previously authenticated and then their user information in LDAP
-        changed such that they're no longer a member of an eligible group. In
-        that case, a cache invalidation done by the login process may be
-        undone by the user using an existing unexpired token to authenticate
-        to something else, resulting in an LDAP query that will be cached.
-        This could cause the confusing behavior that we were hoping to avoid:
-        bad LDAP data cached until the cache timeout.
-
-        That said, hopefully this case will be rare compared to the more
-        typical case of some onboarding problem. In the case where a user is
-        being invalidated entirely, we would normally delete all of their
-        tokens as well, avoiding this conflict.
-        """
-        if self._ldap:
-            await self._ldap.invalidate_cache(username)
+        return self._ldap.get_cache_generation(username) if self._ldap else ()
 
     def _calculate_quota(
         self, groups: list[TokenGroup] | None
     ) -> Quota | None:
         """Calculate the quota for a user.
 
+        The quota depends only on which of the user's groups have quota
+        grants, so the result is cached by that set of groups.
+
         Parameters
         ----------
         groups
@@ -272,6 +343,30 @@ class UserInfoService:
         """
         if not self._config.quota:
             return None
+        grants = self._config.quota.groups
+        quota_groups = frozenset(
+            g.name for g in groups or [] if g.name in grants
+        )
+        quota = self._quota_cache.get(quota_groups)
+        if not quota:
+            quota = self._build_quota(quota_groups)
+            self._quota_cache.store(quota_groups, quota)
+        return quota
+
+    def _build_quota(self, quota_groups: frozenset[str]) -> Quota:
+        """Calculate the quota for a set of groups with quota grants.
+
+        Parameters
+        ----------
+        quota_groups
+            Names of the user's groups that have quota grants.
+
+        Returns
+        -------
+        gafaelfawr.models.token.Quota
+            Quota information for a user in those groups.
+        """
+        assert self._config.quota
         api = dict(self._config.quota.default.api)
         notebook = None
         if self._config.quota.default.notebook:
@@ -279,23 +374,22 @@ class UserInfoService:
                 cpu=self._config.quota.default.notebook.cpu,
                 memory=self._config.quota.default.notebook.memory,
             )
-        for group in groups or []:
-            if group.name in self._config.quota.groups:
-                extra = self._config.quota.groups[group.name]
-                if extra.notebook:
-                    if notebook:
-                        notebook.cpu += extra.notebook.cpu
-                        notebook.memory += extra.notebook.memory
-                    else:
-                        notebook = NotebookQuota(
-                            cpu=extra.notebook.cpu,
-                            memory=extra.notebook.memory,
-                        )
-                for service in extra.api:
-                    if service in api:
-                        api[service] += extra.api[service]
-                    else:
-                        api[service] = extra.api[service]
+        for group in sorted(quota_groups):
+            extra = self._config.quota.groups[group]
+            if extra.notebook:
+                if notebook:
+                    notebook.cpu += extra.notebook.cpu
+                    notebook.memory += extra.notebook.memory
+                else:
+                    notebook = NotebookQuota(
+                        cpu=extra.notebook.cpu,
+                        memory=extra.notebook.memory,
+                    )
+            for service in extra.api:
+                if service in api:
+                    api[service] += extra.api[service]
+                else:
+                    api[service] = extra.api[service]
         return Quota(api=api, notebook=notebook)
 
 
@@ -317,6 +411,10 @@ class OIDCUserInfoService(UserInfoService):
     forgerock
         Service for ForgeRock Identity Management service queries, if
         ForgeRock was configured.
+    quota_cache
+        Cache of calculated quotas.
+    user_info_cache
+        Cache of assembled user information for tokens.
     logger
         Logger to use.
     """
@@ -328,12 +426,16 @@ class OIDCUserInfoService(UserInfoService):
         ldap: LDAPService | None,
         firestore: FirestoreService | None,
         forgerock: ForgeRockStorage | None,
+        quota_cache: QuotaCache,
+        user_info_cache: UserInfoCache,
         logger: BoundLogger,
     ) -> None:
         super().__init__(
             config=config,
             ldap=ldap,
             firestore=firestore,
+            quota_cache=quota_cache,
+            user_info_cache=user_info_cache,
             logger=logger,
         )
         self._forgerock = forgerock
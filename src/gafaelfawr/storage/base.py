@@ -8,52 +8,176 @@ confined to this file.
 
 from __future__ import annotations
 
-from collections.abc import AsyncIterator
+import base64
+import os
+from collections.abc import AsyncIterator, Iterable, Iterator
+from itertools import islice
 from typing import Generic, Optional, TypeVar
 
 import redis.asyncio as redis
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.hashes import SHA256
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from pydantic import BaseModel  # noqa: F401
 
+from ..constants import REDIS_BATCH_SIZE
 from ..exceptions import DeserializeError
 
 S = TypeVar("S", bound="BaseModel")
+T = TypeVar("T")
 
-__all__ = ["RedisStorage"]
+_AESGCM_INFO = b"gafaelfawr redis storage v1"
+"""HKDF context used to derive the AES-GCM key from the storage key."""
+
+_AESGCM_VERSION = b"\x01"
+"""Prefix marking a value stored in the AES-GCM storage format.
+
+Fernet tokens are base64-encoded and therefore always start with a printable
+character, so they can never be mistaken for a versioned value.
+"""
+
+_NONCE_LENGTH = 12
+"""Length of the random AES-GCM nonce stored with each value."""
+
+_STORE_INDEXED_SCRIPT = """
+local existed = redis.call("EXISTS", KEYS[2])
+if ARGV[2] == "" then
+    redis.call("SET", KEYS[1], ARGV[1])
+    redis.call("SADD", KEYS[2], KEYS[1])
+    redis.call("PERSIST", KEYS[2])
+else
+    local lifetime = tonumber(ARGV[2])
+    redis.call("SET", KEYS[1], ARGV[1], "EX", lifetime)
+    redis.call("SADD", KEYS[2], KEYS[1])
+    local ttl = redis.call("TTL", KEYS[2])
+    if existed == 0 or (ttl >= 0 and ttl < lifetime) then
+        redis.call("EXPIRE", KEYS[2], lifetime)
+    end
+end
+"""
+"""Lua script to store an object and add its key to an index.
+
+The index expires when the last object added to it expires, and never
+expires if any object added to it does not expire.  It may therefore contain
+keys of objects that have since expired or been deleted.
+"""
+
+_DELETE_INDEXED_SCRIPT = """
+local keys = redis.call("SMEMBERS", KEYS[1])
+for i = 1, #keys, 1000 do
+    redis.call("UNLINK", unpack(keys, i, math.min(i + 999, #keys)))
+end
+redis.call("UNLINK", KEYS[1])
+return keys
+"""
+"""Lua script to atomically delete an index and all objects in it."""
+
+_PRUNE_INDEX_SCRIPT = """
+local removed = 0
+for _, key in ipairs(ARGV) do
+    if redis.call("EXISTS", key) == 0 then
+        removed = removed + redis.call("SREM", KEYS[1], key)
+    end
+end
+return removed
+"""
+"""Lua script to remove keys of objects that no longer exist from an index.
+
+This is done in a script so that an object cannot be stored between checking
+whether it exists and removing it from the index.
+"""
+
+__all__ = ["RedisStorage", "RedisStringStorage"]
+
+
+def _batched(iterable: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Split an iterable into lists of at most the given size."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
 
 class RedisStorage(Generic[S]):
     """JSON-serialized encrypted storage in Redis.
 
+    Objects are stored in one of two formats.  The older format is a
+    base64-encoded Fernet token of the JSON serialization of the object.  The
+    newer format is a version byte, a random nonce, and the compact JSON
+    serialization of the object encrypted with AES-GCM, using the Redis key as
+    associated data so that an encrypted value cannot be moved to a different
+    key.  Both formats are always accepted when reading, but objects are only
+    stored in the AES-GCM format if requested, so that versions of
+    Gafaelfawr that can only read Fernet tokens can share the same Redis.
+
     Parameters
     ----------
     content
         The class of object being stored.
     key
-        Encryption key.  Must be a `~cryptography.fernet.Fernet` key.
+        Encryption key.  Must be a `~cryptography.fernet.Fernet` key.  It is
+        used directly for the Fernet format, and the AES-GCM key is derived
+        from it.
     redis
         A Redis client configured to talk to the backend store.
+    aes_gcm
+        Whether to store objects in the AES-GCM format rather than as Fernet
+        tokens.
+
+    Notes
+    -----
+    Objects may optionally be added to an index when stored.  An index is a
+    Redis set of the keys of the objects added to it, and is updated
+    atomically with storing or deleting the object.  Indexes allow finding or
+    deleting related objects, such as all tokens for a user, without scanning
+    the keyspace.  Objects that expire are not removed from their index until
+    `prune_index` is called, so callers must tolerate index entries for
+    missing objects.
     """
 
-    def __init__(self, content: type[S], key: str, redis: redis.Redis) -> None:
+    def __init__(
+        self,
+        content: type[S],
+        key: str,
+        redis: redis.Redis,
+        *,
+        aes_gcm: bool = False,
+    ) -> None:
         self._content = content
+        self._aes_gcm = aes_gcm
         self._fernet = Fernet(key.encode())
+        hkdf = HKDF(
+            algorithm=SHA256(), length=32, salt=None, info=_AESGCM_INFO
+        )
+        self._aesgcm = AESGCM(hkdf.derive(base64.urlsafe_b64decode(key)))
         self._redis = redis
+        self._store_indexed = redis.register_script(_STORE_INDEXED_SCRIPT)
+        self._delete_indexed = redis.register_script(_DELETE_INDEXED_SCRIPT)
+        self._prune_index = redis.register_script(_PRUNE_INDEX_SCRIPT)
 
-    async def delete(self, key: str) -> bool:
+    async def delete(self, key: str, *, index: Optional[str] = None) -> bool:
         """Delete a stored object.
 
         Parameters
         ----------
         key
             The key to delete.
+        index
+            If given, also remove the key from this index.
 
         Returns
         -------
         bool
             `True` if the key was found and deleted, `False` otherwise.
         """
-        count = await self._redis.delete(key)
+        if not index:
+            count = await self._redis.delete(key)
+            return count > 0
+        async with self._redis.pipeline(transaction=True) as pipeline:
+            pipeline.delete(key)
+            pipeline.srem(index, key)
+            count, _ = await pipeline.execute()
         return count > 0
 
     async def delete_all(self, pattern: str) -> None:
@@ -64,8 +188,63 @@ class RedisStorage(Generic[S]):
         pattern
             Glob pattern matching the keys to purge, such as ``oidc:*``.
         """
+        batch = []
         async for key in self._redis.scan_iter(pattern):
-            await self._redis.delete(key)
+            batch.append(key)
+            if len(batch) >= REDIS_BATCH_SIZE:
+                await self._redis.unlink(*batch)
+                batch = []
+        if batch:
+            await self._redis.unlink(*batch)
+
+    async def delete_index(self, index: str) -> list[str]:
+        """Atomically delete an index and all objects in it.
+
+        Parameters
+        ----------
+        index
+            The index to delete.
+
+        Returns
+        -------
+        list of str
+            Keys that were in the index.  Some of these objects may have
+            already expired or been deleted.
+        """
+        keys = await self._delete_indexed(keys=[index])
+        return [k.decode() for k in keys]
+
+    async def delete_many(
+        self, keys: Iterable[str], *, index: Optional[str] = None
+    ) -> int:
+        """Delete multiple stored objects.
+
+        The keys are unlinked in batches of at most ``REDIS_BATCH_SIZE``, so
+        the deletion as a whole is not atomic.
+
+        Parameters
+        ----------
+        keys
+            The keys to delete.
+        index
+            If given, also remove the keys from this index.
+
+        Returns
+        -------
+        int
+            Number of keys that were found and deleted.
+        """
+        count = 0
+        for batch in _batched(keys, REDIS_BATCH_SIZE):
+            if not index:
+                count += await self._redis.unlink(*batch)
+                continue
+            async with self._redis.pipeline(transaction=True) as pipeline:
+                pipeline.unlink(*batch)
+                pipeline.srem(index, *batch)
+                deleted, _ = await pipeline.execute()
+            count += deleted
+        return count
 
     async def get(self, key: str) -> S | None:
         """Retrieve a stored object.
@@ -90,21 +269,112 @@ class RedisStorage(Generic[S]):
         encrypted_data = await self._redis.get(key)
         if not encrypted_data:
             return None
+        return self._deserialize(key, encrypted_data)
 
-        # Decrypt the data.
-        try:
-            data = self._fernet.decrypt(encrypted_data)
-        except InvalidToken as e:
-            msg = f"Cannot decrypt data for {key}: {str(e)}"
-            raise DeserializeError(msg) from e
+    async def get_many(
+        self, keys: Iterable[str]
+    ) -> dict[str, S | DeserializeError]:
+        """Retrieve multiple stored objects.
 
-        # Deserialize the data.
-        try:
-            return self._content.parse_raw(data.decode())
-        except Exception as e:
-            error = f"{type(e).__name__}: {str(e)}"
-            msg = f"Cannot deserialize data for {key}: {error}"
-            raise DeserializeError(msg) from e
+        The objects are retrieved with one ``MGET`` per batch of at most
+        ``REDIS_BATCH_SIZE`` keys.
+
+        Parameters
+        ----------
+        keys
+            The keys for the objects.
+
+        Returns
+        -------
+        dict
+            Mapping of keys to deserialized objects.  Keys that were not found
+            are omitted.  If the stored object for a key could not be
+            decrypted or deserialized, its value is the corresponding
+            `~gafaelfawr.exceptions.DeserializeError` instead, so that one
+            bad entry does not prevent retrieving the rest.
+        """
+        results: dict[str, S | DeserializeError] = {}
+        for batch in _batched(keys, REDIS_BATCH_SIZE):
+            values = await self._redis.mget(batch)
+            for key, encrypted_data in zip(batch, values):
+                if not encrypted_data:
+                    continue
+                try:
+                    results[key] = self._deserialize(key, encrypted_data)
+                except DeserializeError as e:
+                    results[key] = e
+        return results
+
+    async def get_index(self, index: str) -> list[str]:
+        """Retrieve the keys in an index.
+
+        Parameters
+        ----------
+        index
+            The index.
+
+        Returns
+        -------
+        list of str
+            Keys added to the index.  Some of these objects may have expired
+            or been deleted.
+        """
+        keys = await self._redis.smembers(index)
+        return [k.decode() for k in keys]
+
+    async def get_index_many(
+        self, indexes: Iterable[str]
+    ) -> dict[str, list[str]]:
+        """Retrieve the keys in multiple indexes.
+
+        The indexes are retrieved with one pipeline per batch of at most
+        ``REDIS_BATCH_SIZE`` indexes.
+
+        Parameters
+        ----------
+        indexes
+            The indexes.
+
+        Returns
+        -------
+        dict of list of str
+            Mapping of each index to the keys added to it, as for
+            `get_index`.
+        """
+        results = {}
+        for batch in _batched(indexes, REDIS_BATCH_SIZE):
+            async with self._redis.pipeline(transaction=False) as pipeline:
+                for index in batch:
+                    pipeline.smembers(index)
+                members = await pipeline.execute()
+            for index, keys in zip(batch, members):
+                results[index] = [k.decode() for k in keys]
+        return results
+
+    async def prune_index(self, index: str) -> int:
+        """Remove the keys of objects that no longer exist from an index.
+
+        Objects that expire are not removed from their index when they
+        expire, so this should be called periodically to keep indexes from
+        growing without bound.  The index is scanned with ``SSCAN`` and
+        pruned in batches of at most ``REDIS_BATCH_SIZE`` keys.
+
+        Parameters
+        ----------
+        index
+            The index.
+
+        Returns
+        -------
+        int
+            Number of keys removed from the index.
+        """
+        members = self._redis.sscan_iter(index, count=REDIS_BATCH_SIZE)
+        keys = [k.decode() async for k in members]
+        removed = 0
+        for batch in _batched(keys, REDIS_BATCH_SIZE):
+            removed += await self._prune_index(keys=[index], args=batch)
+        return removed
 
     async def scan(self, pattern: str) -> AsyncIterator[str]:
         """Scan Redis for a given key pattern, returning each key.
@@ -122,7 +392,14 @@ class RedisStorage(Generic[S]):
         async for key in self._redis.scan_iter(match=pattern):
             yield key.decode()
 
-    async def store(self, key: str, obj: S, lifetime: Optional[int]) -> None:
+    async def store(
+        self,
+        key: str,
+        obj: S,
+        lifetime: Optional[int],
+        *,
+        index: Optional[str] = None,
+    ) -> None:
         """Store an object.
 
         Parameters
@@ -135,6 +412,175 @@ class RedisStorage(Generic[S]):
             The object lifetime in seconds.  The object should expire from the
             data store after that many seconds after the current time.  Pass
             `None` if the object should not expire.
+        index
+            If given, also add the key to this index.
+        """
+        value = self._serialize(key, obj)
+        if index:
+            args = (value, "" if lifetime is None else str(lifetime))
+            await self._store_indexed(keys=[key, index], args=args)
+        else:
+            await self._redis.set(key, value, ex=lifetime)
+
+    async def store_many(
+        self, objects: Iterable[tuple[str, S, Optional[int], Optional[str]]]
+    ) -> None:
+        """Store multiple objects.
+
+        The objects are stored with one pipeline per batch of at most
+        ``REDIS_BATCH_SIZE`` objects.  The pipeline is not a transaction, so
+        the objects are not stored atomically, although each object is stored
+        atomically with the update to its index.
+
+        Parameters
+        ----------
+        objects
+            Tuples of the key for an object, the object, its lifetime in
+            seconds (or `None` if it should not expire), and the index to
+            which to add it (or `None`), as for `store`.
+        """
+        for batch in _batched(objects, REDIS_BATCH_SIZE):
+            async with self._redis.pipeline(transaction=False) as pipeline:
+                for key, obj, lifetime, index in batch:
+                    value = self._serialize(key, obj)
+                    if index:
+                        args = (
+                            value,
+                            "" if lifetime is None else str(lifetime),
+                        )
+                        await self._store_indexed(
+                            keys=[key, index], args=args, client=pipeline
+                        )
+                    else:
+                        pipeline.set(key, value, ex=lifetime)
+                await pipeline.execute()
+
+    def _decrypt(self, key: str, value: bytes) -> bytes:
+        """Decrypt a stored value in either storage format.
+
+        Parameters
+        ----------
+        key
+            The key under which the value was stored.
+        value
+            The stored value.
+
+        Returns
+        -------
+        bytes
+            The decrypted serialized object.
+
+        Raises
+        ------
+        cryptography.exceptions.InvalidTag
+            Raised if an AES-GCM value could not be decrypted.
+        cryptography.fernet.InvalidToken
+            Raised if a Fernet value could not be decrypted.
+        """
+        if not value.startswith(_AESGCM_VERSION):
+            return self._fernet.decrypt(value)
+        start = len(_AESGCM_VERSION)
+        nonce = value[start : start + _NONCE_LENGTH]
+        ciphertext = value[start + _NONCE_LENGTH :]
+        return self._aesgcm.decrypt(nonce, ciphertext, key.encode())
+
+    def _deserialize(self, key: str, value: bytes) -> S:
+        """Decrypt and deserialize a stored value.
+
+        Parameters
+        ----------
+        key
+            The key under which the value was stored.
+        value
+            The stored value.
+
+        Returns
+        -------
+        Any
+            The deserialized object.
+
+        Raises
+        ------
+        DeserializeError
+            Raised if the stored object could not be decrypted or
+            deserialized.
+        """
+        try:
+            data = self._decrypt(key, value)
+        except (InvalidTag, InvalidToken) as e:
+            msg = f"Cannot decrypt data for {key}: {type(e).__name__}"
+            raise DeserializeError(msg) from e
+        try:
+            return self._content.parse_raw(data.decode())
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)}"
+            msg = f"Cannot deserialize data for {key}: {error}"
+            raise DeserializeError(msg) from e
+
+    def _serialize(self, key: str, obj: S) -> bytes:
+        """Serialize and encrypt an object for storage.
+
+        Parameters
+        ----------
+        key
+            The key under which the object will be stored.
+        obj
+            The object to store.
+
+        Returns
+        -------
+        bytes
+            The value to store in Redis.
+        """
+        data = obj.json(separators=(",", ":")).encode()
+        if not self._aes_gcm:
+            return self._fernet.encrypt(data)
+        nonce = os.urandom(_NONCE_LENGTH)
+        encrypted_data = self._aesgcm.encrypt(nonce, data, key.encode())
+        return _AESGCM_VERSION + nonce + encrypted_data
+
+
+class RedisStringStorage:
+    """Unencrypted string storage in Redis.
+
+    Only suitable for values that are not secret, such as the key of an
+    object stored elsewhere, which is useless without the stored object.
+
+    Parameters
+    ----------
+    redis
+        A Redis client configured to talk to the backend store.
+    """
+
+    def __init__(self, redis: redis.Redis) -> None:
+        self._redis = redis
+
+    async def get(self, key: str) -> str | None:
+        """Retrieve a stored string.
+
+        Parameters
+        ----------
+        key
+            The key for the string.
+
+        Returns
+        -------
+        str or None
+            The stored string or `None` if no such string could be found.
+        """
+        value = await self._redis.get(key)
+        return value.decode() if value else None
+
+    async def store(self, key: str, value: str, lifetime: int) -> None:
+        """Store a string.
+
+        Parameters
+        ----------
+        key
+            The key for the string.
+        value
+            The string to store.
+        lifetime
+            The lifetime of the string in seconds.
         """
-        encrypted_data = self._fernet.encrypt(obj.json().encode())
-        await self._redis.set(key, encrypted_data, ex=lifetime)
+        await self._redis.set(key, value, ex=lifetime)
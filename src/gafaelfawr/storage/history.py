@@ -2,25 +2,42 @@
 
 from __future__ import annotations
 
+from collections.abc import Iterable
 from datetime import datetime
-from typing import Optional
+from typing import Any, Optional
 
+import redis.asyncio as redis
 from safir.database import datetime_from_db, datetime_to_db
-from sqlalchemy import and_, delete, func, or_
+from sqlalchemy import and_, delete, func, insert, or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import async_scoped_session
 from sqlalchemy.future import select
 from sqlalchemy.sql import Select, text
 
+from ..constants import TOKEN_CHANGE_HISTORY_STREAM
 from ..models.history import (
     AdminHistoryEntry,
     HistoryCursor,
     PaginatedHistory,
+    TokenAuthHistoryEntry,
     TokenChangeHistoryEntry,
 )
 from ..models.token import TokenType
-from ..schema import AdminHistory, TokenChangeHistory
+from ..schema import (
+    AdminHistory,
+    HistoryCheckpoint,
+    TokenAncestor,
+    TokenAuthHistory,
+    TokenChangeHistory,
+)
 
-__all__ = ["AdminHistoryStore", "TokenChangeHistoryStore"]
+__all__ = [
+    "AdminHistoryStore",
+    "HistoryCheckpointStore",
+    "TokenAuthHistoryStore",
+    "TokenChangeHistoryQueue",
+    "TokenChangeHistoryStore",
+]
 
 
 class AdminHistoryStore:
@@ -48,6 +65,219 @@ class AdminHistoryStore:
         self._session.add(new)
 
 
+class HistoryCheckpointStore:
+    """Tracks how much of a queue of history entries has been written.
+
+    Parameters
+    ----------
+    session
+        The database session proxy.
+    """
+
+    def __init__(self, session: async_scoped_session) -> None:
+        self._session = session
+
+    async def lock(self, stream: str) -> str:
+        """Lock the checkpoint for a queue and return it.
+
+        Must be called inside a transaction.  The lock is held until the
+        transaction ends, so only one process writes entries from a queue at
+        a time.
+
+        Parameters
+        ----------
+        stream
+            Name of the queue.
+
+        Returns
+        -------
+        str
+            ID of the last entry written, or ``0-0`` if none have been.
+        """
+        stmt = (
+            select(HistoryCheckpoint.last_id)
+            .where(HistoryCheckpoint.stream == stream)
+            .with_for_update()
+        )
+        last_id = await self._session.scalar(stmt)
+        if last_id is not None:
+            return last_id
+
+        # There is no checkpoint yet.  Another process may be creating it at
+        # the same time, in which case use and lock the one it created.
+        try:
+            async with self._session.begin_nested():
+                checkpoint = HistoryCheckpoint(stream=stream, last_id="0-0")
+                self._session.add(checkpoint)
+        except IntegrityError:
+            result = await self._session.execute(stmt)
+            return result.scalar_one()
+        return "0-0"
+
+    async def update(self, stream: str, last_id: str) -> None:
+        """Update the checkpoint for a queue.
+
+        Must be called in the same transaction as `lock` and the writes of
+        the entries.
+
+        Parameters
+        ----------
+        stream
+            Name of the queue.
+        last_id
+            ID of the last entry written.
+        """
+        stmt = (
+            update(HistoryCheckpoint)
+            .where(HistoryCheckpoint.stream == stream)
+            .values(last_id=last_id)
+        )
+        await self._session.execute(stmt)
+
+
+class TokenAuthHistoryStore:
+    """Stores the history of authentications with tokens.
+
+    Parameters
+    ----------
+    session
+        The database session proxy.
+    """
+
+    def __init__(self, session: async_scoped_session) -> None:
+        self._session = session
+
+    async def add_many(self, entries: Iterable[TokenAuthHistoryEntry]) -> None:
+        """Record authentications in a single bulk insert.
+
+        Parameters
+        ----------
+        entries
+            New entries to add to the database.
+        """
+        rows = []
+        for entry in entries:
+            row = entry.dict()
+            row["scopes"] = ",".join(sorted(entry.scopes))
+            row["event_time"] = datetime_to_db(entry.event_time)
+            rows.append(row)
+        if rows:
+            await self._session.execute(insert(TokenAuthHistory), rows)
+
+    async def delete(self, *, older_than: datetime) -> None:
+        """Delete older entries.
+
+        Parameters
+        ----------
+        older_than
+            Delete entries created prior to this date.
+        """
+        stmt = delete(TokenAuthHistory).where(
+            TokenAuthHistory.event_time < datetime_to_db(older_than)
+        )
+        await self._session.execute(stmt)
+
+
+class TokenChangeHistoryQueue:
+    """Queue of token change history entries waiting to be written.
+
+    The queue is a Redis stream, so entries survive restarts of the process
+    that added them and are written in the order they were added.  Each
+    entry is identified by its stream ID, which only increases.
+
+    Parameters
+    ----------
+    redis
+        Redis client.
+    key
+        Key of the stream.
+    """
+
+    def __init__(
+        self, redis: redis.Redis, key: str = TOKEN_CHANGE_HISTORY_STREAM
+    ) -> None:
+        self._redis = redis
+        self._key = key
+
+    @property
+    def key(self) -> str:
+        """Key of the stream, also used to name its checkpoint."""
+        return self._key
+
+    async def add(self, entry: TokenChangeHistoryEntry) -> None:
+        """Queue a change to a token.
+
+        Parameters
+        ----------
+        entry
+            Entry to queue.
+        """
+        await self._redis.xadd(self._key, {"entry": entry.json()})
+
+    async def add_many(
+        self, entries: Iterable[TokenChangeHistoryEntry]
+    ) -> None:
+        """Queue multiple changes to tokens in one round trip.
+
+        Parameters
+        ----------
+        entries
+            Entries to queue, in order.
+        """
+        async with self._redis.pipeline(transaction=False) as pipeline:
+            for entry in entries:
+                pipeline.xadd(self._key, {"entry": entry.json()})
+            await pipeline.execute()
+
+    async def is_empty(self) -> bool:
+        """Check whether there are any entries in the queue.
+
+        Returns
+        -------
+        bool
+            Whether the queue is empty.
+        """
+        return await self._redis.xlen(self._key) == 0
+
+    async def read(
+        self, after: str, count: int
+    ) -> list[tuple[str, TokenChangeHistoryEntry]]:
+        """Read queued entries in order.
+
+        Parameters
+        ----------
+        after
+            Only return entries after this stream ID.
+        count
+            Maximum number of entries to return.
+
+        Returns
+        -------
+        list of tuple
+            Stream IDs and entries, oldest first.
+        """
+        results = await self._redis.xrange(
+            self._key, min=f"({after}", count=count
+        )
+        return [
+            (i.decode(), TokenChangeHistoryEntry.parse_raw(f[b"entry"]))
+            for i, f in results
+        ]
+
+    async def remove(self, through: str) -> None:
+        """Remove written entries from the queue.
+
+        Parameters
+        ----------
+        through
+            Remove all entries up to and including this stream ID.
+        """
+        async with self._redis.pipeline() as pipeline:
+            pipeline.xtrim(self._key, minid=through, approximate=False)
+            pipeline.xdel(self._key, through)
+            await pipeline.execute()
+
+
 class TokenChangeHistoryStore:
     """Stores and retrieves the history of changes to tokens.
 
@@ -55,10 +285,22 @@ class TokenChangeHistoryStore:
     ----------
     session
         The database session proxy.
+    queue
+        If given, new entries are added to this queue rather than written to
+        the database directly, and are later written to the database in
+        batches by `~gafaelfawr.services.history.TokenChangeHistoryWriter`.
+        Like other Redis writes, this is not part of the database
+        transaction, so an entry may be recorded for a change whose
+        transaction is later rolled back.
     """
 
-    def __init__(self, session: async_scoped_session) -> None:
+    def __init__(
+        self,
+        session: async_scoped_session,
+        queue: Optional[TokenChangeHistoryQueue] = None,
+    ) -> None:
         self._session = session
+        self._queue = queue
 
     async def add(self, entry: TokenChangeHistoryEntry) -> None:
         """Record a change to a token.
@@ -68,19 +310,28 @@ class TokenChangeHistoryStore:
         entry
             New entry to add to the database.
         """
-        entry_dict = entry.dict()
+        if self._queue:
+            await self._queue.add(entry)
+        else:
+            self._session.add(self._to_row(entry))
 
-        # Convert the lists of scopes to the empty string for an empty list
-        # and a comma-separated string otherwise.
-        entry_dict["scopes"] = ",".join(sorted(entry.scopes))
-        if entry.old_scopes is not None:
-            entry_dict["old_scopes"] = ",".join(sorted(entry.old_scopes))
+    async def add_many(
+        self, entries: Iterable[TokenChangeHistoryEntry]
+    ) -> None:
+        """Record multiple changes to tokens at once.
 
-        new = TokenChangeHistory(**entry_dict)
-        new.expires = datetime_to_db(entry.expires)
-        new.old_expires = datetime_to_db(entry.old_expires)
-        new.event_time = datetime_to_db(entry.event_time)
-        self._session.add(new)
+        Entries are added to the queue, if any, in a single round trip, and
+        otherwise inserted into the database in bulk.
+
+        Parameters
+        ----------
+        entries
+            New entries to add, in order.
+        """
+        if self._queue:
+            await self._queue.add_many(entries)
+        else:
+            self._session.add_all([self._to_row(e) for e in entries])
 
     async def delete(self, *, older_than: datetime) -> None:
         """Delete older entries.
@@ -127,8 +378,9 @@ class TokenChangeHistoryStore:
             Limit the results to actions performed by this user.
         key
             Limit the results to this token and any subtokens of this token.
-            Note that this will currently pick up direct subtokens but not
-            subtokens of subtokens.
+            This finds all current subtokens at any depth, but subtokens
+            that have since been deleted are only found if they were direct
+            subtokens of this token.
         token
             Limit the results to only this token.
         token_type
@@ -156,10 +408,14 @@ class TokenChangeHistoryStore:
         if actor:
             stmt = stmt.where(TokenChangeHistory.actor == actor)
         if key:
+            descendants = select(TokenAncestor.descendant).where(
+                TokenAncestor.ancestor == key
+            )
             stmt = stmt.where(
                 or_(
                     TokenChangeHistory.token == key,
                     TokenChangeHistory.parent == key,
+                    TokenChangeHistory.token.in_(descendants),
                 )
             )
         if token:
@@ -188,6 +444,22 @@ class TokenChangeHistoryStore:
         )
         return history
 
+    def _to_row(self, entry: TokenChangeHistoryEntry) -> TokenChangeHistory:
+        """Convert a history entry to a database row."""
+        entry_dict: dict[str, Any] = entry.dict()
+
+        # Convert the lists of scopes to the empty string for an empty list
+        # and a comma-separated string otherwise.
+        entry_dict["scopes"] = ",".join(sorted(entry.scopes))
+        if entry.old_scopes is not None:
+            entry_dict["old_scopes"] = ",".join(sorted(entry.old_scopes))
+
+        row = TokenChangeHistory(**entry_dict)
+        row.expires = datetime_to_db(entry.expires)
+        row.old_expires = datetime_to_db(entry.old_expires)
+        row.event_time = datetime_to_db(entry.event_time)
+        return row
+
     async def _paginated_query(
         self,
         stmt: Select,
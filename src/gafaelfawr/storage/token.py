@@ -2,23 +2,194 @@
 
 from __future__ import annotations
 
+import hashlib
+from collections.abc import Iterable, Mapping
 from datetime import datetime, timezone
+from enum import Enum
+from itertools import islice
 from typing import Optional, cast
 
 from safir.database import datetime_to_db
-from sqlalchemy import delete
+from sqlalchemy import (
+    DateTime,
+    Integer,
+    String,
+    and_,
+    column,
+    delete,
+    insert,
+    literal,
+    or_,
+    tuple_,
+    union_all,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.engine import CursorResult
 from sqlalchemy.ext.asyncio import async_scoped_session
 from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import ColumnElement
+from sqlalchemy.sql.expression import CTE
 from structlog.stdlib import BoundLogger
 
+from ..constants import TOKEN_DELETE_BATCH_SIZE, TOKEN_USAGE_BATCH_SIZE
 from ..exceptions import DeserializeError, DuplicateTokenNameError
 from ..models.token import Token, TokenData, TokenInfo, TokenType
 from ..schema.subtoken import Subtoken
 from ..schema.token import Token as SQLToken
-from .base import RedisStorage
+from ..schema.token_ancestor import TokenAncestor
+from .base import RedisStorage, RedisStringStorage
 
-__all__ = ["TokenDatabaseStore", "TokenRedisStore"]
+__all__ = [
+    "ChildTokenRedisStore",
+    "TokenDatabaseStore",
+    "TokenLookupStatus",
+    "TokenRedisStore",
+]
+
+
+class TokenLookupStatus(Enum):
+    """Result of looking up a token in Redis."""
+
+    found = "found"
+    """The token exists and the secret matches."""
+
+    not_found = "not_found"
+    """There is no data in Redis for the token key."""
+
+    invalid = "invalid"
+    """The data for the token key could not be decrypted or deserialized."""
+
+    mismatch = "mismatch"
+    """The data for the token key does not match the secret of the token."""
+
+
+class ChildTokenRedisStore:
+    """Shared cache in Redis of the keys of internal and notebook tokens.
+
+    Maps the parent token and the requested service and scopes of an
+    internal token, or the parent token of a notebook token, to the key of a
+    matching child token, so that all Gafaelfawr processes can reuse a child
+    token created by any of them without querying the database.  Entries
+    expire with their child tokens.
+
+    Only the key of the child token is stored.  The caller must retrieve the
+    token data and check that the token is still suitable, since the child
+    token may since have been revoked or changed.
+
+    Parameters
+    ----------
+    storage
+        The underlying storage.
+    """
+
+    def __init__(self, storage: RedisStringStorage) -> None:
+        self._storage = storage
+
+    async def get_internal_token_key(
+        self, token_data: TokenData, service: str, scopes: list[str]
+    ) -> str | None:
+        """Retrieve the key of a cached internal child token.
+
+        Parameters
+        ----------
+        token_data
+            The data for the parent token.
+        service
+            The service to which the internal token is delegated.
+        scopes
+            The scopes of the delegated token.
+
+        Returns
+        -------
+        str or None
+            The key of the cached internal token, or `None` if none is
+            cached.
+        """
+        key = self._internal_key(token_data, service, scopes)
+        return await self._storage.get(key)
+
+    async def get_notebook_token_key(
+        self, token_data: TokenData
+    ) -> str | None:
+        """Retrieve the key of a cached notebook child token.
+
+        Parameters
+        ----------
+        token_data
+            The data for the parent token.
+
+        Returns
+        -------
+        str or None
+            The key of the cached notebook token, or `None` if none is
+            cached.
+        """
+        return await self._storage.get(self._notebook_key(token_data))
+
+    async def store_internal_token(
+        self,
+        token_data: TokenData,
+        service: str,
+        scopes: list[str],
+        data: TokenData,
+    ) -> None:
+        """Cache the key of an internal child token.
+
+        Parameters
+        ----------
+        token_data
+            The data for the parent token.
+        service
+            The service to which the internal token is delegated.
+        scopes
+            The scopes of the delegated token.
+        data
+            The data for the internal token.
+        """
+        key = self._internal_key(token_data, service, scopes)
+        await self._store(key, data)
+
+    async def store_notebook_token(
+        self, token_data: TokenData, data: TokenData
+    ) -> None:
+        """Cache the key of a notebook child token.
+
+        Parameters
+        ----------
+        token_data
+            The data for the parent token.
+        data
+            The data for the notebook token.
+        """
+        await self._store(self._notebook_key(token_data), data)
+
+    def _internal_key(
+        self, token_data: TokenData, service: str, scopes: list[str]
+    ) -> str:
+        """Construct the Redis key for an internal token.
+
+        The service and scopes are hashed, since they may contain any
+        characters and would otherwise make the key arbitrarily long.
+        """
+        request = "\0".join([service, *sorted(scopes)])
+        digest = hashlib.sha256(request.encode()).hexdigest()
+        return f"internal-token:{token_data.token.key}:{digest}"
+
+    def _notebook_key(self, token_data: TokenData) -> str:
+        """Construct the Redis key for a notebook token."""
+        return f"notebook-token:{token_data.token.key}"
+
+    async def _store(self, key: str, data: TokenData) -> None:
+        """Store the key of a child token until it expires."""
+        if not data.expires:
+            return
+        now = datetime.now(tz=timezone.utc)
+        lifetime = int((data.expires - now).total_seconds())
+        if lifetime > 0:
+            await self._storage.store(key, data.token.key, lifetime)
 
 
 class TokenDatabaseStore:
@@ -82,6 +253,31 @@ class TokenDatabaseStore:
         if parent:
             subtoken = Subtoken(parent=parent, child=data.token.key)
             self._session.add(subtoken)
+            await self._add_ancestors(data.token.key, parent)
+
+    async def add_missing_ancestors(self) -> int:
+        """Add any parent/child relationships missing from the closure.
+
+        Tokens created by versions of Gafaelfawr that did not maintain the
+        ``token_ancestor`` table have no entries there.  This adds them from
+        the ``subtoken`` table.  Entries that already exist are left alone.
+
+        Returns
+        -------
+        int
+            Number of entries added.
+        """
+        tree = self._subtoken_closure()
+        stmt = (
+            pg_insert(TokenAncestor)
+            .from_select(
+                ["ancestor", "descendant", "depth"],
+                select(tree.c.ancestor, tree.c.descendant, tree.c.depth),
+            )
+            .on_conflict_do_nothing()
+        )
+        result = cast(CursorResult, await self._session.execute(stmt))
+        return result.rowcount
 
     async def delete(self, key: str) -> bool:
         """Delete a token.
@@ -96,6 +292,7 @@ class TokenDatabaseStore:
         bool
             Whether the token was found to be deleted.
         """
+        await self._remove_ancestors([key])
         stmt = delete(SQLToken).where(SQLToken.token == key)
         result = cast(CursorResult, await self._session.execute(stmt))
         return result.rowcount >= 1
@@ -110,33 +307,62 @@ class TokenDatabaseStore:
         """
         now = datetime.utcnow()
 
-        # Start by finding all tokens that have expired and gather their
-        # information, which in turn will be used to construct history entries
-        # by the caller.  This is the same query as get_info, except that it
-        # asks for the information for all the tokens at once, saving database
-        # round trips.
-        deleted = []
-        stmt = (
-            select(SQLToken, Subtoken.parent)
-            .where(SQLToken.expires <= now)
-            .join(Subtoken, Subtoken.child == SQLToken.token, isouter=True)
+        # In the (broken) case that there is a child token with an expiration
+        # ahead of its parent token, this orphans the child token rather than
+        # deleting it.  (In other words, it doesn't implement cascading delete
+        # semantics.)  These anomalies will be caught by a separate audit
+        # pass.
+        return await self._delete_matching(SQLToken.expires <= now)
+
+    async def delete_for_user(self, username: str) -> list[TokenInfo]:
+        """Delete all tokens for a user and all of their descendants.
+
+        Descendants are included even if they are owned by another user.
+
+        Parameters
+        ----------
+        username
+            Owner of the tokens.
+
+        Returns
+        -------
+        list of TokenInfo
+            The deleted tokens.
+        """
+        descendants = (
+            select(TokenAncestor.descendant)
+            .join(SQLToken, SQLToken.token == TokenAncestor.ancestor)
+            .where(SQLToken.username == username)
         )
-        tokens = await self._session.execute(stmt)
-        for token, parent in tokens.all():
-            info = TokenInfo.from_orm(token)
-            info.parent = parent
-            deleted.append(info)
+        return await self._delete_matching(
+            or_(
+                SQLToken.username == username,
+                SQLToken.token.in_(descendants),
+            )
+        )
+
+    async def delete_many(self, keys: Iterable[str]) -> list[TokenInfo]:
+        """Delete multiple tokens.
+
+        This does not cascade to the children of the tokens, which are
+        orphaned if they are not also deleted.
 
-        # Delete the tokens.  In the (broken) case that there is a child token
-        # with an expiration ahead of its parent token, this orphans the child
-        # token rather than deleting it.  (In other words, it doesn't
-        # implement cascading delete semantics.)  These anomalies will be
-        # caught by a separate audit pass.
-        to_delete = [d.token for d in deleted]
-        delete_stmt = delete(SQLToken).where(SQLToken.token.in_(to_delete))
-        await self._session.execute(delete_stmt)
+        Parameters
+        ----------
+        keys
+            The keys of the tokens to delete.
 
-        # Return the info for the deleted tokens.
+        Returns
+        -------
+        list of TokenInfo
+            The deleted tokens.  Keys of tokens that do not exist are
+            ignored.
+        """
+        deleted = []
+        remaining = iter(keys)
+        while batch := list(islice(remaining, TOKEN_DELETE_BATCH_SIZE)):
+            condition = SQLToken.token.in_(batch)
+            deleted.extend(await self._delete_matching(condition))
         return deleted
 
     async def get_children(self, key: str) -> list[str]:
@@ -154,15 +380,13 @@ class TokenDatabaseStore:
             direct child tokens will be at the beginning of the list, and
             other tokens will be listed in a breadth-first search order.
         """
-        all_children: list[str] = []
-        parents = [key]
-        while parents:
-            stmt = select(Subtoken.child).where(Subtoken.parent.in_(parents))
-            result = await self._session.scalars(stmt)
-            children = result.all()
-            all_children.extend(children)
-            parents = list(children)
-        return all_children
+        stmt = (
+            select(TokenAncestor.descendant)
+            .where(TokenAncestor.ancestor == key)
+            .order_by(TokenAncestor.depth)
+        )
+        result = await self._session.scalars(stmt)
+        return list(result.all())
 
     async def get_info(self, key: str) -> TokenInfo | None:
         """Return information about a token.
@@ -292,6 +516,35 @@ class TokenDatabaseStore:
         result = await self._session.scalars(stmt)
         return [TokenInfo.from_orm(t) for t in result.all()]
 
+    async def list_missing_ancestors(self) -> list[TokenInfo]:
+        """List all tokens with ancestors missing from the closure.
+
+        These are tokens whose ``subtoken`` relationships were not recorded
+        in the ``token_ancestor`` table, such as tokens created by older
+        versions of Gafaelfawr during an upgrade.
+
+        Returns
+        -------
+        list of TokenInfo
+            Information about the tokens.
+        """
+        tree = self._subtoken_closure()
+        missing = (
+            select(tree.c.descendant)
+            .join(
+                TokenAncestor,
+                and_(
+                    TokenAncestor.ancestor == tree.c.ancestor,
+                    TokenAncestor.descendant == tree.c.descendant,
+                ),
+                isouter=True,
+            )
+            .where(TokenAncestor.ancestor.is_(None))
+        )
+        stmt = select(SQLToken).where(SQLToken.token.in_(missing))
+        result = await self._session.scalars(stmt)
+        return [TokenInfo.from_orm(t) for t in result.all()]
+
     async def list_orphaned(self) -> list[TokenInfo]:
         """List all orphaned tokens.
 
@@ -390,6 +643,156 @@ class TokenDatabaseStore:
             token.expires = datetime_to_db(expires)
         return TokenInfo.from_orm(token)
 
+    async def update_last_used(self, last_used: Mapping[str, datetime]) -> int:
+        """Record when tokens were last used.
+
+        Updates the tokens in batches with one statement per batch.  A
+        token's last-used time is only changed if the new time is later, so
+        that updates from different processes can be applied in any order.
+        Keys of tokens that no longer exist are ignored.
+
+        Parameters
+        ----------
+        last_used
+            Mapping of token keys to the time each was last used.
+
+        Returns
+        -------
+        int
+            Number of tokens whose last-used time was changed.
+        """
+        updated = 0
+        items = iter(last_used.items())
+        while batch := list(islice(items, TOKEN_USAGE_BATCH_SIZE)):
+            usage = values(
+                column("token", String),
+                column("last_used", DateTime),
+                name="usage",
+            ).data([(k, datetime_to_db(t)) for k, t in batch])
+            stmt = (
+                update(SQLToken)
+                .where(SQLToken.token == usage.c.token)
+                .where(
+                    or_(
+                        SQLToken.last_used.is_(None),
+                        SQLToken.last_used < usage.c.last_used,
+                    )
+                )
+                .values(last_used=usage.c.last_used)
+                .execution_options(synchronize_session=False)
+            )
+            result = cast(CursorResult, await self._session.execute(stmt))
+            updated += result.rowcount
+        return updated
+
+    async def _add_ancestors(self, key: str, parent: str) -> None:
+        """Add the ancestors of a new child token to the closure.
+
+        The ancestors are the parent and all of the ancestors of the parent.
+        """
+        parent_ancestors = select(
+            TokenAncestor.ancestor,
+            literal(key, String),
+            TokenAncestor.depth + 1,
+        ).where(TokenAncestor.descendant == parent)
+        direct = select(
+            literal(parent, String), literal(key, String), literal(1, Integer)
+        )
+        stmt = insert(TokenAncestor).from_select(
+            ["ancestor", "descendant", "depth"],
+            union_all(direct, parent_ancestors),
+        )
+        await self._session.execute(stmt)
+
+    async def _delete_matching(
+        self, condition: ColumnElement[bool]
+    ) -> list[TokenInfo]:
+        """Delete all tokens matching a condition.
+
+        Parameters
+        ----------
+        condition
+            Condition on the token table selecting the tokens to delete.
+
+        Returns
+        -------
+        list of TokenInfo
+            The deleted tokens.
+        """
+        # Start by finding and locking the tokens and gathering their
+        # information, which in turn will be used to construct history entries
+        # by the caller.  This is the same query as get_info, except that it
+        # asks for the information for all the tokens at once, saving database
+        # round trips.
+        deleted = []
+        stmt = (
+            select(SQLToken, Subtoken.parent)
+            .where(condition)
+            .join(Subtoken, Subtoken.child == SQLToken.token, isouter=True)
+            .with_for_update(of=SQLToken)
+        )
+        tokens = await self._session.execute(stmt)
+        for token, parent in tokens.all():
+            info = TokenInfo.from_orm(token)
+            info.parent = parent
+            deleted.append(info)
+
+        # Delete the tokens by key rather than by the condition, since the
+        # condition may depend on the ancestry that is removed first.
+        keys = iter([d.token for d in deleted])
+        while batch := list(islice(keys, TOKEN_DELETE_BATCH_SIZE)):
+            await self._remove_ancestors(batch)
+            delete_stmt = delete(SQLToken).where(SQLToken.token.in_(batch))
+            await self._session.execute(delete_stmt)
+        return deleted
+
+    async def _remove_ancestors(self, keys: list[str]) -> None:
+        """Remove relationships through tokens that are being deleted.
+
+        The rows for the tokens themselves are removed by the cascading
+        delete, but the descendants of a deleted token are orphaned and must
+        also no longer be descendants of its ancestors, matching the
+        ``subtoken`` table.
+        """
+        up = aliased(TokenAncestor)
+        down = aliased(TokenAncestor)
+        through = (
+            select(up.ancestor, down.descendant)
+            .join(down, down.ancestor == up.descendant)
+            .where(up.descendant.in_(keys))
+        )
+        stmt = delete(TokenAncestor).where(
+            tuple_(TokenAncestor.ancestor, TokenAncestor.descendant).in_(
+                through
+            )
+        )
+        await self._session.execute(stmt)
+
+    def _subtoken_closure(self) -> CTE:
+        """Build the closure of the ``subtoken`` relationships.
+
+        Returns
+        -------
+        sqlalchemy.sql.expression.CTE
+            Recursive common table expression with ``ancestor``,
+            ``descendant``, and ``depth`` columns matching the
+            ``token_ancestor`` table.
+        """
+        tree = (
+            select(
+                Subtoken.parent.label("ancestor"),
+                Subtoken.child.label("descendant"),
+                literal(1, Integer).label("depth"),
+            )
+            .where(Subtoken.parent.is_not(None))
+            .cte("tree", recursive=True)
+        )
+        return tree.union_all(
+            select(Subtoken.parent, tree.c.descendant, tree.c.depth + 1)
+            .join(tree, Subtoken.child == tree.c.ancestor)
+            .where(Subtoken.parent.is_not(None))
+        )
+
     async def _check_name_conflict(
         self, username: str, token_name: str
     ) -> None:
@@ -415,6 +818,11 @@ class TokenRedisStore:
     use those keys directly as tokens and still needs access to the stored
     Redis data plus the decryption key to be able to reconstruct a token.
 
+    Each user also has an index of the keys of their tokens stored in Redis,
+    so that all of a user's tokens can be found or deleted without scanning
+    Redis.  The index may contain keys of tokens that have since expired
+    until they are removed by `prune_indexes`.
+
     Parameters
     ----------
     storage
@@ -431,7 +839,7 @@ class TokenRedisStore:
         self._storage = storage
         self._logger = logger
 
-    async def delete(self, key: str) -> bool:
+    async def delete(self, key: str, username: str) -> bool:
         """Delete a token from Redis.
 
         This only requires the token key, not the full token, so that users
@@ -442,17 +850,57 @@ class TokenRedisStore:
         ----------
         key
             The key portion of the token.
+        username
+            Owner of the token.
 
         Returns
         -------
         bool
             `True` if the token was found and deleted, `False` otherwise.
         """
-        return await self._storage.delete(f"token:{key}")
+        index = self._index(username)
+        return await self._storage.delete(f"token:{key}", index=index)
 
     async def delete_all(self) -> None:
         """Delete all stored tokens."""
         await self._storage.delete_all("token:*")
+        await self._storage.delete_all("user-tokens:*")
+
+    async def delete_for_user(self, username: str) -> list[str]:
+        """Atomically delete all tokens for a user from Redis.
+
+        Parameters
+        ----------
+        username
+            Owner of the tokens.
+
+        Returns
+        -------
+        list of str
+            Keys of the user's tokens that were in Redis, possibly including
+            some that had already expired.
+        """
+        keys = await self._storage.delete_index(self._index(username))
+        return [k[len("token:") :] for k in keys]
+
+    async def delete_many(self, keys: Iterable[str], username: str) -> int:
+        """Delete multiple tokens for the same user from Redis.
+
+        Parameters
+        ----------
+        keys
+            The key portions of the tokens.
+        username
+            Owner of the tokens.
+
+        Returns
+        -------
+        int
+            Number of tokens that were found and deleted.
+        """
+        return await self._storage.delete_many(
+            (f"token:{k}" for k in keys), index=self._index(username)
+        )
 
     async def get_data(self, token: Token) -> TokenData | None:
         """Retrieve the data for a token from Redis.
@@ -470,15 +918,7 @@ class TokenRedisStore:
             The data underlying the token, or `None` if the token is not
             valid.
         """
-        data = await self.get_data_by_key(token.key)
-        if not data:
-            return None
-
-        if data.token != token:
-            error = f"Secret mismatch for {token.key}"
-            self._logger.error("Cannot retrieve token data", error=error)
-            return None
-
+        _, data = await self.lookup(token)
         return data
 
     async def get_data_by_key(self, key: str) -> TokenData | None:
@@ -506,6 +946,67 @@ class TokenRedisStore:
             return None
         return data
 
+    async def get_data_many(self, keys: Iterable[str]) -> dict[str, TokenData]:
+        """Retrieve the data for multiple tokens from Redis by key.
+
+        As with `get_data_by_key`, this bypasses the check that the caller is
+        in possession of the secret, and therefore must never be used with
+        user-supplied keys.
+
+        Parameters
+        ----------
+        keys
+            The keys of the tokens.
+
+        Returns
+        -------
+        dict of TokenData
+            Mapping of token keys to the data underlying those tokens.  Keys
+            of tokens that are not valid are omitted.
+        """
+        results = await self._storage.get_many(f"token:{k}" for k in keys)
+        tokens = {}
+        for redis_key, data in results.items():
+            if isinstance(data, DeserializeError):
+                self._logger.error("Cannot retrieve token", error=str(data))
+                continue
+            tokens[redis_key[len("token:") :]] = data
+        return tokens
+
+    async def lookup(
+        self, token: Token
+    ) -> tuple[TokenLookupStatus, TokenData | None]:
+        """Retrieve the data for a token and report why it is not valid.
+
+        This is the same as `get_data` except that it also distinguishes why
+        the token is not valid, since only a token that does not exist at all
+        may be remembered as not existing.
+
+        Parameters
+        ----------
+        token
+            The token.
+
+        Returns
+        -------
+        tuple of TokenLookupStatus and TokenData or None
+            The result of the lookup, and the data underlying the token if it
+            was found and valid.
+        """
+        key = token.key
+        try:
+            data = await self._storage.get(f"token:{key}")
+        except DeserializeError as e:
+            self._logger.error("Cannot retrieve token", error=str(e))
+            return (TokenLookupStatus.invalid, None)
+        if not data:
+            return (TokenLookupStatus.not_found, None)
+        if data.token != token:
+            error = f"Secret mismatch for {key}"
+            self._logger.error("Cannot retrieve token data", error=error)
+            return (TokenLookupStatus.mismatch, None)
+        return (TokenLookupStatus.found, data)
+
     async def list(self) -> list[str]:
         """List all token keys stored in Redis.
 
@@ -519,6 +1020,42 @@ class TokenRedisStore:
             keys.append(key[len("token:") :])
         return keys
 
+    async def list_for_users(
+        self, usernames: Iterable[str]
+    ) -> dict[str, set[str]]:
+        """List the token keys in the indexes of multiple users.
+
+        Parameters
+        ----------
+        usernames
+            Users whose indexes to retrieve.
+
+        Returns
+        -------
+        dict of set of str
+            Mapping of usernames to the token keys in their indexes, possibly
+            including some tokens that have expired.
+        """
+        indexes = {self._index(u): u for u in usernames}
+        results = await self._storage.get_index_many(indexes.keys())
+        return {
+            indexes[index]: {k[len("token:") :] for k in keys}
+            for index, keys in results.items()
+        }
+
+    async def prune_indexes(self) -> int:
+        """Remove the keys of expired tokens from all user token indexes.
+
+        Returns
+        -------
+        int
+            Number of keys removed.
+        """
+        removed = 0
+        async for index in self._storage.scan("user-tokens:*"):
+            removed += await self._storage.prune_index(index)
+        return removed
+
     async def store_data(self, data: TokenData) -> None:
         """Store the data for a token.
 
@@ -527,8 +1064,59 @@ class TokenRedisStore:
         data
             The data underlying that token.
         """
-        lifetime = None
-        if data.expires:
-            now = datetime.now(tz=timezone.utc)
-            lifetime = int((data.expires - now).total_seconds())
-        await self._storage.store(f"token:{data.token.key}", data, lifetime)
+        key = f"token:{data.token.key}"
+        lifetime = self._lifetime(data)
+        index = self._index(data.username)
+        await self._storage.store(key, data, lifetime, index=index)
+
+    async def store_data_many(self, tokens: Iterable[TokenData]) -> None:
+        """Store the data for multiple tokens.
+
+        Parameters
+        ----------
+        tokens
+            The data underlying those tokens.
+        """
+        await self._storage.store_many(
+            (
+                f"token:{d.token.key}",
+                d,
+                self._lifetime(d),
+                self._index(d.username),
+            )
+            for d in tokens
+        )
+
+    def _index(self, username: str) -> str:
+        """Construct the Redis key of the token index for a user.
+
+        Parameters
+        ----------
+        username
+            Owner of the tokens.
+
+        Returns
+        -------
+        str
+            Redis key of the index.
+        """
+        return f"user-tokens:{username}"
+
+    def _lifetime(self, data: TokenData) -> int | None:
+        """Determine the Redis lifetime of a token.
+
+        Parameters
+        ----------
+        data
+            The data underlying the token.
+
+        Returns
+        -------
+        int or None
+            The remaining lifetime of the token in seconds, or `None` if it
+            does not expire.
+        """
+        if not data.expires:
+            return None
+        now = datetime.now(tz=timezone.utc)
+        return int((data.expires - now).total_seconds())
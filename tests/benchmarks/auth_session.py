@@ -0,0 +1,88 @@
+"""Benchmark the per-request cost of database session scaffolding.
+
+Compares the old shape of the request context dependency, which depended on
+Safir's ``db_session_dependency`` and therefore set up and removed the scoped
+database session for every request, with the current shape of
+`~gafaelfawr.dependencies.context.ContextDependency`, which is a single
+dependency that only removes the session if it was used.  Neither route
+touches the database, matching the common ``/auth`` case.  A route with no
+session handling at all is included as a floor.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator
+
+from fastapi import Depends, FastAPI
+from safir.database import create_async_session
+from safir.dependencies.db_session import db_session_dependency
+from safir.dependencies.logger import logger_dependency
+from sqlalchemy.ext.asyncio import async_scoped_session, create_async_engine
+from structlog.stdlib import BoundLogger
+
+from .support import asgi_get, report, time_async
+
+ITERATIONS = 20000
+"""Number of requests to time for each route."""
+
+
+async def main() -> None:
+    # The engine never connects, since no route uses the database.
+    engine = create_async_engine("postgresql+asyncpg://localhost/benchmark")
+    db_session_dependency.override_engine(engine)
+    await db_session_dependency.initialize("", None)
+    lazy_session = await create_async_session(engine)
+
+    # Shape of the old request context dependency: a plain dependency that
+    # depends on the Safir database session dependency.
+    async def eager_context(
+        session: async_scoped_session = Depends(db_session_dependency),
+        logger: BoundLogger = Depends(logger_dependency),
+    ) -> async_scoped_session:
+        return session
+
+    # Shape of the new request context dependency: a single dependency that
+    # only tears down the scoped session if it was used.
+    async def lazy_context(
+        logger: BoundLogger = Depends(logger_dependency),
+    ) -> AsyncIterator[async_scoped_session]:
+        try:
+            yield lazy_session
+        finally:
+            if lazy_session.registry.has():
+                await lazy_session.remove()
+
+    app = FastAPI()
+
+    @app.get("/none")
+    async def none_route(
+        logger: BoundLogger = Depends(logger_dependency),
+    ) -> dict[str, str]:
+        return {}
+
+    @app.get("/eager")
+    async def eager_route(
+        session: async_scoped_session = Depends(eager_context),
+    ) -> dict[str, str]:
+        return {}
+
+    @app.get("/lazy")
+    async def lazy_route(
+        session: async_scoped_session = Depends(lazy_context),
+    ) -> dict[str, str]:
+        return {}
+
+    results = {}
+    for route in ("eager", "lazy", "none"):
+        path = f"/{route}"
+        assert await asgi_get(app, path) == 200
+        results[route] = await time_async(
+            lambda: asgi_get(app, path), ITERATIONS
+        )
+    report(results)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
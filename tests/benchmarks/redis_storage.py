@@ -0,0 +1,110 @@
+"""Benchmark encryption and serialization of objects stored in Redis.
+
+Compares the previous storage format of `~gafaelfawr.storage.base.RedisStorage`
+(Fernet over pydantic JSON) with the current format (AES-GCM over compact
+JSON, without base64 encoding) for token data with increasing numbers of
+groups.  Redis is replaced by an in-memory dictionary so that only the cost of
+encryption and serialization is measured.  Old-format reads go through the
+same ``get`` method, since it still accepts Fernet values.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import timedelta
+from typing import Any, Optional, cast
+
+import redis.asyncio as redis
+from cryptography.fernet import Fernet
+from safir.datetime import current_datetime
+
+from gafaelfawr.models.token import Token, TokenData, TokenGroup, TokenType
+from gafaelfawr.storage.base import RedisStorage
+
+from .support import report, time_async
+
+ITERATIONS = 2000
+"""Number of operations to time for each case."""
+
+GROUP_COUNTS = (10, 100, 500)
+"""Numbers of groups in the stored token data."""
+
+
+class MemoryRedis:
+    """Minimal in-memory stand-in for the Redis client methods used."""
+
+    def __init__(self) -> None:
+        self.data: dict[str, bytes] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self.data.get(key)
+
+    async def set(self, key: str, value: bytes, **kwargs: Any) -> None:
+        self.data[key] = value
+
+    def register_script(self, script: str) -> None:
+        return None
+
+
+def make_token_data(groups: int) -> TokenData:
+    """Create token data for a user with the given number of groups."""
+    now = current_datetime()
+    return TokenData(
+        token=Token(),
+        username="some-user",
+        token_type=TokenType.session,
+        scopes=["exec:notebook", "read:all", "user:token"],
+        created=now,
+        expires=now + timedelta(days=7),
+        name="Some User",
+        email="some-user@example.com",
+        uid=45613,
+        gid=45613,
+        groups=[
+            TokenGroup(name=f"group-{i}", id=100000 + i) for i in range(groups)
+        ],
+    )
+
+
+async def main() -> None:
+    key = Fernet.generate_key()
+    fernet = Fernet(key)
+    backend = MemoryRedis()
+    client = cast(redis.Redis, backend)
+    storage = RedisStorage(TokenData, key.decode(), client, aes_gcm=True)
+
+    for count in GROUP_COUNTS:
+        data = make_token_data(count)
+        old_key = f"token:old-{count}"
+        new_key = f"token:new-{count}"
+
+        async def store_old() -> None:
+            backend.data[old_key] = fernet.encrypt(data.json().encode())
+
+        async def store_new() -> None:
+            await storage.store(new_key, data, None)
+
+        await store_old()
+        await store_new()
+        assert await storage.get(old_key) == data
+        assert await storage.get(new_key) == data
+        old_size = len(backend.data[old_key])
+        new_size = len(backend.data[new_key])
+        print(f"{count} groups: {old_size} -> {new_size} bytes")
+        report(
+            {
+                "store (old)": await time_async(store_old, ITERATIONS),
+                "store (new)": await time_async(store_new, ITERATIONS),
+                "get (old)": await time_async(
+                    lambda: storage.get(old_key), ITERATIONS
+                ),
+                "get (new)": await time_async(
+                    lambda: storage.get(new_key), ITERATIONS
+                ),
+            }
+        )
+        print()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""Benchmark the state cookie middleware for bearer-token requests.
+
+Compares the previous implementation of
+`~gafaelfawr.middleware.state.StateMiddleware`, which was based on
+``BaseHTTPMiddleware`` and always decrypted the state cookie, with the current
+pure ASGI implementation that only decrypts the cookie if the request state is
+used.  The route mimics ``/auth`` authenticated by a bearer token, which never
+looks at the state cookie.  Requests are timed both without a cookie and with
+a cookie that the route ignores, which is common when a browser sends both.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import json
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Optional, Self
+
+from cryptography.fernet import Fernet
+from fastapi import FastAPI, Request, Response
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from gafaelfawr.middleware.state import BaseState, StateMiddleware
+
+from .support import asgi_get, report, time_async
+
+ITERATIONS = 10000
+"""Number of requests to time for each case."""
+
+_FERNET = Fernet(Fernet.generate_key())
+"""Key used to encrypt the benchmark state cookie."""
+
+
+@dataclass
+class BenchmarkState(BaseState):
+    """Minimal state class using the same encryption as the real one."""
+
+    csrf: Optional[str] = None
+
+    @classmethod
+    def from_cookie(cls, cookie: str, request: Request) -> Self:
+        data = json.loads(_FERNET.decrypt(cookie.encode()).decode())
+        return cls(csrf=data.get("csrf"))
+
+    def to_cookie(self) -> str:
+        data = json.dumps({"csrf": self.csrf}).encode()
+        return _FERNET.encrypt(data).decode()
+
+
+class OldStateMiddleware(BaseHTTPMiddleware):
+    """The previous implementation of the state middleware."""
+
+    def __init__(self, app: FastAPI) -> None:
+        super().__init__(app)
+
+    async def dispatch(
+        self,
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]],
+    ) -> Response:
+        if "state" in request.cookies:
+            cookie = request.cookies["state"]
+            state = BenchmarkState.from_cookie(cookie, request)
+        else:
+            state = BenchmarkState()
+        request.state.cookie = copy.copy(state)
+        response = await call_next(request)
+        if request.state.cookie != state:
+            cookie = request.state.cookie.to_cookie()
+            response.set_cookie("state", cookie, secure=True, httponly=True)
+        return response
+
+
+def build_app(new: bool) -> FastAPI:
+    """Build the benchmark application with the old or new middleware."""
+    app = FastAPI()
+
+    @app.get("/auth")
+    async def get_auth(request: Request) -> dict[str, str]:
+        assert request.headers["Authorization"].startswith("Bearer ")
+        return {"status": "ok"}
+
+    if new:
+        app.add_middleware(
+            StateMiddleware, cookie_name="state", state_class=BenchmarkState
+        )
+    else:
+        app.add_middleware(OldStateMiddleware)
+    return app
+
+
+async def main() -> None:
+    bearer = (b"authorization", b"Bearer gt-benchmark.token")
+    cookie = BenchmarkState(csrf="some-csrf-token").to_cookie()
+    with_cookie = [bearer, (b"cookie", f"state={cookie}".encode())]
+
+    results = {}
+    for name, new in (("old", False), ("new", True)):
+        app = build_app(new)
+        for suffix, headers in (("bearer", [bearer]), ("cookie", with_cookie)):
+            assert await asgi_get(app, "/auth", headers) == 200
+            results[f"{name} ({suffix})"] = await time_async(
+                lambda: asgi_get(app, "/auth", headers), ITERATIONS
+            )
+    report(results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
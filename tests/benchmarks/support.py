@@ -0,0 +1,120 @@
+"""Helpers for micro-benchmarks.
+
+The benchmarks in this package are not run as part of the test suite.  Run
+them from the top of the source tree with, for example:
+
+.. code-block:: shell
+
+   python -m tests.benchmarks.auth_session
+
+They drive ASGI applications directly, without an HTTP client or server, so
+that the measured time is dominated by Gafaelfawr's own request handling.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from starlette.types import ASGIApp, Message
+
+__all__ = ["asgi_get", "report", "time_async"]
+
+
+async def asgi_get(
+    app: ASGIApp, path: str, headers: list[tuple[bytes, bytes]] | None = None
+) -> int:
+    """Send a single GET request directly to an ASGI application.
+
+    Parameters
+    ----------
+    app
+        ASGI application to call.
+    path
+        Path of the request, optionally including a query string.
+    headers
+        Additional request headers.
+
+    Returns
+    -------
+    int
+        HTTP status code of the response.
+    """
+    path, _, query = path.partition("?")
+    scope: dict[str, Any] = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "https",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"localhost"), *(headers or [])],
+        "client": ("127.0.0.1", 12345),
+        "server": ("localhost", 443),
+    }
+    status = 0
+    request_sent = False
+    response_complete = asyncio.Event()
+
+    async def receive() -> Message:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif not message.get("more_body", False):
+            response_complete.set()
+
+    await app(scope, receive, send)
+    return status
+
+
+async def time_async(
+    func: Callable[[], Awaitable[Any]], iterations: int
+) -> float:
+    """Time repeated calls to an async function.
+
+    Parameters
+    ----------
+    func
+        Function to call.
+    iterations
+        Number of times to call it.
+
+    Returns
+    -------
+    float
+        Mean time per call in microseconds.
+    """
+    for _ in range(min(iterations, 100)):
+        await func()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await func()
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def report(results: dict[str, float]) -> None:
+    """Print benchmark results relative to the first result.
+
+    Parameters
+    ----------
+    results
+        Mapping of benchmark names to mean time per call in microseconds.
+    """
+    baseline = next(iter(results.values()))
+    width = max(len(n) for n in results)
+    for name, result in results.items():
+        ratio = result / baseline
+        print(f"{name:<{width}}  {result:9.1f} µs/call  {ratio:5.2f}x")
@@ -0,0 +1,153 @@
+"""Tests for the shared caches."""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from gafaelfawr.cache import LDAPCache, approximate_size
+from gafaelfawr.constants import LDAP_CACHE_SIZE
+from gafaelfawr.models.ldap import LDAPUserData
+from gafaelfawr.models.token import TokenGroup
+
+STRESS_USERS = 100_000
+"""Number of distinct users for the lock stress test."""
+
+
+@pytest.mark.asyncio
+async def test_lock_pruning() -> None:
+    cache = LDAPCache(list[str])
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def hold() -> None:
+        async with await cache.lock("some-user"):
+            started.set()
+            await release.wait()
+
+    # A lock is kept while it is held or waited on, and discarded after.
+    first = asyncio.create_task(hold())
+    await started.wait()
+    second = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    assert len(cache._user_locks) == 1
+    release.set()
+    await asyncio.gather(first, second)
+    assert cache._user_locks == {}
+
+    # Cancelling a waiter also discards its reference to the lock.
+    release.clear()
+    started.clear()
+    first = asyncio.create_task(hold())
+    await started.wait()
+    second = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    second.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await second
+    release.set()
+    await first
+    assert cache._user_locks == {}
+
+
+@pytest.mark.asyncio
+async def test_metrics() -> None:
+    cache = LDAPCache(list[str])
+    assert cache.get("some-user") is None
+    cache.store("some-user", ["foo"])
+    assert cache.get("some-user") == ["foo"]
+    assert cache.get("some-user") == ["foo"]
+    stats = cache.statistics("test")
+    assert stats.name == "test"
+    assert stats.size == 1
+    assert stats.max_size == LDAP_CACHE_SIZE
+    assert stats.hits == 2
+    assert stats.misses == 1
+    assert stats.evictions == 0
+    assert stats.lock_waits == 0
+
+    # Filling the cache evicts the oldest entries.
+    for n in range(LDAP_CACHE_SIZE + 2):
+        cache.store(f"user{n}", [])
+    stats = cache.statistics("test")
+    assert stats.size == LDAP_CACHE_SIZE
+    assert stats.evictions == 3
+
+    # Only lock requests that have to wait are counted.
+    async def wait() -> None:
+        async with await cache.lock("some-user"):
+            pass
+
+    async with await cache.lock("some-user"):
+        waiter = asyncio.create_task(wait())
+        await asyncio.sleep(0.01)
+    await waiter
+    stats = cache.statistics("test")
+    assert stats.lock_waits == 1
+    assert stats.lock_wait_seconds > 0
+
+
+def test_approximate_size() -> None:
+    groups = [TokenGroup(name=f"group-{n}", id=1000 + n) for n in range(10)]
+    assert approximate_size(groups) > sum(len(g.name) for g in groups)
+
+    # The contents of dataclasses are included.
+    empty = LDAPUserData()
+    data = LDAPUserData(
+        name="Some User" * 100, email="user@example.com", uid=1000, gid=1000
+    )
+    assert approximate_size(data) > approximate_size(empty) + 900
+    assert approximate_size((1, data)) > approximate_size(data)
+
+
+def test_memory_limit() -> None:
+    groups = [TokenGroup(name=f"group-{n}", id=1000 + n) for n in range(10)]
+    size = approximate_size((1, groups))
+    assert size > sum(len(g.name) for g in groups)
+    cache = LDAPCache(list[TokenGroup], size=1, memory=size * 3)
+
+    # The entry count is ignored in favor of the memory limit.
+    for n in range(3):
+        cache.store(f"user{n}", groups)
+    stats = cache.statistics("test")
+    assert stats.size == 3
+    assert stats.max_size is None
+    assert stats.memory == size * 3
+    assert stats.max_memory == size * 3
+    assert stats.evictions == 0
+    cache.store("user3", groups)
+    stats = cache.statistics("test")
+    assert stats.size == 3
+    assert stats.evictions == 1
+    assert cache.get("user0") is None
+
+    # Entries too large for the whole cache are not cached and remove any
+    # older data for that user.
+    big_groups = groups * 4
+    cache.store("user1", big_groups)
+    assert cache.get("user1") is None
+    assert cache.get("user2") == groups
+
+
+@pytest.mark.asyncio
+async def test_lock_stress() -> None:
+    """Locks for many distinct users are concurrent and not retained."""
+    cache = LDAPCache(list[str])
+    held = 0
+    all_held = asyncio.Event()
+
+    async def hold(username: str) -> None:
+        nonlocal held
+        async with await cache.lock(username):
+            held += 1
+            if held == STRESS_USERS:
+                all_held.set()
+            await all_held.wait()
+
+    # Every task holds its lock until all tasks hold their locks, which would
+    # deadlock if locks for different users were serialized.
+    tasks = [hold(f"user{n}") for n in range(STRESS_USERS)]
+    await asyncio.wait_for(asyncio.gather(*tasks), 60)
+    assert held == STRESS_USERS
+    assert cache._user_locks == {}
@@ -32,6 +32,7 @@ from gafaelfawr.models.history import TokenChange, TokenChangeHistoryEntry
 from gafaelfawr.models.oidc import OIDCAuthorizationCode
 from gafaelfawr.models.token import Token, TokenData, TokenType, TokenUserInfo
 from gafaelfawr.schema import Base
+from gafaelfawr.schema.subtoken import Subtoken
 from gafaelfawr.storage.history import TokenChangeHistoryStore
 from gafaelfawr.storage.token import TokenDatabaseStore
 
@@ -237,6 +238,14 @@ def test_maintenance(
         created=now - timedelta(minutes=60),
         expires=now + timedelta(minutes=30),
     )
+    child_token_data = TokenData(
+        token=Token(),
+        username="some-user",
+        token_type=TokenType.internal,
+        scopes=["read:all"],
+        created=now - timedelta(minutes=60),
+        expires=now + timedelta(minutes=30),
+    )
     old_history_entry = TokenChangeHistoryEntry(
         token=Token().key,
         username="other-user",
@@ -258,6 +267,15 @@ def test_maintenance(
                 history_store = TokenChangeHistoryStore(factory.session)
                 await history_store.add(old_history_entry)
 
+                # Add a child token recorded only in the subtoken table, as if
+                # created by an older version of Gafaelfawr.
+                await token_store.add(child_token_data, service="a-service")
+                subtoken = Subtoken(
+                    parent=new_token_data.token.key,
+                    child=child_token_data.token.key,
+                )
+                factory.session.add(subtoken)
+
     event_loop.run_until_complete(initialize())
     runner = CliRunner()
     result = runner.invoke(main, ["maintenance"])
@@ -272,6 +290,10 @@ def test_maintenance(
                 history_store = TokenChangeHistoryStore(factory.session)
                 history = await history_store.list(username="other-user")
                 assert history.entries == []
+                children = await token_store.get_children(
+                    new_token_data.token.key
+                )
+                assert children == [child_token_data.token.key]
 
     event_loop.run_until_complete(check_database())
 
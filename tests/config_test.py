@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+from datetime import timedelta
 from pathlib import Path
 
 import pytest
@@ -9,6 +10,7 @@ import yaml
 from pydantic import ValidationError
 
 from gafaelfawr.config import Config, Settings
+from gafaelfawr.constants import AUTH_HISTORY_BUFFER_SIZE, LDAP_CACHE_SIZE
 from gafaelfawr.exceptions import InvalidTokenError
 from gafaelfawr.models.token import Token
 
@@ -82,3 +84,35 @@ def test_config_invalid_token(tmp_path: Path) -> None:
     )
     with pytest.raises(InvalidTokenError):
         Config.from_file(path)
+
+
+def test_config_cache(tmp_path: Path) -> None:
+    path = build_config(tmp_path, "github")
+    config = Config.from_file(path)
+    assert config.cache.ldap_size == LDAP_CACHE_SIZE
+    assert config.cache.ldap_memory is None
+
+    cache = "{ldapSize: 20000, ldapMemory: 67108864, tokenDataLifetime: 10}"
+    path = build_config(tmp_path, "github", cache=cache)
+    config = Config.from_file(path)
+    assert config.cache.ldap_size == 20000
+    assert config.cache.ldap_memory == 67108864
+    assert config.cache.token_data_lifetime == timedelta(seconds=10)
+
+    path = build_config(tmp_path, "github", cache="{quotaSize: 0}")
+    with pytest.raises(ValidationError):
+        Config.from_file(path)
+
+
+def test_config_auth_history(tmp_path: Path) -> None:
+    path = build_config(tmp_path, "github")
+    config = Config.from_file(path)
+    assert config.auth_history_buffer_size == AUTH_HISTORY_BUFFER_SIZE
+
+    path = build_config(tmp_path, "github", authHistoryBufferSize="0")
+    config = Config.from_file(path)
+    assert config.auth_history_buffer_size == 0
+
+    path = build_config(tmp_path, "github", authHistoryBufferSize="-1")
+    with pytest.raises(ValidationError):
+        Config.from_file(path)
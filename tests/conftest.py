@@ -15,7 +15,6 @@ from asgi_lifespan import LifespanManager
 from fastapi import FastAPI
 from httpx import AsyncClient
 from safir.database import create_database_engine, initialize_database
-from safir.dependencies.db_session import db_session_dependency
 from safir.testing.slack import MockSlackWebhook, mock_slack_webhook
 from seleniumwire import webdriver
 from sqlalchemy import text
@@ -24,6 +23,7 @@ from sqlalchemy.ext.asyncio import AsyncEngine
 from gafaelfawr.config import Config
 from gafaelfawr.constants import COOKIE_NAME
 from gafaelfawr.dependencies.config import config_dependency
+from gafaelfawr.dependencies.context import context_dependency
 from gafaelfawr.factory import Factory
 from gafaelfawr.main import create_app
 from gafaelfawr.models.state import State
@@ -49,7 +49,7 @@ async def app(
     Wraps the application in a lifespan manager so that startup and shutdown
     events are sent during test execution.
     """
-    db_session_dependency.override_engine(engine)
+    context_dependency.override_engine(engine)
     app = create_app()
     async with LifespanManager(app):
         yield app
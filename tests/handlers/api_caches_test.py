@@ -0,0 +1,75 @@
+"""Tests for the ``/auth/api/v1/caches`` routes."""
+
+from __future__ import annotations
+
+import pytest
+from httpx import AsyncClient
+
+from gafaelfawr.factory import Factory
+
+from ..support.tokens import create_session_token
+
+
+@pytest.mark.asyncio
+async def test_get_caches(client: AsyncClient, factory: Factory) -> None:
+    r = await client.get("/auth/api/v1/caches")
+    assert r.status_code == 401
+
+    token_data = await create_session_token(factory)
+    r = await client.get(
+        "/auth/api/v1/caches",
+        headers={"Authorization": f"bearer {token_data.token}"},
+    )
+    assert r.status_code == 403
+
+    token_data = await create_session_token(factory, scopes=["admin:token"])
+    r = await client.get(
+        "/auth/api/v1/caches",
+        headers={"Authorization": f"bearer {token_data.token}"},
+    )
+    assert r.status_code == 200
+    caches = {c["name"]: c for c in r.json()}
+    assert sorted(caches) == sorted(factory._context.caches())
+    assert caches["token_data"]["size"] >= 1
+    assert caches["token_data"]["misses"] >= 1
+    assert caches["missing_token"]["size"] == 0
+    assert caches["ldap_user"] == {
+        "name": "ldap_user",
+        "size": 0,
+        "max_size": caches["ldap_user"]["max_size"],
+        "memory": None,
+        "max_memory": None,
+        "hits": 0,
+        "misses": 0,
+        "stale_hits": 0,
+        "evictions": 0,
+        "expirations": 0,
+        "lock_waits": 0,
+        "lock_wait_seconds": 0.0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_delete_user_caches(
+    client: AsyncClient, factory: Factory
+) -> None:
+    user_data = await create_session_token(factory, username="some-user")
+    token_service = factory.create_token_service()
+    assert await token_service.get_data_cached(user_data.token)
+    ldap_cache = factory._context.ldap_group_name_cache
+    ldap_cache.store("some-user", ["foo"])
+
+    r = await client.delete(
+        "/auth/api/v1/caches/users/some-user",
+        headers={"Authorization": f"bearer {user_data.token}"},
+    )
+    assert r.status_code == 403
+
+    token_data = await create_session_token(factory, scopes=["admin:token"])
+    r = await client.delete(
+        "/auth/api/v1/caches/users/some-user",
+        headers={"Authorization": f"bearer {token_data.token}"},
+    )
+    assert r.status_code == 204
+    assert ldap_cache.get("some-user") is None
+    assert not factory._context.token_data_cache.get(user_data.token)
@@ -45,7 +45,7 @@ async def test_login(
         "scopes": ["exec:admin", "read:all"],
         "config": {"scopes": expected_scopes},
     }
-    state = await State.from_cookie(r.cookies[COOKIE_NAME])
+    state = State.from_cookie(r.cookies[COOKIE_NAME])
     assert state.csrf == data["csrf"]
     assert state.token == token_data.token
 
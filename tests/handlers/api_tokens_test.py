@@ -1546,3 +1546,36 @@ async def test_ldap_error(
             ]
         },
     ]
+
+
+@pytest.mark.asyncio
+async def test_delete_all(client: AsyncClient, factory: Factory) -> None:
+    token_data = await create_session_token(factory, scopes=["user:token"])
+    token_service = factory.create_token_service()
+    async with factory.session.begin():
+        user_token = await token_service.create_user_token(
+            token_data,
+            token_data.username,
+            token_name="some token",
+            scopes=[],
+            ip_address="127.0.0.1",
+        )
+    url = f"/auth/api/v1/users/{token_data.username}/tokens"
+
+    # Users cannot revoke all of their own tokens.
+    csrf = await set_session_cookie(client, token_data.token)
+    r = await client.delete(url, headers={"X-CSRF-Token": csrf})
+    assert r.status_code == 403
+
+    admin_token_data = await create_session_token(
+        factory, username="admin", scopes=["admin:token"]
+    )
+    csrf = await set_session_cookie(client, admin_token_data.token)
+    r = await client.delete(url, headers={"X-CSRF-Token": csrf})
+    assert r.status_code == 204
+    assert await token_service.get_data(token_data.token) is None
+    assert await token_service.get_data(user_token) is None
+
+    r = await client.get(url)
+    assert r.status_code == 200
+    assert r.json() == []
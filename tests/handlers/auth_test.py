@@ -5,18 +5,27 @@ from __future__ import annotations
 import base64
 from datetime import timedelta
 from pathlib import Path
+from typing import Any
 from unittest.mock import ANY
 
 import pytest
+from fastapi.exceptions import RequestValidationError
 from httpx import AsyncClient
 from safir.datetime import current_datetime
 from safir.testing.slack import MockSlackWebhook
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.future import select
 
 from gafaelfawr.config import Config
 from gafaelfawr.constants import COOKIE_NAME, MINIMUM_LIFETIME
+from gafaelfawr.exceptions import InvalidDelegateToError
 from gafaelfawr.factory import Factory
+from gafaelfawr.handlers.auth import parse_auth_config
 from gafaelfawr.models.auth import AuthError, AuthErrorChallenge, AuthType
+from gafaelfawr.models.history import TokenAuthHistoryEntry
 from gafaelfawr.models.token import Token, TokenUserInfo
+from gafaelfawr.schema import TokenAuthHistory
 
 from ..support.config import reconfigure
 from ..support.constants import TEST_HOSTNAME
@@ -87,6 +96,27 @@ async def test_invalid(
     assert mock_slack.messages == []
 
 
+def test_parse_auth_config() -> None:
+    query = b"scope=read:all&scope=exec:admin&notebook=true"
+    auth_config = parse_auth_config(query)
+    assert auth_config.scopes == {"read:all", "exec:admin"}
+    assert auth_config.notebook
+    assert auth_config.minimum_lifetime == MINIMUM_LIFETIME
+    assert parse_auth_config(query) is auth_config
+
+    query = b"scope=read:all&delegate_to=foo&delegate_scope=a,%20b"
+    auth_config = parse_auth_config(query)
+    assert auth_config.delegate_to == "foo"
+    assert auth_config.delegate_scopes == {"a", "b"}
+
+    # Invalid query strings are rejected every time.
+    for _ in range(2):
+        with pytest.raises(RequestValidationError):
+            parse_auth_config(b"scope=read:all&satisfy=foo")
+        with pytest.raises(InvalidDelegateToError):
+            parse_auth_config(b"scope=read:all&notebook=true&delegate_to=a")
+
+
 @pytest.mark.asyncio
 async def test_invalid_auth(
     client: AsyncClient, config: Config, mock_slack: MockSlackWebhook
@@ -242,6 +272,43 @@ async def test_success_minimal(client: AsyncClient, factory: Factory) -> None:
     assert "X-Auth-Request-Email" not in r.headers
 
 
+@pytest.mark.asyncio
+async def test_no_database(
+    client: AsyncClient, engine: AsyncEngine, factory: Factory
+) -> None:
+    token_data = await create_session_token(
+        factory, group_names=["admin"], scopes=["exec:admin", "read:all"]
+    )
+    checkouts = []
+
+    def record_checkout(*args: Any) -> None:
+        checkouts.append(args)
+
+    event.listen(engine.sync_engine, "checkout", record_checkout)
+    try:
+        # Simple authentication checks should not use the database.
+        r = await client.get(
+            "/auth",
+            params={"scope": "exec:admin"},
+            headers={"Authorization": f"Bearer {token_data.token}"},
+        )
+        assert r.status_code == 200
+        r = await client.get("/auth/anonymous")
+        assert r.status_code == 200
+        assert checkouts == []
+
+        # Creating a notebook token does.
+        r = await client.get(
+            "/auth",
+            params={"scope": "exec:admin", "notebook": "true"},
+            headers={"Authorization": f"Bearer {token_data.token}"},
+        )
+        assert r.status_code == 200
+        assert checkouts
+    finally:
+        event.remove(engine.sync_engine, "checkout", record_checkout)
+
+
 @pytest.mark.asyncio
 async def test_notebook(client: AsyncClient, factory: Factory) -> None:
     token_data = await create_session_token(
@@ -1035,3 +1102,51 @@ async def test_ldap_error(
     # We should not report any error message to Slack, however. If we did, we
     # would risk drowning the alert channel during an LDAP outage.
     assert mock_slack.messages == []
+
+
+@pytest.mark.asyncio
+async def test_auth_history(
+    tmp_path: Path, client: AsyncClient, factory: Factory
+) -> None:
+    await reconfigure(tmp_path, "github", factory)
+    token_data = await create_session_token(
+        factory, scopes=["read:all", "exec:admin"]
+    )
+    r = await client.get(
+        "/auth",
+        params={"scope": ["read:all", "exec:admin"], "delegate_to": "service"},
+        headers={
+            "Authorization": f"Bearer {token_data.token}",
+            "X-Forwarded-For": "192.0.2.1",
+        },
+    )
+    assert r.status_code == 200
+
+    # Failed authentications are not recorded.
+    r = await client.get(
+        "/auth",
+        params={"scope": "admin:token"},
+        headers={"Authorization": f"Bearer {token_data.token}"},
+    )
+    assert r.status_code == 403
+
+    # Reconfiguring stops the background writer, which writes any buffered
+    # entries.
+    await reconfigure(tmp_path, "github", factory, authHistoryBufferSize="0")
+    async with factory.session.begin():
+        result = await factory.session.scalars(select(TokenAuthHistory))
+        entries = [TokenAuthHistoryEntry.from_orm(r) for r in result.all()]
+    assert len(entries) == 1
+    assert entries[0].token == token_data.token.key
+    assert entries[0].scopes == ["exec:admin", "read:all"]
+    assert entries[0].service == "service"
+    assert entries[0].ip_address == "192.0.2.1"
+
+    # With a buffer size of zero, authentications are not recorded.
+    assert not factory._context.token_auth_history_buffer
+    r = await client.get(
+        "/auth",
+        params={"scope": "read:all"},
+        headers={"Authorization": f"Bearer {token_data.token}"},
+    )
+    assert r.status_code == 200
@@ -18,3 +18,12 @@ async def test_get_index(client: AsyncClient, config: Config) -> None:
     assert isinstance(data["description"], str)
     assert isinstance(data["repository_url"], str)
     assert isinstance(data["documentation_url"], str)
+
+
+@pytest.mark.asyncio
+async def test_get_metrics(client: AsyncClient, config: Config) -> None:
+    r = await client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["Content-Type"].startswith("text/plain")
+    assert "# TYPE gafaelfawr_cache_hits_total counter" in r.text
+    assert 'gafaelfawr_cache_entries{cache="ldap_user"} 0' in r.text
@@ -0,0 +1,95 @@
+"""Tests for cross-process cache invalidation."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from gafaelfawr.config import Config
+from gafaelfawr.factory import Factory
+from gafaelfawr.models.token import TokenData, TokenUserInfo
+
+from .support.tokens import create_session_token
+
+
+async def wait_for_eviction(factory: Factory, data: TokenData) -> None:
+    """Wait for an invalidation event to evict a cached token."""
+    cache = factory._context.token_data_cache
+    for _ in range(50):
+        if not cache.get(data.token):
+            return
+        await asyncio.sleep(0.1)
+    raise AssertionError("Token data was never evicted from the cache")
+
+
+@pytest.mark.asyncio
+async def test_token_invalidation(
+    config: Config, engine: AsyncEngine, factory: Factory
+) -> None:
+    data = await create_session_token(factory, scopes=["read:all"])
+    token_service = factory.create_token_service()
+
+    async with Factory.standalone(config, engine) as other_factory:
+        other_token_service = other_factory.create_token_service()
+        assert await other_token_service.get_data_cached(data.token)
+        other_cache = other_factory._context.token_data_cache
+        assert other_cache.get(data.token)
+
+        async with factory.session.begin():
+            assert await token_service.delete_token(
+                data.token.key,
+                data,
+                data.username,
+                ip_address="127.0.0.1",
+            )
+        await wait_for_eviction(other_factory, data)
+        assert await other_token_service.get_data_cached(data.token) is None
+
+
+@pytest.mark.asyncio
+async def test_user_invalidation(
+    config: Config, engine: AsyncEngine, factory: Factory
+) -> None:
+    data = await create_session_token(factory, username="some-user")
+
+    async with Factory.standalone(config, engine) as other_factory:
+        other_cache = other_factory._context.ldap_group_name_cache
+        other_cache.store("some-user", ["foo", "bar"])
+        other_token_service = other_factory.create_token_service()
+        assert await other_token_service.get_data_cached(data.token)
+
+        await factory._context.cache_invalidator.invalidate_user("some-user")
+        await wait_for_eviction(other_factory, data)
+        assert other_cache.get("some-user") is None
+
+
+@pytest.mark.asyncio
+async def test_lost_subscription(
+    config: Config, engine: AsyncEngine, factory: Factory
+) -> None:
+    async with Factory.standalone(config, engine) as other_factory:
+        context = other_factory._context
+        ldap_cache = context.ldap_group_name_cache
+        ldap_cache.store("some-user", ["foo", "bar"])
+        user_info_cache = context.user_info_cache
+        info = TokenUserInfo(username="some-user")
+        user_info_cache.store("some-key", (None,), info)
+
+        # Make processing the next event fail, which drops the subscription
+        # as if the connection to Redis had been lost.
+        invalidator = context.cache_invalidator
+
+        async def fail(message: dict[str, Any]) -> None:
+            raise RuntimeError("Simulated failure")
+
+        invalidator._process_message = fail  # type: ignore[method-assign]
+        await factory._context.cache_invalidator.invalidate_user("other-user")
+        for _ in range(50):
+            if ldap_cache.get("some-user") is None:
+                break
+            await asyncio.sleep(0.1)
+        assert ldap_cache.get("some-user") is None
+        assert user_info_cache.get("some-key", (None,)) is None
@@ -0,0 +1,25 @@
+"""Tests for the state cookie model."""
+
+from __future__ import annotations
+
+from gafaelfawr.config import Config
+from gafaelfawr.models.state import State
+from gafaelfawr.models.token import Token
+
+
+def test_from_cookie_cached(config: Config) -> None:
+    state = State(csrf="some-csrf", token=Token())
+    cookie = state.to_cookie()
+
+    first = State.from_cookie(cookie)
+    assert first == state
+
+    # Each call returns a separate copy, so modifying the result does not
+    # affect later parses of the same cookie.
+    first.csrf = "other-csrf"
+    second = State.from_cookie(cookie)
+    assert second == state
+    assert second is not first
+
+    # Invalid cookies still produce empty state.
+    assert State.from_cookie("invalid") == State()
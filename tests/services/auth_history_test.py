@@ -0,0 +1,122 @@
+"""Tests for recording the authentication history of tokens."""
+
+from __future__ import annotations
+
+from datetime import timedelta
+
+import pytest
+from safir.datetime import current_datetime
+from sqlalchemy.future import select
+
+from gafaelfawr.constants import (
+    AUTH_HISTORY_RETENTION,
+    AUTH_HISTORY_SCOPES_LENGTH,
+    AUTH_HISTORY_SERVICE_LENGTH,
+)
+from gafaelfawr.factory import Factory
+from gafaelfawr.models.history import TokenAuthHistoryEntry
+from gafaelfawr.models.token import TokenType
+from gafaelfawr.schema import TokenAuthHistory
+from gafaelfawr.services.auth_history import TokenAuthHistoryBuffer
+from gafaelfawr.storage.history import TokenAuthHistoryStore
+
+from ..support.history import make_auth_history_entry
+from ..support.tokens import create_session_token
+
+
+def test_buffer() -> None:
+    buffer = TokenAuthHistoryBuffer(3)
+    entries = [make_auth_history_entry(f"user{n}") for n in range(5)]
+    for entry in entries:
+        buffer.add(entry)
+    assert len(buffer) == 3
+    assert buffer.take_dropped() == 2
+    assert buffer.take_dropped() == 0
+
+    # Entries are taken oldest first, and entries that could not be written
+    # are put back at the front as long as there is room.
+    batch = buffer.take(2)
+    assert batch == entries[:2]
+    buffer.add(entries[3])
+    buffer.restore(batch)
+    assert buffer.take_dropped() == 1
+    assert buffer.take(10) == [entries[0], entries[2], entries[3]]
+    assert len(buffer) == 0
+
+
+@pytest.mark.asyncio
+async def test_writer(factory: Factory) -> None:
+    token_data = await create_session_token(factory, scopes=["read:all"])
+    token_service = factory.create_token_service()
+    buffer = factory.token_auth_history_buffer
+    assert buffer
+    buffer.record(
+        token_data,
+        scopes=["read:all"],
+        service="some-service",
+        ip_address="192.0.2.1",
+    )
+    writer = factory.create_token_auth_history_writer()
+    assert await writer.flush() == 1
+    assert await writer.flush() == 0
+
+    async with factory.session.begin():
+        result = await factory.session.scalars(select(TokenAuthHistory))
+        rows = result.all()
+    assert len(rows) == 1
+    entry = TokenAuthHistoryEntry.from_orm(rows[0])
+    assert entry.dict(exclude={"event_time"}) == {
+        "token": token_data.token.key,
+        "username": token_data.username,
+        "token_type": TokenType.session,
+        "scopes": ["read:all"],
+        "service": "some-service",
+        "ip_address": "192.0.2.1",
+    }
+    assert current_datetime() - entry.event_time < timedelta(seconds=5)
+
+    # Old entries are deleted by history truncation.
+    old = make_auth_history_entry("olduser")
+    old.event_time = current_datetime() - AUTH_HISTORY_RETENTION
+    old.event_time -= timedelta(days=1)
+    async with factory.session.begin():
+        await TokenAuthHistoryStore(factory.session).add_many([old])
+    async with factory.session.begin():
+        await token_service.truncate_history()
+    async with factory.session.begin():
+        result = await factory.session.scalars(select(TokenAuthHistory))
+        usernames = [r.username for r in result.all()]
+    assert usernames == [token_data.username]
+
+
+@pytest.mark.asyncio
+async def test_writer_invalid(factory: Factory) -> None:
+    token_data = await create_session_token(factory, scopes=["read:all"])
+    buffer = factory.token_auth_history_buffer
+    assert buffer
+
+    # Overlong values are truncated when recording authentications.
+    scopes = [f"read:scope-{n:04d}" for n in range(100)]
+    buffer.record(
+        token_data, scopes=scopes, service="s" * 100, ip_address="192.0.2.1"
+    )
+    entries = buffer.take(10)
+    assert len(entries) == 1
+    assert len(",".join(entries[0].scopes)) <= AUTH_HISTORY_SCOPES_LENGTH
+    assert entries[0].scopes == sorted(scopes)[: len(entries[0].scopes)]
+    assert entries[0].service == "s" * AUTH_HISTORY_SERVICE_LENGTH
+
+    # An entry that the database rejects is dropped rather than blocking the
+    # entries after it.
+    bad = make_auth_history_entry("baduser")
+    bad.service = "s" * 100
+    buffer.add(make_auth_history_entry("user1"))
+    buffer.add(bad)
+    buffer.add(make_auth_history_entry("user2"))
+    writer = factory.create_token_auth_history_writer()
+    await writer.flush()
+    assert len(buffer) == 0
+    async with factory.session.begin():
+        result = await factory.session.scalars(select(TokenAuthHistory))
+        usernames = sorted(r.username for r in result.all())
+    assert usernames == ["user1", "user2"]
@@ -0,0 +1,89 @@
+"""Tests for write-behind of token change history."""
+
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from gafaelfawr.factory import Factory
+from gafaelfawr.models.history import TokenChange
+from gafaelfawr.storage.history import (
+    HistoryCheckpointStore,
+    TokenChangeHistoryQueue,
+)
+
+from ..support.config import reconfigure
+from ..support.history import make_change_history_entry
+from ..support.tokens import create_session_token
+
+
+@pytest.mark.asyncio
+async def test_write_behind(tmp_path: Path, factory: Factory) -> None:
+    await reconfigure(tmp_path, "github", factory, historyWriteBehind="true")
+    token_data = await create_session_token(factory, scopes=["read:all"])
+    token_cache = factory.create_token_cache_service()
+    token = await token_cache.get_notebook_token(token_data, "127.0.0.1")
+
+    # The history entry is written by the background writer.
+    history_store = factory.create_token_change_history_store()
+    for _ in range(50):
+        async with factory.session.begin():
+            history = await history_store.list(token=token.key)
+        if history.entries:
+            break
+        await asyncio.sleep(0.1)
+    assert [e.action for e in history.entries] == [TokenChange.create]
+    assert history.entries[0].parent == token_data.token.key
+
+
+@pytest.mark.asyncio
+async def test_writer(factory: Factory) -> None:
+    queue = TokenChangeHistoryQueue(factory._context.redis)
+    entries = [make_change_history_entry(f"user{n}") for n in range(3)]
+    for entry in entries:
+        await queue.add(entry)
+    queued = await queue.read("0-0", 10)
+    assert [e for _, e in queued] == entries
+
+    # Simulate a process that wrote the first entry but died before removing
+    # it from the queue.  It must not be written again.
+    checkpoint_store = HistoryCheckpointStore(factory.session)
+    async with factory.session.begin():
+        await checkpoint_store.lock(queue.key)
+        await checkpoint_store.update(queue.key, queued[0][0])
+
+    writer = factory.create_token_change_history_writer()
+    assert await writer.flush() == 2
+    assert await writer.flush() == 0
+    assert await queue.read("0-0", 10) == []
+
+    history_store = factory.create_token_change_history_store()
+    async with factory.session.begin():
+        history = await history_store.list()
+    written = [e for e in history.entries if e.username.startswith("user")]
+    assert sorted(written, key=lambda e: e.username) == entries[1:]
+
+
+@pytest.mark.asyncio
+async def test_disable_write_behind(tmp_path: Path, factory: Factory) -> None:
+    await reconfigure(tmp_path, "github", factory, historyWriteBehind="true")
+    await reconfigure(tmp_path, "github", factory)
+    assert not factory._context.config.history_write_behind
+
+    # Entries left in the queue by processes that had write-behind enabled,
+    # but that stopped before writing them, are still written.
+    queue = TokenChangeHistoryQueue(factory._context.redis)
+    entries = [make_change_history_entry(f"user{n}") for n in range(3)]
+    await queue.add_many(entries)
+    history_store = factory.create_token_change_history_store()
+    for _ in range(50):
+        async with factory.session.begin():
+            history = await history_store.list()
+        written = [e for e in history.entries if e.username.startswith("user")]
+        if len(written) == len(entries):
+            break
+        await asyncio.sleep(0.1)
+    assert sorted(written, key=lambda e: e.username) == entries
+    assert await queue.is_empty()
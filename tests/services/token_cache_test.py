@@ -2,7 +2,9 @@
 
 from __future__ import annotations
 
+import asyncio
 from datetime import timedelta
+from pathlib import Path
 
 import pytest
 import structlog
@@ -14,6 +16,7 @@ from gafaelfawr.models.token import Token, TokenData, TokenType
 from gafaelfawr.storage.base import RedisStorage
 from gafaelfawr.storage.token import TokenRedisStore
 
+from ..support.config import reconfigure
 from ..support.tokens import create_session_token
 
 
@@ -72,18 +75,42 @@ async def test_basic(factory: Factory) -> None:
 
 
 @pytest.mark.asyncio
-async def test_invalid(factory: Factory) -> None:
-    """Invalid tokens should not be returned even if cached."""
+async def test_invalidation(config: Config, factory: Factory) -> None:
+    """Cache hits don't use Redis, and deleted tokens are evicted."""
     token_data = await create_session_token(factory, scopes=["read:all"])
+    token_service = factory.create_token_service()
     token_cache = factory.create_token_cache_service()
-    internal_token = Token()
-    notebook_token = Token()
+    async with factory.session.begin():
+        internal_token = await token_cache.get_internal_token(
+            token_data, "some-service", ["read:all"], "127.0.0.1"
+        )
+        notebook_token = await token_cache.get_notebook_token(
+            token_data, "127.0.0.1"
+        )
 
-    token_cache._internal_cache.store(
-        token_data, "some-service", ["read:all"], internal_token
+    # Remove the tokens from Redis without telling the cache.  The cache
+    # should still return them, since it doesn't check Redis.
+    logger = structlog.get_logger("gafaelfawr")
+    storage = RedisStorage(TokenData, config.session_secret, factory.redis)
+    token_store = TokenRedisStore(storage, logger)
+    await token_store.delete(internal_token.key, token_data.username)
+    await token_store.delete(notebook_token.key, token_data.username)
+    assert internal_token == await token_cache.get_internal_token(
+        token_data, "some-service", ["read:all"], "127.0.0.1"
+    )
+    assert notebook_token == await token_cache.get_notebook_token(
+        token_data, "127.0.0.1"
     )
-    token_cache._notebook_cache.store(token_data, notebook_token)
 
+    # Deleting the tokens through the token service evicts them.
+    async with factory.session.begin():
+        for token in (internal_token, notebook_token):
+            assert await token_service.delete_token(
+                token.key,
+                token_data,
+                token_data.username,
+                ip_address="127.0.0.1",
+            )
     async with factory.session.begin():
         assert internal_token != await token_cache.get_internal_token(
             token_data, "some-service", ["read:all"], "127.0.0.1"
@@ -119,7 +146,7 @@ async def test_expiration(config: Config, factory: Factory) -> None:
     )
     await token_store.store_data(internal_token_data)
     token_cache._internal_cache.store(
-        token_data, "some-service", ["read:all"], internal_token_data.token
+        token_data, "some-service", ["read:all"], internal_token_data
     )
 
     # The cache should return this token.
@@ -129,9 +156,12 @@ async def test_expiration(config: Config, factory: Factory) -> None:
 
     # Now change the expiration to be ten seconds earlier, which should make
     # the remaining lifetime less than half the total lifetime, and replace
-    # replace the stored token with that new version.
+    # the stored and cached token with that new version.
     internal_token_data.expires = expires - timedelta(seconds=20)
     await token_store.store_data(internal_token_data)
+    token_cache._internal_cache.store(
+        token_data, "some-service", ["read:all"], internal_token_data
+    )
 
     # The cache should now decline to return the token and generate a new one.
     old_token = internal_token_data.token
@@ -150,14 +180,174 @@ async def test_expiration(config: Config, factory: Factory) -> None:
         expires=expires,
     )
     await token_store.store_data(notebook_token_data)
-    token_cache._notebook_cache.store(token_data, notebook_token_data.token)
+    token_cache._notebook_cache.store(token_data, notebook_token_data)
     assert notebook_token_data.token == await token_cache.get_notebook_token(
         token_data, "127.0.0.1"
     )
     notebook_token_data.expires = expires - timedelta(seconds=20)
     await token_store.store_data(notebook_token_data)
+    token_cache._notebook_cache.store(token_data, notebook_token_data)
     old_token = notebook_token_data.token
     async with factory.session.begin():
         assert old_token != await token_cache.get_notebook_token(
             token_data, "127.0.0.1"
         )
+
+
+@pytest.mark.asyncio
+async def test_locking(factory: Factory) -> None:
+    """Only identical token requests wait for each other."""
+    token_data = await create_session_token(factory, scopes=["read:all"])
+    token_cache = factory.create_token_cache_service()
+    internal_cache = token_cache._internal_cache
+
+    async def get_token(service: str) -> Token:
+        async with factory.session.begin():
+            return await token_cache.get_internal_token(
+                token_data, service, ["read:all"], "127.0.0.1"
+            )
+
+    lock = internal_cache.lock_token(token_data, "some-service", ["read:all"])
+    async with lock:
+        other_token = await asyncio.wait_for(get_token("other-service"), 5)
+        async with factory.session.begin():
+            notebook_token = await asyncio.wait_for(
+                token_cache.get_notebook_token(token_data, "127.0.0.1"), 5
+            )
+        task = asyncio.create_task(get_token("some-service"))
+        await asyncio.sleep(0.1)
+        assert not task.done()
+    token = await task
+    assert token != other_token
+    assert token != notebook_token
+    assert token == await get_token("some-service")
+
+
+@pytest.mark.asyncio
+async def test_refresh(tmp_path: Path, factory: Factory) -> None:
+    """Tokens past the refresh threshold are replaced in the background."""
+    config = await reconfigure(
+        tmp_path, "github", factory, tokenRefreshThreshold="0.4"
+    )
+    token_data = await create_session_token(factory, scopes=["read:all"])
+    token_service = factory.create_token_service()
+    token_cache = factory.create_token_cache_service()
+    internal_cache = token_cache._internal_cache
+    notebook_cache = token_cache._notebook_cache
+
+    # Cache child tokens that are past the refresh threshold but not yet
+    # past half of their lifetime.
+    lifetime = config.token_lifetime
+    created = current_datetime() - lifetime * 0.45
+    internal_token_data = TokenData(
+        token=Token(),
+        username=token_data.username,
+        token_type=TokenType.internal,
+        scopes=["read:all"],
+        created=created,
+        expires=created + lifetime,
+    )
+    internal_cache.store(
+        token_data, "some-service", ["read:all"], internal_token_data
+    )
+    notebook_token_data = TokenData(
+        token=Token(),
+        username=token_data.username,
+        token_type=TokenType.notebook,
+        scopes=["read:all"],
+        created=created,
+        expires=created + lifetime,
+    )
+    notebook_cache.store(token_data, notebook_token_data)
+
+    # The cached tokens are still returned, but replacements are created.
+    assert internal_token_data.token == await token_cache.get_internal_token(
+        token_data, "some-service", ["read:all"], "127.0.0.1"
+    )
+    assert notebook_token_data.token == await token_cache.get_notebook_token(
+        token_data, "127.0.0.1"
+    )
+    refreshes = [
+        *internal_cache._refreshes.values(),
+        *notebook_cache._refreshes.values(),
+    ]
+    assert len(refreshes) == 2
+    await asyncio.gather(*refreshes)
+
+    internal_token = await token_cache.get_internal_token(
+        token_data, "some-service", ["read:all"], "127.0.0.1"
+    )
+    assert internal_token != internal_token_data.token
+    notebook_token = await token_cache.get_notebook_token(
+        token_data, "127.0.0.1"
+    )
+    assert notebook_token != notebook_token_data.token
+    assert internal_cache._refreshes == {}
+    assert notebook_cache._refreshes == {}
+
+    # The replacements were stored and expire later than the old tokens.
+    for token in (internal_token, notebook_token):
+        data = await token_service.get_data(token)
+        assert data
+        assert data.expires
+        assert data.expires > created + lifetime
+
+
+@pytest.mark.asyncio
+async def test_shared(
+    factory: Factory, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Child tokens are shared between processes through Redis."""
+    token_data = await create_session_token(factory, scopes=["read:all"])
+    token_service = factory.create_token_service()
+    token_cache = factory.create_token_cache_service()
+    async with factory.session.begin():
+        internal_token = await token_cache.get_internal_token(
+            token_data, "some-service", ["read:all"], "127.0.0.1"
+        )
+        notebook_token = await token_cache.get_notebook_token(
+            token_data, "127.0.0.1"
+        )
+
+    # Simulate another process by clearing the in-memory cache.  The tokens
+    # should be found without querying the database.
+    await token_cache.clear()
+    db_store = token_cache._token_db_store
+
+    async def fail(*args: object) -> None:
+        raise AssertionError("Unexpected database query")
+
+    with monkeypatch.context() as m:
+        m.setattr(db_store, "get_internal_token_key", fail)
+        m.setattr(db_store, "get_notebook_token_key", fail)
+        async with factory.session.begin():
+            assert internal_token == await token_cache.get_internal_token(
+                token_data, "some-service", ["read:all"], "127.0.0.1"
+            )
+            assert notebook_token == await token_cache.get_notebook_token(
+                token_data, "127.0.0.1"
+            )
+
+    # Tokens with different scopes are not reused.
+    async with factory.session.begin():
+        assert internal_token != await token_cache.get_internal_token(
+            token_data, "some-service", [], "127.0.0.1"
+        )
+
+    # Revoked tokens are not reused.
+    async with factory.session.begin():
+        for token in (internal_token, notebook_token):
+            assert await token_service.delete_token(
+                token.key,
+                token_data,
+                token_data.username,
+                ip_address="127.0.0.1",
+            )
+    await token_cache.clear()
+    async with factory.session.begin():
+        assert internal_token != await token_cache.get_internal_token(
+            token_data, "some-service", ["read:all"], "127.0.0.1"
+        )
+        assert notebook_token != await token_cache.get_notebook_token(
+            token_data, "127.0.0.1"
+        )
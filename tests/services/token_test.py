@@ -9,6 +9,7 @@ import pytest
 from cryptography.fernet import Fernet
 from pydantic import ValidationError
 from safir.datetime import current_datetime
+from sqlalchemy import delete
 
 from gafaelfawr.config import Config
 from gafaelfawr.constants import CHANGE_HISTORY_RETENTION
@@ -29,6 +30,7 @@ from gafaelfawr.models.token import (
     TokenUserInfo,
 )
 from gafaelfawr.schema.subtoken import Subtoken
+from gafaelfawr.schema.token_ancestor import TokenAncestor
 from gafaelfawr.storage.history import TokenChangeHistoryStore
 from gafaelfawr.storage.token import TokenDatabaseStore
 
@@ -1128,6 +1130,140 @@ async def test_delete_cascade(factory: Factory) -> None:
         assert await token_service.get_data(token) is None
 
 
+@pytest.mark.asyncio
+async def test_delete_user_tokens(factory: Factory) -> None:
+    token_service = factory.create_token_service()
+    token_db_store = TokenDatabaseStore(factory.session)
+    admin_token_data = await create_session_token(
+        factory, username="admin", scopes=["admin:token"]
+    )
+    session_token_data = await create_session_token(
+        factory, scopes=["read:all", "user:token"]
+    )
+    username = session_token_data.username
+    async with factory.session.begin():
+        user_token = await token_service.create_user_token(
+            session_token_data,
+            username,
+            token_name="some token",
+            scopes=["read:all"],
+            ip_address="127.0.0.1",
+        )
+        notebook_token = await token_service.get_notebook_token(
+            session_token_data, ip_address="127.0.0.1"
+        )
+    notebook_token_data = await token_service.get_data(notebook_token)
+    assert notebook_token_data
+    async with factory.session.begin():
+        internal_token = await token_service.get_internal_token(
+            notebook_token_data, "a-service", [], ip_address="127.0.0.1"
+        )
+    keys = {
+        session_token_data.token.key,
+        user_token.key,
+        notebook_token.key,
+        internal_token.key,
+    }
+
+    # Only token administrators may delete all tokens for a user.
+    with pytest.raises(PermissionDeniedError):
+        async with factory.session.begin():
+            await token_service.delete_user_tokens(
+                session_token_data, username, ip_address="127.0.0.1"
+            )
+
+    async with factory.session.begin():
+        count = await token_service.delete_user_tokens(
+            admin_token_data, username, ip_address="192.0.2.1"
+        )
+    assert count == 4
+    for token in (user_token, notebook_token, internal_token):
+        assert await token_service.get_data(token) is None
+    assert await token_service.get_data(session_token_data.token) is None
+    assert await token_service.get_data(admin_token_data.token)
+    async with factory.session.begin():
+        assert await token_db_store.list_tokens(username=username) == []
+        assert await token_db_store.get_info(admin_token_data.token.key)
+        history = await token_service.get_change_history(
+            admin_token_data, username=username
+        )
+    revoked = [e for e in history.entries if e.action == TokenChange.revoke]
+    assert {e.token for e in revoked} == keys
+    for entry in revoked:
+        assert entry.actor == "admin"
+        assert entry.ip_address == "192.0.2.1"
+    nested = next(e for e in revoked if e.token == internal_token.key)
+    assert nested.parent == notebook_token.key
+
+    # Deleting again finds nothing.
+    async with factory.session.begin():
+        count = await token_service.delete_user_tokens(
+            admin_token_data, username, ip_address="192.0.2.1"
+        )
+    assert count == 0
+
+
+@pytest.mark.asyncio
+async def test_token_ancestry(factory: Factory) -> None:
+    """Test that subtokens are found at any depth."""
+    token_service = factory.create_token_service()
+    token_db_store = TokenDatabaseStore(factory.session)
+    session_token_data = await create_session_token(factory)
+    async with factory.session.begin():
+        notebook_token = await token_service.get_notebook_token(
+            session_token_data, ip_address="127.0.0.1"
+        )
+        internal_token = await token_service.get_internal_token(
+            session_token_data, "a-service", [], ip_address="127.0.0.1"
+        )
+    notebook_token_data = await token_service.get_data(notebook_token)
+    assert notebook_token_data
+    async with factory.session.begin():
+        nested_token = await token_service.get_internal_token(
+            notebook_token_data, "b-service", [], ip_address="127.0.0.1"
+        )
+    session_key = session_token_data.token.key
+
+    # Children are returned with the direct children first.
+    async with factory.session.begin():
+        children = await token_db_store.get_children(session_key)
+        assert sorted(children[:2]) == sorted(
+            [notebook_token.key, internal_token.key]
+        )
+        assert children[2:] == [nested_token.key]
+        history = await token_service.get_change_history(
+            session_token_data,
+            username=session_token_data.username,
+            key=session_key,
+        )
+    assert {e.token for e in history.entries} == {
+        session_key,
+        notebook_token.key,
+        internal_token.key,
+        nested_token.key,
+    }
+
+    # Entries for tokens created before the closure was maintained can be
+    # recreated from the parent relationships.
+    async with factory.session.begin():
+        await factory.session.execute(delete(TokenAncestor))
+        assert await token_db_store.get_children(session_key) == []
+        assert await token_db_store.add_missing_ancestors() == 4
+        assert await token_db_store.add_missing_ancestors() == 0
+        children = await token_db_store.get_children(session_key)
+        assert children[2:] == [nested_token.key]
+
+    # Deleting a token in the middle of the tree orphans its children, so
+    # they are no longer children of its parent.
+    async with factory.session.begin():
+        assert await token_db_store.delete(notebook_token.key)
+        children = await token_db_store.get_children(session_key)
+        assert children == [internal_token.key]
+        assert await token_db_store.get_children(nested_token.key) == []
+        orphaned = await token_db_store.list_orphaned()
+        assert [t.token for t in orphaned] == [nested_token.key]
+
+
 @pytest.mark.asyncio
 async def test_modify_expires(config: Config, factory: Factory) -> None:
     """Test that expiration changes cascade to subtokens."""
@@ -1204,6 +1340,94 @@ async def test_modify_expires(config: Config, factory: Factory) -> None:
         assert ttl - 5 <= await factory.redis.ttl(f"token:{token.key}") <= ttl
 
 
+@pytest.mark.asyncio
+async def test_get_data_cached(factory: Factory) -> None:
+    data = await create_session_token(factory, scopes=["read:all"])
+    admin_data = await create_session_token(
+        factory, username="admin", scopes=["admin:token"]
+    )
+    token_service = factory.create_token_service()
+    async with factory.session.begin():
+        token = await token_service.create_user_token(
+            data,
+            data.username,
+            token_name="some token",
+            scopes=["read:all"],
+            ip_address="127.0.0.1",
+        )
+    user_data = await token_service.get_data_cached(token)
+    assert user_data == await token_service.get_data(token)
+
+    # Changes made directly in Redis are not seen until the cache entry is
+    # invalidated, but uncached lookups see them immediately.
+    assert user_data
+    user_data.scopes = []
+    await token_service._token_redis_store.store_data(user_data)
+    cached_data = await token_service.get_data_cached(token)
+    assert cached_data and cached_data.scopes == ["read:all"]
+    redis_data = await token_service.get_data(token)
+    assert redis_data and redis_data.scopes == []
+
+    # The secret must still match.
+    bad_token = Token(key=token.key, secret=Token().secret)
+    assert await token_service.get_data_cached(bad_token) is None
+
+    # Modifying or deleting the token through the token service invalidates
+    # the cache.
+    async with factory.session.begin():
+        await token_service.modify_token(
+            token.key,
+            admin_data,
+            ip_address="127.0.0.1",
+            scopes=["read:all"],
+        )
+    cached_data = await token_service.get_data_cached(token)
+    assert cached_data and cached_data.scopes == ["read:all"]
+    async with factory.session.begin():
+        assert await token_service.delete_token(
+            token.key, data, data.username, ip_address="127.0.0.1"
+        )
+    assert await token_service.get_data_cached(token) is None
+
+
+@pytest.mark.asyncio
+async def test_get_data_cached_missing(factory: Factory) -> None:
+    data = await create_session_token(factory, scopes=["read:all"])
+    token_service = factory.create_token_service()
+    redis_store = token_service._token_redis_store
+
+    # A missing key is remembered, so data that later appears in Redis
+    # without going through the token service is not seen.
+    await redis_store.delete(data.token.key, data.username)
+    assert await token_service.get_data_cached(data.token) is None
+    await redis_store.store_data(data)
+    assert await token_service.get_data_cached(data.token) is None
+    assert await token_service.get_data(data.token) == data
+    missing_cache = factory._context.missing_token_cache
+    assert missing_cache.statistics("missing_token").size == 1
+    assert missing_cache.statistics("missing_token").hits == 1
+    await missing_cache.clear()
+    assert await token_service.get_data_cached(data.token) == data
+
+    # A secret mismatch must not cause the key to be remembered as missing.
+    other_data = await create_session_token(factory, scopes=["read:all"])
+    await factory._context.token_data_cache.clear()
+    bad_token = Token(key=other_data.token.key, secret=Token().secret)
+    assert await token_service.get_data_cached(bad_token) is None
+    assert await token_service.get_data_cached(other_data.token) == other_data
+
+    # Nor may data that cannot be decrypted, so that the token can be used
+    # again once the data is fixed.
+    await factory._context.token_data_cache.clear()
+    key = f"token:{other_data.token.key}"
+    value = await factory.redis.get(key)
+    assert value
+    await factory.redis.set(key, b"invalid")
+    assert await token_service.get_data_cached(other_data.token) is None
+    await factory.redis.set(key, value)
+    assert await token_service.get_data_cached(other_data.token) == other_data
+
+
 @pytest.mark.asyncio
 async def test_invalid(config: Config, factory: Factory) -> None:
     token_service = factory.create_token_service()
@@ -1417,6 +1641,19 @@ async def test_expire_tokens(factory: Factory) -> None:
         )
         await token_store.add(service_token_data)
 
+    # The index of the user's tokens in Redis still contains the keys of the
+    # expired tokens, which should be removed from it.
+    token_redis_store = token_service._token_redis_store
+    await token_redis_store.store_data(unexpired_user_token_data)
+    await factory.redis.sadd(
+        "user-tokens:some-user",
+        f"token:{session_token_data.token.key}",
+        f"token:{user_token_data.token.key}",
+    )
+    await factory.redis.sadd(
+        "user-tokens:bot-service", f"token:{service_token_data.token.key}"
+    )
+
     # Run the expiration.
     async with factory.session.begin():
         await token_service.expire_tokens()
@@ -1468,6 +1705,16 @@ async def test_expire_tokens(factory: Factory) -> None:
             expires=unexpired_user_token_data.expires,
         )
 
+    # Only the unexpired token should remain in the indexes.
+    indexes = await token_redis_store.list_for_users(
+        ["some-user", "bot-service"]
+    )
+    assert indexes == {
+        "some-user": {unexpired_user_token_data.token.key},
+        "bot-service": set(),
+    }
+    assert await factory.redis.exists("user-tokens:bot-service") == 0
+
 
 @pytest.mark.asyncio
 async def test_truncate_history(factory: Factory) -> None:
@@ -1611,6 +1858,41 @@ async def test_audit(factory: Factory) -> None:
     async with factory.session.begin():
         await token_db_store.add(unknown_scope_token_data)
 
+    # Add a token that is missing from the user's token index, as if it had
+    # been created by an older version of Gafaelfawr.
+    unindexed_token_data = TokenData(
+        token=Token(),
+        username="some-user",
+        token_type=TokenType.session,
+        scopes=["user:token"],
+        created=now,
+        expires=now + timedelta(days=7),
+    )
+    key = f"token:{unindexed_token_data.token.key}"
+    lifetime = int(timedelta(days=7).total_seconds())
+    await token_redis_store._storage.store(key, unindexed_token_data, lifetime)
+    async with factory.session.begin():
+        await token_db_store.add(unindexed_token_data)
+
+    # Add a child token recorded only in the subtoken table, as if it had
+    # been created by an older version of Gafaelfawr during an upgrade.
+    legacy_token_data = TokenData(
+        token=Token(),
+        username="some-user",
+        token_type=TokenType.internal,
+        scopes=[],
+        created=now,
+        expires=db_user_token_data.expires,
+    )
+    await token_redis_store.store_data(legacy_token_data)
+    async with factory.session.begin():
+        await token_db_store.add(legacy_token_data, service="other-service")
+        subtoken = Subtoken(
+            parent=db_user_token_data.token.key,
+            child=legacy_token_data.token.key,
+        )
+        factory.session.add(subtoken)
+
     # A token that has expired shouldn't result in warnings about it missing
     # from Redis.
     expired_token_data = TokenData(
@@ -1641,6 +1923,10 @@ async def test_audit(factory: Factory) -> None:
         " no parent token",
         f"Token `{unknown_scope_token_data.token.key}` for `some-user`"
         " has unknown scope (`bogus:scope`)",
+        f"Token `{unindexed_token_data.token.key}` for `some-user` missing"
+        " from user token index",
+        f"Token `{legacy_token_data.token.key}` for `some-user` missing"
+        " from token ancestry",
     ]
     assert sorted(alerts) == sorted(expected)
 
@@ -1649,12 +1935,21 @@ async def test_audit(factory: Factory) -> None:
         alerts = await token_service.audit(fix=True)
     expected[0] += " (fixed)"
     expected[1] += " (fixed)"
+    expected[6] += " (fixed)"
+    expected[7] += " (fixed)"
     expected[2] = (
         f"Token `{db_user_token_data.token.key}` for `some-user` does"
         " not match between database and Redis (scopes [fixed], created)"
     )
     assert sorted(alerts) == sorted(expected)
 
+    # The child token should now be found as a child of its parent.
+    async with factory.session.begin():
+        children = await token_db_store.get_children(
+            db_user_token_data.token.key
+        )
+    assert legacy_token_data.token.key in children
+
     # Remove expired tokens from the database, since a token present in the
     # database and not in Redis is addressed by expiring it.
     async with factory.session.begin():
@@ -1663,7 +1958,7 @@ async def test_audit(factory: Factory) -> None:
     # Run the audit again, which should show fewer issues.
     async with factory.session.begin():
         alerts = await token_service.audit()
-    expected = expected[2:]
+    expected = expected[2:6]
     expected[0] = (
         f"Token `{db_user_token_data.token.key}` for `some-user` does"
         " not match between database and Redis (created)"
@@ -0,0 +1,77 @@
+"""Tests for recording the last-used times of tokens."""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from safir.datetime import current_datetime
+
+from gafaelfawr.factory import Factory
+from gafaelfawr.models.token import Token
+from gafaelfawr.services.token_usage import TokenUsageTracker
+from gafaelfawr.storage.token import TokenDatabaseStore
+
+from ..support.tokens import create_session_token
+
+
+def test_tracker() -> None:
+    tracker = TokenUsageTracker()
+    key = Token().key
+    other_key = Token().key
+    now = datetime(2023, 4, 1, 12, 30, 45, tzinfo=timezone.utc)
+    minute = now.replace(second=0)
+
+    # Pin the current time so that the uses are not split across a minute
+    # boundary.
+    with patch("gafaelfawr.services.token_usage.current_datetime") as mock:
+        mock.return_value = now
+        tracker.record(key)
+        tracker.record(key)
+        assert tracker.take() == {key: minute}
+        assert tracker.take() == {}
+
+        # Restored times do not override times recorded since they were
+        # taken.
+        tracker.record(key)
+        earlier = tracker.take()[key] - timedelta(minutes=5)
+        tracker.record(key)
+        tracker.restore({key: earlier, other_key: earlier})
+        assert tracker.take() == {key: minute, other_key: earlier}
+
+
+@pytest.mark.asyncio
+async def test_last_used(factory: Factory) -> None:
+    token_data = await create_session_token(factory)
+    token = token_data.token
+    token_service = factory.create_token_service()
+    async with factory.session.begin():
+        info = await token_service.get_token_info_unchecked(token.key)
+    assert info
+    assert info.last_used is None
+
+    # Authenticating with the token records its use, which is written by the
+    # writer in one update.
+    assert await token_service.get_data_cached(token)
+    assert await token_service.get_data_cached(token)
+    writer = factory.create_token_usage_writer()
+    assert await writer.flush() == 1
+    assert await writer.flush() == 0
+    async with factory.session.begin():
+        info = await token_service.get_token_info_unchecked(token.key)
+    assert info
+    assert info.last_used
+    assert info.last_used <= current_datetime()
+    assert current_datetime() - info.last_used < timedelta(minutes=2)
+
+    # An older time, such as one from a process that was slow to write, does
+    # not replace a newer one.
+    last_used = info.last_used
+    token_db_store = TokenDatabaseStore(factory.session)
+    async with factory.session.begin():
+        older = {token.key: last_used - timedelta(hours=1)}
+        assert await token_db_store.update_last_used(older) == 0
+        info = await token_service.get_token_info_unchecked(token.key)
+    assert info
+    assert info.last_used == last_used
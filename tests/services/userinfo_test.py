@@ -4,6 +4,7 @@ from __future__ import annotations
 
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from unittest.mock import patch
 
 import pytest
 
@@ -13,8 +14,11 @@ from gafaelfawr.exceptions import (
 )
 from gafaelfawr.factory import Factory
 from gafaelfawr.models.oidc import OIDCVerifiedToken
+from gafaelfawr.models.token import NotebookQuota, Quota
 
 from ..support.config import reconfigure
+from ..support.ldap import MockLDAP
+from ..support.tokens import create_session_token
 
 
 @pytest.mark.asyncio
@@ -46,3 +50,145 @@ async def test_missing_token_data(tmp_path: Path, factory: Factory) -> None:
         await user_info.get_user_info_from_oidc_token(token)
     expected = f"No {config.oidc.uid_claim} claim in token"
     assert str(excinfo_uid.value) == expected
+
+
+@pytest.mark.asyncio
+async def test_get_email_from_token(
+    tmp_path: Path, factory: Factory, mock_ldap: MockLDAP
+) -> None:
+    config = await reconfigure(tmp_path, "oidc-ldap", factory)
+    assert config.ldap
+    assert config.ldap.user_base_dn
+    mock_ldap.add_entries_for_test(
+        config.ldap.user_base_dn,
+        config.ldap.user_search_attr,
+        "ldap-user",
+        [{"displayName": ["LDAP User"], "mail": ["ldap-user@example.com"]}],
+    )
+    mock_ldap.add_entries_for_test(
+        config.ldap.group_base_dn,
+        "member",
+        "ldap-user",
+        [{"cn": ["foo"], "gidNumber": ["1222"]}],
+    )
+    user_info_service = factory.create_user_info_service()
+
+    # Only the user entry should be retrieved, not group membership.
+    token_data = await create_session_token(
+        factory, username="ldap-user", minimal=True
+    )
+    with patch.object(mock_ldap, "search", wraps=mock_ldap.search) as search:
+        email = await user_info_service.get_email_from_token(token_data)
+    assert email == "ldap-user@example.com"
+    assert search.call_args_list
+    for call in search.call_args_list:
+        assert call.kwargs["base"] == config.ldap.user_base_dn
+
+    # Email stored with the token takes precedence.
+    token_data.email = "other@example.com"
+    email = await user_info_service.get_email_from_token(token_data)
+    assert email == "other@example.com"
+
+
+@pytest.mark.asyncio
+async def test_user_info_cached(
+    tmp_path: Path, factory: Factory, mock_ldap: MockLDAP
+) -> None:
+    config = await reconfigure(tmp_path, "oidc-ldap", factory)
+    assert config.ldap
+    assert config.ldap.user_base_dn
+    mock_ldap.add_entries_for_test(
+        config.ldap.user_base_dn,
+        config.ldap.user_search_attr,
+        "ldap-user",
+        [{"displayName": ["LDAP User"], "mail": ["ldap-user@example.com"]}],
+    )
+    mock_ldap.add_entries_for_test(
+        config.ldap.group_base_dn,
+        "member",
+        "ldap-user",
+        [{"cn": ["foo"], "gidNumber": ["1222"]}],
+    )
+    user_info_service = factory.create_user_info_service()
+    token_data = await create_session_token(
+        factory, username="ldap-user", minimal=True
+    )
+
+    # The second call should be answered from the cache without assembling
+    # the user information again.
+    with patch.object(
+        user_info_service,
+        "_build_user_info",
+        wraps=user_info_service._build_user_info,
+    ) as build:
+        user_info = await user_info_service.get_user_info_from_token(
+            token_data
+        )
+        assert (
+            await user_info_service.get_user_info_from_token(token_data)
+            == user_info
+        )
+    assert build.call_count == 1
+    assert user_info.groups
+    assert [g.name for g in user_info.groups] == ["foo"]
+
+    # Changes to LDAP are not seen until the LDAP cache is invalidated, at
+    # which point the cached user information is also discarded.
+    mock_ldap.add_entries_for_test(
+        config.ldap.group_base_dn,
+        "member",
+        "ldap-user",
+        [
+            {"cn": ["foo"], "gidNumber": ["1222"]},
+            {"cn": ["bar"], "gidNumber": ["1223"]},
+        ],
+    )
+    user_info = await user_info_service.get_user_info_from_token(token_data)
+    assert user_info.groups
+    assert [g.name for g in user_info.groups] == ["foo"]
+    await user_info_service.invalidate_cache("ldap-user")
+    user_info = await user_info_service.get_user_info_from_token(token_data)
+    assert user_info.groups
+    assert [g.name for g in user_info.groups] == ["bar", "foo"]
+
+
+@pytest.mark.asyncio
+async def test_quota_cached(tmp_path: Path, factory: Factory) -> None:
+    await reconfigure(tmp_path, "github-quota", factory)
+    user_info_service = factory.create_user_info_service()
+    expected = Quota(
+        api={"datalinker": 1000},
+        notebook=NotebookQuota(cpu=8.0, memory=8.0),
+    )
+
+    # Groups without quota grants do not affect the quota or the cache key,
+    # so both tokens should get the same quota from a single calculation.
+    token_data = await create_session_token(factory, group_names=["foo"])
+    other_data = await create_session_token(
+        factory, group_names=["foo", "other"]
+    )
+    with patch.object(
+        user_info_service,
+        "_build_quota",
+        wraps=user_info_service._build_quota,
+    ) as build:
+        user_info = await user_info_service.get_user_info_from_token(
+            token_data
+        )
+        assert user_info.quota == expected
+        user_info = await user_info_service.get_user_info_from_token(
+            other_data
+        )
+        assert user_info.quota == expected
+    assert build.call_count == 1
+
+    # Modifying the returned quota must not modify the cached quota.
+    assert user_info.quota
+    assert user_info.quota.notebook
+    user_info.quota.notebook.cpu = 1.0
+    user_info.quota.api["datalinker"] = 1
+    token_data = await create_session_token(
+        factory, group_names=["foo", "another"]
+    )
+    user_info = await user_info_service.get_user_info_from_token(token_data)
+    assert user_info.quota == expected
@@ -0,0 +1,167 @@
+"""Tests for the base Redis storage layer."""
+
+from __future__ import annotations
+
+from unittest.mock import patch
+
+import pytest
+from cryptography.fernet import Fernet
+from safir.datetime import current_datetime
+
+from gafaelfawr.config import Config
+from gafaelfawr.exceptions import DeserializeError
+from gafaelfawr.factory import Factory
+from gafaelfawr.models.token import Token, TokenData, TokenGroup, TokenType
+from gafaelfawr.storage.base import RedisStorage
+
+
+def make_token_data() -> TokenData:
+    return TokenData(
+        token=Token(),
+        username="example",
+        token_type=TokenType.session,
+        scopes=["read:all", "user:token"],
+        created=current_datetime(),
+        name="Example Person",
+        uid=12345,
+        groups=[TokenGroup(name=f"group-{i}", id=1000 + i) for i in range(10)],
+    )
+
+
+@pytest.mark.asyncio
+async def test_store(config: Config, factory: Factory) -> None:
+    storage = RedisStorage(
+        TokenData, config.session_secret, factory.redis, aes_gcm=True
+    )
+    data = make_token_data()
+    key = f"token:{data.token.key}"
+
+    await storage.store(key, data, None)
+    assert await storage.get(key) == data
+
+    # The stored value is binary, is not a Fernet token, and does not contain
+    # the serialized data in the clear.
+    value = await factory.redis.get(key)
+    assert value
+    assert b"example" not in value
+    fernet = Fernet(config.session_secret.encode())
+    with pytest.raises(Exception):
+        fernet.decrypt(value)
+
+    # The value cannot be copied to a different key.
+    other_key = f"token:{Token().key}"
+    await factory.redis.set(other_key, value)
+    with pytest.raises(DeserializeError):
+        await storage.get(other_key)
+
+    # The value cannot be modified.
+    tampered = value[:-1] + bytes([value[-1] ^ 1])
+    await factory.redis.set(key, tampered)
+    with pytest.raises(DeserializeError):
+        await storage.get(key)
+
+
+@pytest.mark.asyncio
+async def test_legacy_format(config: Config, factory: Factory) -> None:
+    storage = RedisStorage(TokenData, config.session_secret, factory.redis)
+    aes_gcm_storage = RedisStorage(
+        TokenData, config.session_secret, factory.redis, aes_gcm=True
+    )
+    data = make_token_data()
+    key = f"token:{data.token.key}"
+
+    # By default, values are stored as Fernet tokens, which older versions
+    # of Gafaelfawr can read, but values in either format can be read.
+    fernet = Fernet(config.session_secret.encode())
+    await storage.store(key, data, None)
+    value = await factory.redis.get(key)
+    assert value
+    assert data.parse_raw(fernet.decrypt(value)) == data
+    assert await aes_gcm_storage.get(key) == data
+
+    # Storing the object with AES-GCM enabled replaces it with that format,
+    # which can still be read when AES-GCM is not enabled.
+    await aes_gcm_storage.store(key, data, None)
+    value = await factory.redis.get(key)
+    assert value
+    assert not value.startswith(b"gAAAAA")
+    assert await aes_gcm_storage.get(key) == data
+    assert await storage.get(key) == data
+
+
+@pytest.mark.asyncio
+async def test_bulk(config: Config, factory: Factory) -> None:
+    storage = RedisStorage(TokenData, config.session_secret, factory.redis)
+    tokens = [make_token_data() for _ in range(7)]
+    keys = [f"token:{t.token.key}" for t in tokens]
+
+    # Use a small batch size so that multiple batches are exercised.
+    with patch("gafaelfawr.storage.base.REDIS_BATCH_SIZE", 3):
+        await storage.store_many(
+            (k, t, 60, None) for k, t in zip(keys, tokens)
+        )
+        for key in keys:
+            assert 0 < await factory.redis.ttl(key) <= 60
+
+        # Missing keys are omitted and invalid entries are reported as
+        # errors without affecting the other entries.
+        await factory.redis.set(keys[0], b"invalid")
+        missing = f"token:{Token().key}"
+        results = await storage.get_many([*keys, missing])
+        assert set(results.keys()) == set(keys)
+        assert isinstance(results[keys[0]], DeserializeError)
+        for key, data in zip(keys[1:], tokens[1:]):
+            assert results[key] == data
+
+        assert await storage.delete_many([*keys[:4], missing]) == 4
+        assert await storage.get_many(keys) == {
+            k: t for k, t in zip(keys[4:], tokens[4:])
+        }
+        await storage.delete_all("token:*")
+        assert await storage.get_many(keys) == {}
+
+
+@pytest.mark.asyncio
+async def test_index(config: Config, factory: Factory) -> None:
+    storage = RedisStorage(TokenData, config.session_secret, factory.redis)
+    tokens = [make_token_data() for _ in range(3)]
+    keys = [f"token:{t.token.key}" for t in tokens]
+    index = "user-tokens:example"
+
+    # The index expires with the longest-lived object in it.
+    await storage.store(keys[0], tokens[0], 60, index=index)
+    assert 0 < await factory.redis.ttl(index) <= 60
+    await storage.store(keys[1], tokens[1], 600, index=index)
+    assert 60 < await factory.redis.ttl(index) <= 600
+    await storage.store(keys[0], tokens[0], 60, index=index)
+    assert 60 < await factory.redis.ttl(index) <= 600
+    assert sorted(await storage.get_index(index)) == sorted(keys[:2])
+
+    # An object that does not expire makes the index permanent.
+    await storage.store_many([(keys[2], tokens[2], None, index)])
+    assert await factory.redis.ttl(index) == -1
+    await storage.store(keys[0], tokens[0], 60, index=index)
+    assert await factory.redis.ttl(index) == -1
+    assert sorted(await storage.get_index(index)) == sorted(keys)
+
+    # Deleting an object removes it from the index.
+    assert await storage.delete(keys[0], index=index)
+    assert await storage.delete_many(keys[1:2], index=index) == 1
+    assert await storage.get_index_many([index, "user-tokens:other"]) == {
+        index: [keys[2]],
+        "user-tokens:other": [],
+    }
+
+    # Pruning the index removes the keys of objects that no longer exist.
+    await factory.redis.sadd(index, keys[0], keys[1])
+    assert await storage.prune_index(index) == 2
+    assert await storage.get_index(index) == [keys[2]]
+    assert await storage.prune_index(index) == 0
+
+    # Deleting the index deletes all the objects in it.
+    await storage.store(keys[0], tokens[0], 60, index=index)
+    assert sorted(await storage.delete_index(index)) == sorted(
+        [keys[0], keys[2]]
+    )
+    assert await storage.get_many(keys) == {}
+    assert await factory.redis.exists(index) == 0
@@ -0,0 +1,61 @@
+"""Create history entries for testing."""
+
+from __future__ import annotations
+
+from gafaelfawr.models.history import (
+    TokenAuthHistoryEntry,
+    TokenChange,
+    TokenChangeHistoryEntry,
+)
+from gafaelfawr.models.token import Token, TokenType
+
+__all__ = [
+    "make_auth_history_entry",
+    "make_change_history_entry",
+]
+
+
+def make_auth_history_entry(username: str) -> TokenAuthHistoryEntry:
+    """Create an authentication history entry for a new session token.
+
+    Parameters
+    ----------
+    username
+        Owner of the token.
+
+    Returns
+    -------
+    TokenAuthHistoryEntry
+        The new history entry.
+    """
+    return TokenAuthHistoryEntry(
+        token=Token().key,
+        username=username,
+        token_type=TokenType.session,
+        scopes=["read:all"],
+        ip_address="127.0.0.1",
+    )
+
+
+def make_change_history_entry(username: str) -> TokenChangeHistoryEntry:
+    """Create a token change history entry for a new session token.
+
+    Parameters
+    ----------
+    username
+        Owner of the token, who is also recorded as the actor.
+
+    Returns
+    -------
+    TokenChangeHistoryEntry
+        The new history entry.
+    """
+    return TokenChangeHistoryEntry(
+        token=Token().key,
+        username=username,
+        token_type=TokenType.session,
+        scopes=["read:all"],
+        actor=username,
+        action=TokenChange.create,
+        ip_address="127.0.0.1",
+    )